@@ -3,9 +3,9 @@ import json
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext, font
 import socket
+import selectors
 import threading
 
-import datetime
 import pyaudio
 import time
 import numpy as np
@@ -20,11 +20,78 @@ from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
 import struct
 import math
+import random
+from protocol import (DatagramReader, ReorderBuffer, FecDecoder, NackTracker, nack_message,
+                      FRAME_AUDIO, FRAME_JSON, FRAME_FEC)
+from audio_codecs import get_codec, PcmCodec
 
 CERT_FILE = 'PyWavesClientCert.pem'
 SAVE_FILE = "user_data.txt"
 LOGINPORT = 12346
+STREAMPORT = 12345
+LOGIN_ATTEMPTS = 3
 BUFFER_SIZE = 1024
+# Most packets the reorder buffer holds: an FEC group of up to 32, plus 2
+MAX_REORDER_DEPTH = 34
+
+# Stream quality choices: codec name sent to the server ("" = server default)
+QUALITY_OPTIONS = {
+    "Server default": "",
+    "Uncompressed": "pcm",
+    "Lossless": "rice",
+    "Reduced (mu-law)": "mulaw",
+    "Low bandwidth (ADPCM)": "adpcm",
+}
+
+# Latency profiles offered by the server ("" = server default)
+LATENCY_OPTIONS = {
+    "Server default": "",
+    "Low latency": "low-latency",
+    "Efficient": "efficient",
+}
+
+
+# One TLS context for every login request, and the last session with each
+# login server, so logging in again resumes it instead of a full handshake
+login_context = None
+login_sessions = {}
+login_lock = threading.Lock()
+
+
+def split_station_address(address):
+    """Split "host" or "host:port" into the server host and the station's stream port"""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address, STREAMPORT
+
+
+def get_login_context():
+    global login_context
+    with login_lock:
+        if login_context is None:
+            login_context = ssl.create_default_context()
+            login_context.check_hostname = False
+            login_context.verify_mode = ssl.CERT_REQUIRED
+            login_context.load_verify_locations(CERT_FILE)
+    return login_context
+
+
+def send_login_request(ip, port, data_dict):
+    """Send one JSON request to the login server and return its (JSON-decoded if possible) reply"""
+    context = get_login_context()
+    with socket.create_connection((ip, port), timeout=5) as sock:
+        with context.wrap_socket(sock, server_hostname=ip, session=login_sessions.get((ip, port))) as ssock:
+            ssock.sendall(json.dumps(data_dict).encode('utf-8'))
+            response = ssock.recv(BUFFER_SIZE).decode('utf-8').strip()
+            # TLS 1.3 tickets arrive after the handshake, so take the session once the reply is in
+            if ssock.session is not None:
+                login_sessions[(ip, port)] = ssock.session
+
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError:
+        return response
 
 
 class ModernLoginDialog(tk.Tk):
@@ -59,12 +126,6 @@ class ModernLoginDialog(tk.Tk):
         self.load_saved_data()
         self.create_modern_ui()
 
-        # SSL context
-        self.context = ssl.create_default_context()
-        self.context.check_hostname = False
-        self.context.verify_mode = ssl.CERT_REQUIRED
-        self.context.load_verify_locations(CERT_FILE)
-
     def create_modern_ui(self):
         # Main container
         main_frame = tk.Frame(self, bg=self.colors['bg'])
@@ -243,7 +304,8 @@ class ModernLoginDialog(tk.Tk):
         }
 
         try:
-            response = self.send_tcp_message(ip, LOGINPORT, message)
+            # Every station on a server shares its login port
+            response = self.send_tcp_message(split_station_address(ip)[0], LOGINPORT, message)
 
             if isinstance(response, dict) and response.get("status") == "success":
                 self.token = response.get("token")
@@ -251,24 +313,19 @@ class ModernLoginDialog(tk.Tk):
                 self.key = response.get("key")
                 self.save_user_data(user, pw, ip, self.token)
                 self.destroy()
-                open_main_app(user, pw, ip, self.token, self.index, self.key)
+                open_main_app(user, pw, ip, self.token, self.index, self.key, response.get("refresh"))
+            elif isinstance(response, dict) and response.get("status") == "busy":
+                messagebox.showwarning("Server Busy", "The server is handling many logins. Please try again "
+                                                      f"in {response.get('retry_after', 1)} seconds.")
             elif response == "already exists":
                 messagebox.showerror("Register Failed", "User already exists.")
             else:
                 messagebox.showerror("Authentication Failed", "Invalid username or password.")
         except Exception as e:
-            messagebox.showerror("Connection Error", f"Could not connect to server at {ip}:{LOGINPORT}")
+            messagebox.showerror("Connection Error", f"Could not connect to server at {split_station_address(ip)[0]}:{LOGINPORT}")
 
     def send_tcp_message(self, ip, port, data_dict):
-        with socket.create_connection((ip, port), timeout=5) as sock:
-            with self.context.wrap_socket(sock, server_hostname=ip) as ssock:
-                ssock.sendall(json.dumps(data_dict).encode('utf-8'))
-                response = ssock.recv(BUFFER_SIZE).decode('utf-8').strip()
-
-                try:
-                    return json.loads(response)
-                except json.JSONDecodeError:
-                    return response
+        return send_login_request(ip, port, data_dict)
 
     def save_user_data(self, username, password, ip, token):
         with open(SAVE_FILE, "w") as f:
@@ -290,13 +347,16 @@ class ModernLoginDialog(tk.Tk):
 
 
 class ModernRadioClient:
-    def __init__(self, root, server_ip, token, index, key, username, password):
+    def __init__(self, root, server_ip, token, index, key, username, password, refresh=None):
         self.token = token
         self.index = index
         self.key = key
+        # Swapped for a new session when the token expires, so the server skips bcrypt
+        self.refresh = refresh
         self.username = username
         self.password = password
-        self.server_ip = server_ip
+        # "host:port" selects a station other than the one on STREAMPORT
+        self.server_ip, self.port = split_station_address(server_ip)
         self.conn_status = None
         self.root = root
         self.root.title("PyWaves Radio")
@@ -322,24 +382,39 @@ class ModernRadioClient:
         self.root.configure(bg=self.colors['bg'])
 
         # Server settings
-        self.host = server_ip
-        self.port = 12345
+        self.host = self.server_ip
         self.client_socket = None
+        self.multicast_socket = None
+        self.multicast_group = None
+        # Selector of the receive thread, which reads the unicast and multicast sockets
+        self.receive_selector = None
         self.connected = False
         self.settings_file = "client_settings.json"
 
         # Audio settings
         self.audio = pyaudio.PyAudio()
         self.stream = None
-        self.chunk_size = 256
+        self.chunk_size = 256  # visualizer window
+        self.frames_per_buffer = 256
         self.format = pyaudio.paInt16
         self.channels = 2
         self.rate = 44100
         self.frames = 0
+        # Codec of the substream we receive, from format_info; AUDIO and FEC frames in any other are dropped
+        self.codec = PcmCodec()
+        self.preferred_codec = ""
+        self.preferred_profile = ""
+        self.preferred_fec = False
+        self.preferred_retransmit = False
+        self.server_retransmit = False
+        self.server_fec_group = 0
 
         # Audio buffer management
         self.audio_queue = queue.Queue(maxsize=100)
         self.max_buffer_size = 100
+        self.reorder_buffer = ReorderBuffer(depth=8)
+        self.fec_decoder = FecDecoder()
+        self.nack_tracker = NackTracker()
 
         # Thread safety
         self.playback_thread = None
@@ -347,6 +422,8 @@ class ModernRadioClient:
         self.cleanup_in_progress = False
         self.stream_lock = threading.Lock()
         self.shutdown_event = threading.Event()
+        # Held while a re-login runs on its own thread, so there is only ever one
+        self.relogin_lock = threading.Lock()
 
         # Time tracking
         self.current_track_duration = 0
@@ -655,7 +732,55 @@ class ModernRadioClient:
                                         font=('SF Mono', 11),
                                         bg=self.colors['surface'],
                                         fg=self.colors['text_dim'])
-        self.user_info_label.pack(anchor="w")
+        self.user_info_label.pack(anchor="w", pady=(0, 5))
+
+        # Stream statistics from AUDIO sequence numbers
+        self.stream_stats_label = tk.Label(inner_frame,
+                                           text="Packets: 0 received • 0 lost • 0 reordered",
+                                           font=('SF Mono', 11),
+                                           bg=self.colors['surface'],
+                                           fg=self.colors['text_dim'])
+        self.stream_stats_label.pack(anchor="w", pady=(0, 5))
+        self.update_stream_stats()
+
+        # Stream quality, sent to the server with every ping
+        quality_frame = tk.Frame(inner_frame, bg=self.colors['surface'])
+        quality_frame.pack(anchor="w")
+        tk.Label(quality_frame, text="Quality:", font=('SF Mono', 11),
+                 bg=self.colors['surface'], fg=self.colors['text_dim']).pack(side="left")
+        self.quality_var = tk.StringVar(value="Server default")
+        quality_menu = tk.OptionMenu(quality_frame, self.quality_var, *QUALITY_OPTIONS,
+                                     command=self.on_quality_change)
+        quality_menu.config(font=('SF Mono', 11), bg=self.colors['surface_light'], fg=self.colors['text'],
+                            activebackground=self.colors['accent'], highlightthickness=0, relief="flat")
+        quality_menu["menu"].config(bg=self.colors['surface_light'], fg=self.colors['text'])
+        quality_menu.pack(side="left", padx=(10, 0))
+
+        # Latency profile, likewise
+        tk.Label(quality_frame, text="Latency:", font=('SF Mono', 11),
+                 bg=self.colors['surface'], fg=self.colors['text_dim']).pack(side="left", padx=(20, 0))
+        self.latency_var = tk.StringVar(value="Server default")
+        latency_menu = tk.OptionMenu(quality_frame, self.latency_var, *LATENCY_OPTIONS,
+                                     command=self.on_latency_change)
+        latency_menu.config(font=('SF Mono', 11), bg=self.colors['surface_light'], fg=self.colors['text'],
+                            activebackground=self.colors['accent'], highlightthickness=0, relief="flat")
+        latency_menu["menu"].config(bg=self.colors['surface_light'], fg=self.colors['text'])
+        latency_menu.pack(side="left", padx=(10, 0))
+
+        # Parity packets from the server to mask occasional loss
+        self.fec_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(quality_frame, text="Error correction", variable=self.fec_var, command=self.on_fec_change,
+                       font=('SF Mono', 11), bg=self.colors['surface'], fg=self.colors['text_dim'],
+                       selectcolor=self.colors['surface_light'], activebackground=self.colors['surface'],
+                       highlightthickness=0).pack(side="left", padx=(20, 0))
+
+        # Ask the server to resend lost packets, at the cost of holding gaps longer
+        self.retransmit_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(quality_frame, text="Resend lost packets", variable=self.retransmit_var,
+                       command=self.on_retransmit_change,
+                       font=('SF Mono', 11), bg=self.colors['surface'], fg=self.colors['text_dim'],
+                       selectcolor=self.colors['surface_light'], activebackground=self.colors['surface'],
+                       highlightthickness=0).pack(side="left", padx=(10, 0))
 
     def create_visualizer_card(self, parent):
         """Create the visualizer card"""
@@ -891,6 +1016,62 @@ class ModernRadioClient:
 
         return f"#{r:02x}{g:02x}{b:02x}"
 
+    def update_stream_stats(self):
+        """Refresh the packet statistics line once a second"""
+        if self.shutdown_event.is_set():
+            return
+
+        stats = self.reorder_buffer
+        text = (f"Packets: {stats.delivered} received • {stats.lost} lost "
+                f"({stats.loss_rate() * 100:.1f}%) • {stats.reordered} reordered • {stats.duplicates} duplicate")
+        if self.preferred_fec:
+            text += f" • {self.fec_decoder.recovered} recovered"
+        if self.preferred_retransmit:
+            text += f" • {self.nack_tracker.sent} resend requests"
+        self.stream_stats_label.config(text=text)
+        self.root.after(1000, self.update_stream_stats)
+
+    def on_quality_change(self, label):
+        """Ask the server for another codec; it switches on the next ping"""
+        self.preferred_codec = QUALITY_OPTIONS.get(label, "")
+        self.save_settings()
+
+    def on_latency_change(self, label):
+        """Ask the server for another latency profile; it switches on the next ping"""
+        self.preferred_profile = LATENCY_OPTIONS.get(label, "")
+        self.save_settings()
+
+    def on_fec_change(self):
+        """Ask the server for parity packets, or stop them"""
+        self.preferred_fec = self.fec_var.get()
+        self.update_reorder_depth()
+        self.save_settings()
+
+    def on_retransmit_change(self):
+        """Start or stop asking the server for lost packets"""
+        self.preferred_retransmit = self.retransmit_var.get()
+        self.update_reorder_depth()
+        self.save_settings()
+
+    def update_reorder_depth(self):
+        """Hold gaps until the group's parity frame, or a resent packet, could have arrived"""
+        depth = 8
+        if self.preferred_fec:
+            depth = max(depth, self.server_fec_group + 2)
+        if self.preferred_retransmit and self.server_retransmit:
+            depth = max(depth, 32)
+        self.reorder_buffer.depth = min(depth, MAX_REORDER_DEPTH)
+
+    def receive_slots(self):
+        """DatagramReader ring size that never overwrites a payload still in use.
+
+        Queued payloads are copied, so only the FEC decoder and the reorder
+        buffer keep views into the ring. Each packet they hold may be
+        followed by a parity datagram (FEC group 1), with room for JSON
+        messages and resent duplicates in between.
+        """
+        return 2 * (self.fec_decoder.order.maxlen + MAX_REORDER_DEPTH) + 16
+
     def update_connection_status(self, connected):
         """Update connection status indicator"""
         if connected:
@@ -1004,6 +1185,26 @@ class ModernRadioClient:
                     self.volume_value = settings['volume']
                     self.update_volume_display()
 
+                if settings.get('codec') in QUALITY_OPTIONS.values():
+                    self.preferred_codec = settings['codec']
+                    for label, codec in QUALITY_OPTIONS.items():
+                        if codec == self.preferred_codec:
+                            self.quality_var.set(label)
+
+                if settings.get('profile') in LATENCY_OPTIONS.values():
+                    self.preferred_profile = settings['profile']
+                    for label, profile in LATENCY_OPTIONS.items():
+                        if profile == self.preferred_profile:
+                            self.latency_var.set(label)
+
+                if 'fec' in settings:
+                    self.preferred_fec = bool(settings['fec'])
+                    self.fec_var.set(self.preferred_fec)
+
+                if 'retransmit' in settings:
+                    self.preferred_retransmit = bool(settings['retransmit'])
+                    self.retransmit_var.set(self.preferred_retransmit)
+
         except Exception as e:
             print(f"Error loading settings: {e}")
 
@@ -1014,6 +1215,10 @@ class ModernRadioClient:
                 'server_ip': self.host,
                 'server_port': self.port,
                 'volume': self.volume_value,
+                'codec': self.preferred_codec,
+                'profile': self.preferred_profile,
+                'fec': self.preferred_fec,
+                'retransmit': self.preferred_retransmit,
                 'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
             }
 
@@ -1032,13 +1237,19 @@ class ModernRadioClient:
         while self.connected and self.playback_active and not self.shutdown_event.is_set():
             try:
                 try:
-                    frame = self.audio_queue.get(timeout=0.1)
+                    codec, frame = self.audio_queue.get(timeout=0.1)
                 except queue.Empty:
                     continue
 
                 if not frame or self.shutdown_event.is_set():
                     continue
 
+                try:
+                    frame = codec.decode(frame, self.channels)
+                except Exception as e:
+                    print(f"Error decoding audio frame: {e}")
+                    continue
+
                 self.process_audio_for_visualizer(frame)
 
                 with self.stream_lock:
@@ -1125,6 +1336,10 @@ class ModernRadioClient:
         """Clear audio buffers safely"""
         print("Clearing audio buffers")
 
+        self.reorder_buffer.reset()
+        self.fec_decoder.reset()
+        self.nack_tracker.reset()
+
         while not self.audio_queue.empty():
             try:
                 self.audio_queue.get_nowait()
@@ -1150,133 +1365,170 @@ class ModernRadioClient:
         #             print(f"Error closing audio stream: {e}")
         #             self.stream = None
 
+    def start_login_again(self):
+        """Run login_again on a worker thread, unless one is already running.
+
+        A busy login server can keep it waiting for over a minute, and the
+        receive thread must keep reading audio and pinging meanwhile.
+        """
+        if not self.relogin_lock.acquire(blocking=False):
+            return
+
+        def relogin():
+            try:
+                self.login_again()
+            finally:
+                self.relogin_lock.release()
+
+        threading.Thread(target=relogin, daemon=True).start()
+
     def login_again(self):
-        """Try to login again with saved credentials"""
+        """Get a new session with the refresh token, or else log in again with saved credentials"""
+        if self.refresh:
+            try:
+                response = send_login_request(self.server_ip, LOGINPORT, {"type": "refresh", "refresh": self.refresh})
+                if isinstance(response, dict) and response.get("status") == "success":
+                    self.use_session(response)
+                    return True
+            except:
+                pass
+            # Used, expired or forgotten by a restarted server: fall back to the password
+            self.refresh = None
+
         message = {
             "username": self.username,
             "password": self.password,
             "type": 'login'
         }
 
-        self.context = ssl.create_default_context()
-        self.context.check_hostname = False
-        self.context.verify_mode = ssl.CERT_REQUIRED
-        self.context.load_verify_locations(CERT_FILE)
+        for attempt in range(LOGIN_ATTEMPTS):
+            retry_after = None
+            try:
+                response = send_login_request(self.server_ip, LOGINPORT, message)
+                if isinstance(response, dict) and response.get("status") == "success":
+                    self.use_session(response)
+                    return True
+                if isinstance(response, dict) and response.get("status") == "busy":
+                    retry_after = float(response.get("retry_after", 1))
+            except:
+                pass
 
-        try:
-            with socket.create_connection((self.server_ip, LOGINPORT), timeout=5) as sock:
-                with self.context.wrap_socket(sock, server_hostname=self.server_ip) as ssock:
-                    ssock.sendall(json.dumps(message).encode('utf-8'))
-                    response = ssock.recv(BUFFER_SIZE).decode('utf-8').strip()
-                    try:
-                        response = json.loads(response)
-                        if isinstance(response, dict) and response.get("status") == "success":
-                            self.token = response.get("token")
-                            self.index = response.get("index")
-                            self.key = response.get("key")
-                            return True
-                    except json.JSONDecodeError:
-                        pass
-        except:
-            pass
+            if retry_after is None or self.shutdown_event.is_set():
+                break
+            # Spread out reconnect storms: wait as asked, plus a little jitter
+            print(f"Login server busy, retrying in {retry_after}s")
+            if self.shutdown_event.wait(min(retry_after, 30) + random.uniform(0, 1)):
+                break
 
         return False
 
+    def use_session(self, response):
+        self.token = response.get("token")
+        self.index = response.get("index")
+        self.key = response.get("key")
+        self.refresh = response.get("refresh")
+
     def receive_messages(self):
-        """Receive messages from server"""
-        buffer = b''
-        lastaudiorecvd = 0
+        """Receive messages from the server on the unicast socket and, once joined, the multicast group.
+
+        Both sockets are read from this one thread, so the reorder buffer,
+        FEC decoder and NACK tracker are only ever touched here.
+        """
+        sock = self.client_socket
+        selector = self.receive_selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ, DatagramReader(sock, slots=self.receive_slots()))
+        lastaudiorecvd = time.monotonic()
         connectionflag = True
-        while self.connected and not self.shutdown_event.is_set():
+        while self.connected and not self.shutdown_event.is_set() and sock.fileno() != -1:
             try:
-                data = None
-                self.client_socket.settimeout(5000)
-                try:
-                    data, addr = self.client_socket.recvfrom(2048 * 4)
-                except ConnectionResetError:
-                    pass
-                except socket.timeout:
-                    pass
-                except Exception as e:
-                    print("Error in receive udp", e)
-
-                if not data:
-                    print("No data received")
-                    if lastaudiorecvd == 0 or datetime.datetime.now() - lastaudiorecvd >= datetime.timedelta(seconds=5):
+                events = selector.select(timeout=1)
+                if not events:
+                    if connectionflag and time.monotonic() - lastaudiorecvd >= 5:
+                        print("No data received")
                         self.update_connection_status(False)
                         connectionflag = False
-
-                    time.sleep(1)
                     continue
 
-                buffer += data
-                lastaudiorecvd = datetime.datetime.now()
-                if not connectionflag:
-                    self.update_connection_status(True)
-                    connectionflag = True
-
-
-                while buffer and not self.shutdown_event.is_set():
-                    if buffer.startswith(b'AUDIO'):
-                        if len(buffer) < 9:
+                for key, _ in events:
+                    try:
+                        frames = key.data.receive()
+                    except (ConnectionResetError, BlockingIOError):
+                        continue
+                    except OSError as e:
+                        print("Error in receive udp", e)
+                        continue
+
+                    lastaudiorecvd = time.monotonic()
+                    if not connectionflag:
+                        self.update_connection_status(True)
+                        connectionflag = True
+
+                    for kind, codec_id, seq, sample_pos, data in frames:
+                        if self.shutdown_event.is_set():
                             break
 
-                        data_len = int.from_bytes(buffer[5:9], 'big')
-                        total_len = 9 + data_len
+                        if kind != FRAME_JSON and (self.codec is None or codec_id != self.codec.id):
+                            # Sent before the server switched us to another codec: part of
+                            # a substream we have left, and not decodable with the new codec
+                            continue
 
-                        if len(buffer) < total_len:
-                            break
+                        if kind == FRAME_AUDIO:
+                            self.queue_audio(seq, sample_pos, data)
+                            for packet in self.fec_decoder.add_audio(seq, sample_pos, data):
+                                self.queue_audio(*packet)
 
-                        audio_data = buffer[9:total_len]
+                        elif kind == FRAME_FEC:
+                            # For parity frames seq is the first packet covered and sample_pos the count
+                            for packet in self.fec_decoder.add_parity(seq, sample_pos, data):
+                                self.queue_audio(*packet)
 
-                        if not self.shutdown_event.is_set():
+                        elif kind == FRAME_JSON:
                             try:
-                                self.audio_queue.put(audio_data, timeout=0.01)
-                            except queue.Full:
-                                try:
-                                    self.audio_queue.get_nowait()
-                                    self.audio_queue.put(audio_data, timeout=0.01)
-                                except:
-                                    pass
-
-                        buffer = buffer[total_len:]
-
-                    elif buffer.startswith(b'JSON'):
-                        if len(buffer) < 8:
-                            break
-
-                        msg_len = int.from_bytes(buffer[4:8], 'big')
-                        total_len = 8 + msg_len
-
-                        if len(buffer) < total_len:
-                            break
-
-                        json_data = buffer[8:total_len].decode('utf-8')
-
-                        try:
-                            msg = json.loads(json_data)
-                            if not self.shutdown_event.is_set():
+                                msg = json.loads(bytes(data))
                                 self.handle_json_message_safe(msg)
-                        except json.JSONDecodeError as e:
-                            print(f"Error decoding JSON: {e}")
-
-                        buffer = buffer[total_len:]
+                            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                                print(f"Error decoding JSON: {e}")
 
-                    else:
-                        print("Unknown message format")
-                        buffer = b''
-                        break
+                if self.reorder_buffer.pending and self.preferred_retransmit and self.server_retransmit:
+                    self.request_missing()
 
             except Exception as e:
                 if not self.shutdown_event.is_set():
                     print(f"Error receiving data: {e}")
                 break
 
+        self.receive_selector = None
+        selector.close()
+
         # print("Message receiver thread ending")
         # if not hasattr(self, 'closing') or not self.closing:
         #     if not self.shutdown_event.is_set():
         #         self.disconnect_safe()
 
+    def queue_audio(self, seq, sample_pos, data):
+        """Reorder, drop duplicates and count losses before playback"""
+        for _, _, payload in self.reorder_buffer.push(seq, sample_pos, data):
+            # Tagged with the codec it arrived in, so a later switch does not change how it is
+            # decoded, and copied out of the receive ring, which the queue can outlast
+            item = (self.codec, bytes(payload))
+            try:
+                self.audio_queue.put_nowait(item)
+            except queue.Full:
+                try:
+                    self.audio_queue.get_nowait()
+                    self.audio_queue.put_nowait(item)
+                except:
+                    pass
+
+    def request_missing(self):
+        """NACK the packets the reorder buffer is waiting for"""
+        seqs = self.nack_tracker.due(self.reorder_buffer.missing(), time.monotonic())
+        if seqs:
+            try:
+                self.client_socket.sendto(nack_message(seqs), self.server_addr)
+            except (OSError, AttributeError):
+                pass
+
     def handle_json_message_safe(self, msg):
         """Handle JSON messages safely"""
         try:
@@ -1306,6 +1558,21 @@ class ModernRadioClient:
                 self.channels = msg.get("channels", 2)
                 self.format = msg.get("format", pyaudio.paInt16)
                 self.frames = msg.get("frames", 0)
+                self.frames_per_buffer = msg.get("frames_per_buffer", 256)
+                # A new codec or profile is a new substream with its own sequence numbers
+                self.reorder_buffer.reset()
+                self.fec_decoder.reset()
+                self.nack_tracker.reset()
+                self.server_retransmit = msg.get("retransmit", False)
+                self.server_fec_group = msg.get("fec_group", 0)
+                self.update_reorder_depth()
+
+                try:
+                    self.codec = get_codec(msg.get("codec", "pcm"))
+                except ValueError as e:
+                    # Nothing playable until the server sends a codec we know
+                    print(f"Cannot play stream: {e}")
+                    self.codec = None
 
                 if self.frames > 0 and self.rate > 0:
                     self.current_track_duration = int(self.frames / self.rate)
@@ -1327,22 +1594,69 @@ class ModernRadioClient:
                                 channels=self.channels,
                                 rate=self.rate,
                                 output=True,
-                                frames_per_buffer=self.chunk_size
+                                frames_per_buffer=self.frames_per_buffer
                             )
-                        print(f"Audio stream created: {self.rate}Hz, {self.channels} channels")
+                        print(f"Audio stream created: {self.rate}Hz, {self.channels} channels, "
+                              f"{msg.get('profile', 'low-latency')} profile")
                         self.start_time_tracking()
 
                     except Exception as e:
                         print(f"Error creating audio stream: {e}")
 
+            elif msg["type"] == "multicast":
+                self.join_multicast(msg.get("group"), msg.get("port"))
+
             elif msg["type"] == "loginrequired":
                 self.token = None
                 print("Login required")
-                self.login_again()
+                self.start_login_again()
 
         except Exception as e:
             print(f"Error handling JSON message: {e}")
 
+    def join_multicast(self, group, port):
+        """Join the station's multicast group and receive the stream from it"""
+        if not group or not port or self.multicast_group == (group, port):
+            return
+
+        self.leave_multicast()
+
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', port))
+            mreq = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        except OSError as e:
+            print(f"Could not join multicast group {group}:{port}: {e}")
+            return
+
+        self.multicast_socket = sock
+        self.multicast_group = (group, port)
+        print(f"Joined multicast group {group}:{port}")
+
+        # Called from the receive thread, which reads the group from now on
+        if self.receive_selector:
+            self.receive_selector.register(sock, selectors.EVENT_READ,
+                                           DatagramReader(sock, slots=self.receive_slots()))
+
+    def leave_multicast(self):
+        """Leave the multicast group (closing the socket drops the membership)"""
+        if self.multicast_socket:
+            try:
+                if self.receive_selector:
+                    self.receive_selector.unregister(self.multicast_socket)
+            except (KeyError, ValueError, OSError):
+                pass
+            try:
+                self.multicast_socket.close()
+            except:
+                pass
+        self.multicast_socket = None
+        self.multicast_group = None
+
     def ping_host(self):
         """Send ping to server"""
         while self.connected:
@@ -1352,7 +1666,13 @@ class ModernRadioClient:
                 decoded_key = base64.b64decode(self.key.encode('utf-8'))
                 aesgcm = AESGCM(decoded_key)
                 nonce = os.urandom(12)
-                ciphertext = aesgcm.encrypt(nonce, packed_ts + self.token.encode('utf-8'), None)
+                plaintext = packed_ts + self.token.encode('utf-8')
+                options = {"codec": self.preferred_codec, "profile": self.preferred_profile}
+                if self.preferred_fec:
+                    options["fec"] = True
+                if any(options.values()):
+                    plaintext += b'\0' + json.dumps(options).encode('utf-8')
+                ciphertext = aesgcm.encrypt(nonce, plaintext, None)
 
                 pingmsg = b'ping' + self.index.encode('utf-8') + nonce + ciphertext
 
@@ -1419,6 +1739,8 @@ class ModernRadioClient:
             except:
                 pass
 
+        self.leave_multicast()
+
         self.update_connection_status(False)
         self.update_track_display("")
 
@@ -1450,11 +1772,11 @@ class ModernRadioClient:
         print("Client closed")
 
 
-def open_main_app(username, password, server_ip, token, index, key):
-    main(server_ip, token, index, key, username, password)
+def open_main_app(username, password, server_ip, token, index, key, refresh=None):
+    main(server_ip, token, index, key, username, password, refresh)
 
 
-def main(server_ip, token, index, key, username, password):
+def main(server_ip, token, index, key, username, password, refresh=None):
     root = tk.Tk()
 
     # Set DPI awareness for Windows
@@ -1464,7 +1786,7 @@ def main(server_ip, token, index, key, username, password):
     except:
         pass
 
-    app = ModernRadioClient(root, server_ip, token, index, key, username, password)
+    app = ModernRadioClient(root, server_ip, token, index, key, username, password, refresh)
 
     def on_closing():
         print("Closing window...")
@@ -7,25 +7,36 @@ import threading
 import json
 import os
 from tkinter import filedialog
-from datetime import datetime, timedelta
+from datetime import datetime
 import pyaudio
 import wave
 import time
+import argparse
 # from pydub import AudioSegment
 # from pydub.utils import make_chunks
-import queue
-from dataclasses import dataclass
-from loginserver import start_server, active_tokens
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-import struct
+from loginserver import start_server
+from broadcast_engine import BroadcastEngine, EngineObserver, parse_station, validate_stations
+from metrics import METRICS_HOST, METRICS_PORT, start_metrics_server
 import math
 
+# One Prometheus endpoint for every station window in the process
+metrics_server = None
 
-@dataclass
-class UdpClient:
-    addr: tuple  # IPv4: (host, port)
-    active: bool
-    lastping: datetime
+
+class TkObserver(EngineObserver):
+    """Mirrors engine events into the Tk window from the Tk main loop"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def log(self, message, level="info"):
+        self.app.root.after(0, self.app.log_message, message, level)
+
+    def client_count_changed(self, count):
+        self.app.root.after(0, self.app.update_client_count, count)
+
+    def track_finished(self):
+        self.app.root.after(500, self.app.on_track_finished)
 
 
 def create_modern_styles():
@@ -234,12 +245,13 @@ def create_modern_styles():
 
 
 class ModernRadioServer:
-    def __init__(self, root):
+    def __init__(self, root, port=12345, playlist_file="server_playlist.json", station=None):
         self.client_count = None
         self.server_status = None
         self.server_ip_label = None
         self.root = root
-        self.root.title("Radio Station Control Center")
+        self.station = station
+        self.root.title(f"Radio Station Control Center - {station}" if station else "Radio Station Control Center")
         self.root.geometry("1500x800")
 
         # Get colors from style
@@ -252,45 +264,17 @@ class ModernRadioServer:
 
         # Server settings
         self.host = '0.0.0.0'
-        self.port = 12345
-        self.server_socket = None
-        self.clients = []
-        self.udpclients = {}
-        self.current_track = ""
+        self.port = port
         self.playlist = []
-        self.index = 0
         self.audio = pyaudio.PyAudio()
-        self.TOKEN_VALID_HOURS = 10
-
-        # Audio settings
-        self.chunk_size = 256
-        self.buffer_chunks = 8
-        self.audio_queue = queue.Queue(maxsize=50)
-        self.playing = False
-        self.audio_thread_active = False
-        self.sampwidth = 2
-        self.params = None
-        self.default_params = {
-            "nchannels": 2,
-            "framerate": 44100,
-            "sampwidth": 2,
-            "nframes": 0
-        }
-        self.current_track_elapsed = 0
         self.resume_button = True
 
-        # Audio conversion variables
-        self.audio_segments = {}
-        self.current_audio_data = None
-        self.audio_position = 0
-
-        # Threading controls
-        self.frame_reader_thread = None
-        self.broadcast_thread = None
-        self.stop_event = threading.Event()
+        # Streaming runs in the headless engine; this window only observes it
+        self.engine = BroadcastEngine(self.host, self.port, observer=TkObserver(self), station=station)
+        self.engine.auto_advance = False
 
         # Playlist file path
-        self.playlist_file = "server_playlist.json"
+        self.playlist_file = playlist_file
 
         # Volume control
         self.volume = 1.0
@@ -723,7 +707,7 @@ class ModernRadioServer:
         if not self.animation_running:
             return
 
-        if hasattr(self, 'server_socket') and self.server_socket and self.playing:
+        if self.engine.server_socket and self.engine.playing:
             # Pulsing red effect when on air
             self.on_air_pulse = getattr(self, 'on_air_pulse', 0)
             self.on_air_pulse += 0.1
@@ -751,13 +735,13 @@ class ModernRadioServer:
         width = self.waveform_canvas.winfo_width()
         height = self.waveform_canvas.winfo_height()
 
-        if width > 1 and self.playing:
+        if width > 1 and self.engine.playing:
             # Create animated waveform bars
             bar_count = 40
             bar_width = width / bar_count
 
             for i in range(bar_count):
-                if self.playing:
+                if self.engine.playing:
                     # Random height for animation effect
                     bar_height = height * (0.3 + 0.7 * abs(math.sin(time.time() * 2 + i * 0.3)))
                 else:
@@ -784,10 +768,11 @@ class ModernRadioServer:
         if not self.animation_running:
             return
 
-        if self.playing and self.params:
+        if self.engine.playing and self.engine.params:
             # Calculate total time
-            total_seconds = self.params.nframes // self.params.framerate
-            current_seconds = self.current_track_elapsed
+            params = self.engine.params
+            total_seconds = params.nframes // params.framerate
+            current_seconds = self.engine.current_track_elapsed
 
             # Format times
             current_time = f"{current_seconds // 60}:{current_seconds % 60:02d}"
@@ -840,9 +825,10 @@ class ModernRadioServer:
         if lines > 500:
             self.log_text.delete('1.0', '250.0')
 
-    def update_client_count(self):
+    def update_client_count(self, count=None):
         """Update the client count display with modern styling"""
-        count = len(self.udpclients)
+        if count is None:
+            count = len(self.engine.udpclients)
 
         if count == 0:
             self.client_count.config(text="0 Listeners")
@@ -859,7 +845,7 @@ class ModernRadioServer:
 
     def toggle_play(self):
         """Toggle playback with modern UI updates"""
-        if not self.playing:
+        if not self.engine.playing:
             if not self.playlist:
                 messagebox.showwarning("No Playlist",
                                        "Please add tracks to the playlist first")
@@ -882,10 +868,9 @@ class ModernRadioServer:
 
             # Update UI
             self.play_button.config(text="⏸")
-            self.current_track = os.path.basename(file_path)
 
             # Update now playing display
-            track_name = os.path.splitext(self.current_track)[0]
+            track_name = os.path.splitext(os.path.basename(file_path))[0]
             self.now_playing_label.config(text=track_name)
 
             # Update playlist status
@@ -893,47 +878,23 @@ class ModernRadioServer:
                 self.playlist_box.set(item, 'Status', '')
             self.playlist_box.set(selected_item, 'Status', '▶ Playing')
 
-            # Clear the audio queue
-            while not self.audio_queue.empty():
-                try:
-                    self.audio_queue.get_nowait()
-                except queue.Empty:
-                    break
-
             # Log playback start
             self.log_message(f"Now playing: {track_name}", "info")
 
-            # Send track info
-            jsonfile = json.dumps({
-                "type": "track_info",
-                "track": self.current_track
-            })
-            self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
-
-            # Start frame reading thread
-            self.frame_reader_thread = threading.Thread(
-                target=self.read_frames_optimized,
-                args=(file_path,),
-                daemon=True
-            )
-            self.frame_reader_thread.start()
-            self.playing = True
-            self.stop_event.clear()
+            # Hand the track to the broadcast engine
+            self.engine.play(file_path)
 
         else:
             # Stop playback
-            jsonfile = json.dumps({"type": "stop", "track": ""})
-            self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
+            self.engine.stop_playback()
             self.stop_audio()
             if not self.resume_button:
                 self.play_button.config(text="▶")
 
     def stop_audio(self):
         """Stop audio playback and update UI"""
-        self.playing = False
+        self.engine.stop_audio()
         self.resume_button = False
-        self.stop_event.set()
-        self.audio_thread_active = False
 
         # Update UI
         self.play_button.config(text="▶")
@@ -943,13 +904,12 @@ class ModernRadioServer:
         for item in self.playlist_box.get_children():
             self.playlist_box.set(item, 'Status', '')
 
-        # Clear the audio queue
-        while not self.audio_queue.empty():
-            try:
-                self.audio_queue.get_nowait()
-            except queue.Empty:
-                break
-        self.current_track_elapsed = 0
+    def on_track_finished(self):
+        """Advance to the next track once the engine finishes one"""
+        if not self.resume_button:
+            self.play_button.config(text="▶")
+        self.stop_audio()
+        self.next_track()
 
     def add_songs(self):
         """Add songs with modern file dialog"""
@@ -1010,10 +970,7 @@ class ModernRadioServer:
     def start_server(self):
         """Start server with modern UI updates"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.settimeout(3)
+            self.engine.start()
 
             # Update UI
             self.server_status.config(text="Server Online", style='StatusGood.TLabel')
@@ -1025,29 +982,33 @@ class ModernRadioServer:
             self.server_ip_label.config(text=f"Server Address: {self.get_local_ip()}:{self.port}")
 
             self.log_message(f"Server started on {self.get_local_ip()}:{self.port}", "success")
+            self.start_metrics()
             self.log_message("Ready to accept connections...", "info")
 
-            # Start listening thread
-            self.accept_thread = threading.Thread(target=self.accept_clients, daemon=True)
-            self.accept_thread.start()
-
         except Exception as e:
             messagebox.showerror("Server Error", f"Failed to start server: {str(e)}")
             self.log_message(f"Server start failed: {str(e)}", "error")
 
+    def start_metrics(self):
+        """Serve engine and login metrics in Prometheus format on localhost"""
+        global metrics_server
+        if metrics_server is not None:
+            return
+        try:
+            metrics_server = start_metrics_server(METRICS_HOST, METRICS_PORT)
+            self.log_message(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics", "info")
+        except OSError as e:
+            self.log_message(f"Metrics endpoint not started: {e}", "warning")
+
     def stop_server(self):
         """Stop server with modern UI updates"""
-        if self.server_socket:
+        if self.engine.server_socket:
             # Stop any playing audio
-            if self.playing:
+            if self.engine.playing:
                 self.stop_audio()
 
-            # Set stop event
-            self.stop_event.set()
-
-            # Close socket
-            self.server_socket.close()
-            self.server_socket = None
+            # Close socket and drop listeners
+            self.engine.shutdown()
 
             # Update UI
             self.server_status.config(text="Server Offline", style='StatusBad.TLabel')
@@ -1056,7 +1017,6 @@ class ModernRadioServer:
             self.stop_button.config(state="disabled")
             self.client_count.config(text="0 Listeners")
 
-            self.udpclients = {}
             self.log_message("Server stopped", "warning")
 
     def setup_drag_and_drop(self):
@@ -1085,10 +1045,9 @@ class ModernRadioServer:
             self.playlist_box.selection_set(item)
             self.playlist_box.see(item)
 
-            if self.playing:
+            if self.engine.playing:
                 self.stop_audio()
-                jsonfile = json.dumps({"type": "stop", "track": ""})
-                self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
+                self.engine.send_json({"type": "stop", "track": ""})
 
             self.resume_button = True
             time.sleep(0.1)
@@ -1343,10 +1302,9 @@ class ModernRadioServer:
             messagebox.showwarning("Empty Playlist", "Playlist is empty")
             return
 
-        if self.playing:
+        if self.engine.playing:
             self.stop_audio()
-            jsonfile = json.dumps({"type": "stop", "track": ""})
-            self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
+            self.engine.send_json({"type": "stop", "track": ""})
 
         current_selection = self.playlist_box.selection()
         if current_selection:
@@ -1369,10 +1327,9 @@ class ModernRadioServer:
             messagebox.showwarning("Empty Playlist", "Playlist is empty")
             return
 
-        if self.playing:
+        if self.engine.playing:
             self.stop_audio()
-            jsonfile = json.dumps({"type": "stop", "track": ""})
-            self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
+            self.engine.send_json({"type": "stop", "track": ""})
 
         current_selection = self.playlist_box.selection()
         if current_selection:
@@ -1396,308 +1353,10 @@ class ModernRadioServer:
         if hasattr(self, 'audio'):
             self.audio.terminate()
 
-    # All the original audio handling methods remain the same
-    def read_frames_optimized(self, filename):
-        """Optimized frame reading with better buffering"""
-        self.log_message(f"Starting playback: {os.path.basename(filename)}", "info")
-
-        try:
-            audio_data, self.params = self.load_audio_file(filename)
-            self.current_audio_data = audio_data
-            self.audio_position = 0
-
-            if self.params.sampwidth == 1:
-                self.sampwidth = pyaudio.paInt8
-            elif self.params.sampwidth == 2:
-                self.sampwidth = pyaudio.paInt16
-            elif self.params.sampwidth == 3:
-                self.sampwidth = pyaudio.paInt24
-            elif self.params.sampwidth == 4:
-                self.sampwidth = pyaudio.paInt32
-            else:
-                self.sampwidth = pyaudio.paInt16
-
-            jsonfile = json.dumps({
-                "type": "format_info",
-                "channels": self.params.nchannels,
-                "rate": self.params.framerate,
-                "format": self.sampwidth,
-                "frames": self.params.nframes,
-                "current_time": self.current_track_elapsed
-            })
-            self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
-
-            bytes_per_frame = self.params.nchannels * self.params.sampwidth
-            chunk_bytes = self.chunk_size * bytes_per_frame
-
-            for _ in range(self.buffer_chunks):
-                if self.audio_position < len(self.current_audio_data) and not self.stop_event.is_set():
-                    end_pos = min(self.audio_position + chunk_bytes, len(self.current_audio_data))
-                    data = self.current_audio_data[self.audio_position:end_pos]
-
-                    if data:
-                        try:
-                            self.audio_queue.put(data, timeout=0.1)
-                            self.audio_position = end_pos
-                        except queue.Full:
-                            break
-
-            self.broadcast_thread = threading.Thread(target=self.broadcast_audio_loop, daemon=True)
-            self.broadcast_thread.start()
-
-            frame_count = 0
-            self.current_track_elapsed = 0
-            target_frame_time = time.time()
-            frame_duration = self.chunk_size / self.params.framerate
-
-            while self.playing and self.audio_position < len(self.current_audio_data) and not self.stop_event.is_set():
-                try:
-                    target_frame_time += frame_duration
-                    current_time = time.time()
-                    sleep_time = target_frame_time - current_time
-
-                    if sleep_time > 0:
-                        time.sleep(sleep_time)
-
-                    end_pos = min(self.audio_position + chunk_bytes, len(self.current_audio_data))
-                    data = self.current_audio_data[self.audio_position:end_pos]
-
-                    if not data:
-                        break
-
-                    self.audio_queue.put(data, timeout=0.1)
-                    self.audio_position = end_pos
-                    frame_count += 1
-
-                    if self.playing:
-                        self.current_track_elapsed = int(frame_count * self.chunk_size / self.params.framerate)
-
-                except queue.Full:
-                    time.sleep(0.01)
-                    continue
-                except Exception as e:
-                    self.log_message(f"Error in frame reading: {str(e)}", "error")
-                    break
-
-            if self.audio_position >= len(self.current_audio_data):
-                self.log_message("Track completed", "info")
-                if not self.resume_button:
-                    self.play_button.config(text="▶")
-                self.stop_audio()
-                time.sleep(0.5)
-                self.next_track()
-
-        except Exception as e:
-            self.log_message(f"Error in playback: {str(e)}", "error")
-            self.playing = False
-        finally:
-            self.audio_thread_active = False
-
-    def broadcast_audio_loop(self):
-        """Separate thread for broadcasting audio to clients"""
-        self.audio_thread_active = True
-        client_error_counts = {}
-        max_consecutive_errors = 5
-
-        while self.playing and self.audio_thread_active and not self.stop_event.is_set():
-            try:
-                audio_data = self.audio_queue.get(timeout=0.1)
-
-                if audio_data and self.udpclients:
-                    packet = b'AUDIO' + len(audio_data).to_bytes(4, 'big') + audio_data
-
-                    for key in list(self.udpclients.keys()):
-                        oneudp = self.udpclients.get(key)
-                        if self.server_socket and oneudp and oneudp.active and oneudp.addr:
-                            try:
-                                self.server_socket.sendto(packet, oneudp.addr)
-                            except ConnectionResetError:
-                                oneudp.active = False
-
-                self.audio_queue.task_done()
-
-            except queue.Empty:
-                continue
-            except Exception as e:
-                self.log_message(f"Error in broadcast: {str(e)}", "error")
-                break
-
-    def load_audio_file(self, filename):
-        """Load and convert audio file to standard format"""
-        try:
-            file_ext = os.path.splitext(filename)[1].lower()
-
-            if file_ext == '.wav':
-                with wave.open(filename, 'rb') as wf:
-                    params = wf.getparams()
-                    audio_data = wf.readframes(params.nframes)
-                    return audio_data, params
-
-            elif file_ext == '.mp3':
-                self.log_message(f"Converting MP3: {os.path.basename(filename)}", "info")
-
-                # If pydub is available
-                # audio_segment = AudioSegment.from_mp3(filename)
-                # audio_segment = audio_segment.set_frame_rate(44100)
-                # audio_segment = audio_segment.set_channels(2)
-                # audio_segment = audio_segment.set_sample_width(2)
-                # audio_data = audio_segment.raw_data
 
-                # For now, return error if MP3
-                raise ValueError("MP3 support requires pydub library")
-
-            else:
-                raise ValueError(f"Unsupported format: {file_ext}")
-
-        except Exception as e:
-            self.log_message(f"Error loading audio: {str(e)}", "error")
-            raise
-
-    def broadcast(self, message):
-        """Send a message to all connected clients"""
-        for key in list(self.udpclients.keys()):
-            oneudp = self.udpclients.get(key)
-            if oneudp and oneudp.active and oneudp.addr:
-                try:
-                    self.server_socket.sendto(message, oneudp.addr)
-                except ConnectionResetError:
-                    oneudp.active = False
-
-    def send_reject_token(self, addr):
-        """Send login required message to client"""
-        if addr:
-            jsonfile = json.dumps({"type": "loginrequired"})
-            packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
-
-            try:
-                self.server_socket.sendto(packet, addr)
-            except ConnectionResetError:
-                pass
-
-    def send_wav_parameters(self, oneudp):
-        """Send audio parameters to client"""
-        if oneudp and oneudp.addr and oneudp.active:
-            try:
-                jsonfile = json.dumps({
-                    "type": "track_info",
-                    "track": self.current_track if self.current_track else ""
-                })
-                packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
-                try:
-                    self.server_socket.sendto(packet, oneudp.addr)
-                except ConnectionResetError:
-                    oneudp.active = False
-
-                if self.playing and self.params:
-                    jsonfile = json.dumps({
-                        "type": "format_info",
-                        "channels": self.params.nchannels,
-                        "rate": self.params.framerate,
-                        "format": self.sampwidth,
-                        "frames": self.params.nframes,
-                        "current_time": self.current_track_elapsed
-                    })
-                    packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
-                    try:
-                        self.server_socket.sendto(packet, oneudp.addr)
-                    except ConnectionResetError:
-                        oneudp.active = False
-
-            except Exception as e:
-                self.log_message(f"Error sending parameters: {str(e)}", "error")
-
-    def accept_clients(self):
-        """Handle incoming client connections"""
-        self.log_message("Waiting for client connections...", "info")
-
-        last_check = datetime.now()
-
-        while True:
-            if self.server_socket:
-                now = datetime.now()
-
-                try:
-                    data = None
-                    try:
-                        data, addr = self.server_socket.recvfrom(2048)
-                    except ConnectionResetError:
-                        pass
-                    except socket.timeout:
-                        pass
-                    except OSError:
-                        pass
-
-                    client_list_changed = False
-
-                    if data:
-                        message = data[:4].decode('utf-8')
-                        key = f"{addr[0]}:{addr[1]}"
-                        udpone = self.udpclients.get(key)
-
-                        if message.startswith("ping"):
-                            index = data[4:14].decode('utf-8')
-                            packed_ts = data[14:22]
-                            nonce = data[14:26]
-                            ciphertext = data[26:]
-
-                            Entry = active_tokens.get(index)
-                            if Entry is not None:
-                                KEY = Entry.get("key")
-                                if KEY is not None:
-                                    aesgcm = AESGCM(KEY)
-
-                                    try:
-                                        plaintext = aesgcm.decrypt(nonce, ciphertext, None)
-                                        timestamp = struct.unpack('!d', plaintext[:8])[0]
-                                        token = plaintext[8:].decode('utf-8')
-                                        comparetonow = time.time()
-
-                                        if token == Entry.get('token') and comparetonow - timestamp < 5:
-                                            token_time = Entry.get('timestamp')
-                                            if token_time is not None:
-                                                if udpone:
-                                                    udpone.active = True
-                                                    udpone.lastping = datetime.now()
-                                                else:
-                                                    age = now - token_time
-                                                    if age < timedelta(hours=self.TOKEN_VALID_HOURS):
-                                                        udpone = UdpClient(active=True, addr=addr,
-                                                                           lastping=datetime.now())
-                                                        self.udpclients[key] = udpone
-                                                        self.log_message(f"New client: {addr[0]}:{addr[1]}", "success")
-                                                        self.send_wav_parameters(udpone)
-                                            else:
-                                                self.send_reject_token(addr)
-
-                                            client_list_changed = True
-
-                                    except Exception as e:
-                                        pass
-
-                        if udpone and message.startswith("quit"):
-                            udpone.active = False
-                            client_list_changed = True
-
-                    if client_list_changed or now - last_check > timedelta(seconds=3):
-                        last_check = now
-
-                        for key in list(self.udpclients.keys()):
-                            oneudp = self.udpclients.get(key)
-                            if oneudp and (not oneudp.active or now - oneudp.lastping > timedelta(seconds=6)):
-                                del self.udpclients[key]
-                                self.log_message(f"Client disconnected: {oneudp.addr[0]}:{oneudp.addr[1]}", "warning")
-
-                    self.update_client_count()
-
-                except Exception as e:
-                    if hasattr(self.server_socket, '_closed') and self.server_socket._closed:
-                        break
-                    self.log_message(f"Error in client handler: {str(e)}", "error")
-                    break
-
-
-def main():
-    """Main entry point"""
+def main(stations=None):
+    """Main entry point: one control window per (name, port, playlist) station"""
+    stations = stations or [(None, 12345, "server_playlist.json")]
     root = tk.Tk()
 
     # Set DPI awareness for Windows
@@ -1707,10 +1366,22 @@ def main():
     except:
         pass
 
-    app = ModernRadioServer(root)
+    # The first station gets the main window, the others their own Toplevel
+    apps = []
+    for name, port, playlist in stations:
+        window = root if not apps else tk.Toplevel(root)
+        app = ModernRadioServer(window, port, playlist, name)
+        apps.append(app)
+        if window is not root:
+            def close_station(app=app, window=window):
+                app.close_server()
+                apps.remove(app)
+                window.destroy()
+            window.protocol("WM_DELETE_WINDOW", close_station)
 
     def on_closing():
-        app.close_server()
+        for app in apps:
+            app.close_server()
         root.destroy()
 
     root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -1719,14 +1390,21 @@ def main():
         root.mainloop()
     except KeyboardInterrupt:
         print("Shutting down...")
-        app.close_server()
-        root.destroy()
+        on_closing()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PyWaves Radio station control")
+    parser.add_argument("--station", type=parse_station, action="append", metavar="NAME=PORT[:PLAYLIST]",
+                        help="open a window for this station (repeat for several; all share one login server)")
+    args = parser.parse_args()
+    error = validate_stations(args.station or [])
+    if error:
+        parser.error(error)
+
     # Start login server in background
     login_server = threading.Thread(target=start_server, daemon=True)
     login_server.start()
 
     # Start main GUI
-    main()
\ No newline at end of file
+    main(args.station)
\ No newline at end of file
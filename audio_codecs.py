@@ -0,0 +1,333 @@
+# audio_codecs.py - Payload codecs for AUDIO packets, shared by the broadcast engine and the radio client
+import struct
+import numpy as np
+
+
+# Chunk header: mode, channels, frames
+CHUNK_HEADER = struct.Struct('!BBH')
+# Per channel in a Rice chunk: predictor order, Rice parameter, unary section length
+CHANNEL_HEADER = struct.Struct('!BBI')
+
+MODE_VERBATIM = 0
+MODE_RICE = 1
+MODE_ADPCM = 2
+
+MAX_ORDER = 2
+MAX_RICE_PARAMETER = 24
+
+# ADPCM: frames per block, and step sizes tried per block between the lower
+# and upper bound for each predictor order
+ADPCM_BLOCK_FRAMES = 128
+ADPCM_STEP_CANDIDATES = 4
+# Per ADPCM block: step size, predictor order, first two lattice values
+ADPCM_BLOCK_DTYPE = [('step', '<u2'), ('order', 'u1'), ('warmup', '<i2', 2)]
+
+
+def verbatim(pcm, channels, frames):
+    return CHUNK_HEADER.pack(MODE_VERBATIM, channels, frames) + bytes(pcm)
+
+
+def mulaw_tables():
+    """G.711 mu-law encode table indexed by the sample as uint16, and decode table.
+
+    Same quantization as the 14-bit reference coder used by audioop.
+    """
+    samples = np.arange(-32768, 32768, dtype=np.int64)
+    value = samples >> 2
+    magnitude = np.minimum(np.abs(value), 8159) + 33
+    segment = np.floor(np.log2(magnitude)).astype(np.int64) - 5
+    codes = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    codes ^= np.where(value < 0, 0x7F, 0xFF)
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[samples & 0xFFFF] = codes
+
+    codes = ~np.arange(256, dtype=np.int64) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    magnitude = ((((codes & 0x0F) << 3) + 0x84) << exponent) - 0x84
+    decode = np.where(codes & 0x80, -magnitude, magnitude).astype('<i2')
+    return encode, decode
+
+
+MULAW_ENCODE, MULAW_DECODE = mulaw_tables()
+
+
+class PcmCodec:
+    """Raw little-endian PCM, as read from the WAV file"""
+    name = "pcm"
+    id = 0
+
+    def supports(self, sampwidth):
+        return True
+
+    def encode(self, pcm, channels):
+        return pcm
+
+    def decode(self, payload, channels):
+        # The payload may be a view into the client's receive ring; PyAudio's
+        # Stream.write only takes read-only bytes, like the other codecs return
+        return bytes(payload)
+
+
+class RiceCodec:
+    """Lossless 16-bit codec: fixed linear prediction plus Rice coding.
+
+    Every chunk is coded on its own, so a lost packet never affects the
+    next one. Each channel picks the fixed predictor order (0-2) and Rice
+    parameter that code it smallest. The unary quotients and the k-bit
+    remainders are stored in separate sections, which lets both directions
+    run as whole-array NumPy operations instead of a per-sample bit loop.
+    Chunks that would not shrink are sent verbatim.
+    """
+    name = "rice"
+    id = 1
+
+    def supports(self, sampwidth):
+        return sampwidth == 2
+
+    def encode(self, pcm, channels):
+        frames = len(pcm) // (2 * channels)
+        if frames == 0 or len(pcm) != frames * 2 * channels or frames > 0xFFFF:
+            return verbatim(pcm, channels, frames)
+
+        samples = np.frombuffer(pcm, dtype='<i2').reshape(frames, channels).astype(np.int64)
+        parts = [CHUNK_HEADER.pack(MODE_RICE, channels, frames)]
+        size = CHUNK_HEADER.size
+
+        for channel in range(channels):
+            order, residual = self.predict(samples[:, channel])
+            # Zigzag: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+            folded = (residual << 1) ^ (residual >> 63)
+            k = self.rice_parameter(folded)
+
+            unary = self.pack_unary(folded >> k)
+            remainder = self.pack_remainders(folded & ((1 << k) - 1), k)
+            parts += [CHANNEL_HEADER.pack(order, k, len(unary)), unary, remainder]
+            size += CHANNEL_HEADER.size + len(unary) + len(remainder)
+
+        if size >= CHUNK_HEADER.size + len(pcm):
+            return verbatim(pcm, channels, frames)
+        return b''.join(parts)
+
+    def decode(self, payload, channels):
+        mode, channels, frames = CHUNK_HEADER.unpack_from(payload)
+        if mode == MODE_VERBATIM:
+            return bytes(payload[CHUNK_HEADER.size:])
+        if mode != MODE_RICE:
+            raise ValueError(f"unknown chunk mode {mode}")
+
+        samples = np.empty((frames, channels), dtype='<i2')
+        offset = CHUNK_HEADER.size
+        for channel in range(channels):
+            order, k, unary_len = CHANNEL_HEADER.unpack_from(payload, offset)
+            offset += CHANNEL_HEADER.size
+            quotients = self.unpack_unary(payload[offset:offset + unary_len], frames)
+            offset += unary_len
+            remainder_len = (frames * k + 7) // 8
+            remainders = self.unpack_remainders(payload[offset:offset + remainder_len], frames, k)
+            offset += remainder_len
+
+            folded = (quotients << k) | remainders
+            residual = (folded >> 1) ^ -(folded & 1)
+            for _ in range(order):
+                residual = np.cumsum(residual)
+            samples[:, channel] = residual
+
+        return samples.tobytes()
+
+    @staticmethod
+    def predict(samples):
+        """Return the fixed predictor order with the smallest residual, and that residual"""
+        best_order, best = 0, samples
+        best_cost = np.abs(samples).sum()
+        residual = samples
+        for order in range(1, MAX_ORDER + 1):
+            residual = np.diff(residual, prepend=0)
+            cost = np.abs(residual).sum()
+            if cost < best_cost:
+                best_order, best, best_cost = order, residual, cost
+        return best_order, best
+
+    @staticmethod
+    def rice_parameter(folded):
+        """Rice parameter giving the fewest bits for these values"""
+        # The optimum is within one of log2(mean); only try those
+        mean = int(folded.sum()) // len(folded)
+        guess = max(mean.bit_length() - 1, 0)
+        ks = np.arange(max(guess - 1, 0), min(guess + 1, MAX_RICE_PARAMETER) + 1)
+        bits = (folded[:, None] >> ks).sum(axis=0) + len(folded) * (ks + 1)
+        return int(ks[np.argmin(bits)])
+
+    @staticmethod
+    def pack_unary(quotients):
+        # q zero bits then a one; the ones are the only set bits in the section
+        ends = np.cumsum(quotients + 1) - 1
+        bits = np.zeros(int(ends[-1]) + 1, dtype=np.uint8)
+        bits[ends] = 1
+        return np.packbits(bits).tobytes()
+
+    @staticmethod
+    def unpack_unary(section, count):
+        ends = np.flatnonzero(np.unpackbits(np.frombuffer(section, dtype=np.uint8)))[:count]
+        if len(ends) != count:
+            raise ValueError("truncated unary section")
+        return np.diff(ends, prepend=-1).astype(np.int64) - 1
+
+    @staticmethod
+    def pack_remainders(remainders, k):
+        if k == 0:
+            return b''
+        shifts = np.arange(k - 1, -1, -1)
+        bits = ((remainders[:, None] >> shifts) & 1).astype(np.uint8)
+        return np.packbits(bits.ravel()).tobytes()
+
+    @staticmethod
+    def unpack_remainders(section, count, k):
+        if k == 0:
+            return np.zeros(count, dtype=np.int64)
+        bits = np.unpackbits(np.frombuffer(section, dtype=np.uint8))[:count * k]
+        if len(bits) != count * k:
+            raise ValueError("truncated remainder section")
+        weights = 1 << np.arange(k - 1, -1, -1, dtype=np.int64)
+        return bits.reshape(count, k).astype(np.int64) @ weights
+
+
+class MulawCodec:
+    """G.711 mu-law: 8 bits per sample (2:1), one table lookup each way"""
+    name = "mulaw"
+    id = 3
+
+    def supports(self, sampwidth):
+        return sampwidth == 2
+
+    def encode(self, pcm, channels):
+        samples = np.frombuffer(pcm, dtype='<u2', count=len(pcm) // 2)
+        return MULAW_ENCODE[samples].tobytes()
+
+    def decode(self, payload, channels):
+        return MULAW_DECODE[np.frombuffer(payload, dtype=np.uint8)].tobytes()
+
+
+class AdpcmCodec:
+    """4-bit forward-adaptive DPCM for 16-bit audio, about 3.5:1.
+
+    Each channel is cut into blocks of ADPCM_BLOCK_FRAMES. For every block
+    the encoder picks a fixed predictor order (0-2) and the smallest step
+    size for which no 4-bit code saturates, and sends both in the block
+    header. Because nothing saturates, closed-loop prediction reconstructs
+    every sample as the step multiple nearest to it, so encoding is a
+    rounding and a difference and decoding is a cumulative sum, all done
+    for every block at once. IMA-ADPCM's sample-by-sample step adaptation
+    could not be vectorized this way.
+    """
+    name = "adpcm"
+    id = 2
+
+    def supports(self, sampwidth):
+        return sampwidth == 2
+
+    def encode(self, pcm, channels):
+        frames = len(pcm) // (2 * channels)
+        if frames == 0 or len(pcm) != frames * 2 * channels or frames > 0xFFFF:
+            return verbatim(pcm, channels, frames)
+
+        samples = np.frombuffer(pcm, dtype='<i2').reshape(frames, channels).astype(np.int64)
+        blocks = -(-frames // ADPCM_BLOCK_FRAMES)
+        padding = blocks * ADPCM_BLOCK_FRAMES - frames
+        if padding:
+            samples = np.pad(samples, ((0, padding), (0, 0)), mode='edge')
+        # One row per (channel, block)
+        lanes = samples.T.reshape(channels * blocks, ADPCM_BLOCK_FRAMES)
+
+        order, step = self.choose_steps(lanes)
+        lattice = np.floor(lanes / step[:, None] + 0.5).astype(np.int64)
+
+        codes = lattice.copy()
+        first = np.diff(lattice, axis=1)
+        second = np.diff(first, axis=1)
+        codes[order == 1, 0] = 0
+        codes[order == 1, 1:] = first[order == 1]
+        codes[order == 2, :2] = 0
+        codes[order == 2, 2:] = second[order == 2]
+
+        nibbles = (codes & 0x0F).astype(np.uint8)
+        header = np.empty(len(lanes), dtype=ADPCM_BLOCK_DTYPE)
+        header['step'] = step
+        header['order'] = order
+        header['warmup'] = lattice[:, :2]
+        return (CHUNK_HEADER.pack(MODE_ADPCM, channels, frames) + header.tobytes()
+                + ((nibbles[:, 0::2] << 4) | nibbles[:, 1::2]).tobytes())
+
+    def decode(self, payload, channels):
+        mode, channels, frames = CHUNK_HEADER.unpack_from(payload)
+        if mode == MODE_VERBATIM:
+            return bytes(payload[CHUNK_HEADER.size:])
+        if mode != MODE_ADPCM:
+            raise ValueError(f"unknown chunk mode {mode}")
+
+        blocks = -(-frames // ADPCM_BLOCK_FRAMES)
+        count = channels * blocks
+        header = np.frombuffer(payload, dtype=ADPCM_BLOCK_DTYPE, count=count, offset=CHUNK_HEADER.size)
+        packed = np.frombuffer(payload, dtype=np.uint8, count=count * ADPCM_BLOCK_FRAMES // 2,
+                               offset=CHUNK_HEADER.size + header.nbytes).reshape(count, -1)
+
+        codes = np.empty((count, ADPCM_BLOCK_FRAMES), dtype=np.int64)
+        codes[:, 0::2] = packed >> 4
+        codes[:, 1::2] = packed & 0x0F
+        codes[codes >= 8] -= 16
+
+        # Rebuild the order-k differences so k cumulative sums give the lattice
+        order = header['order']
+        warmup = header['warmup'].astype(np.int64)
+        codes[:, 0] = warmup[:, 0]
+        codes[order == 2, 1] = warmup[order == 2, 1] - 2 * warmup[order == 2, 0]
+        for k in (1, 2):
+            rows = order >= k
+            codes[rows] = np.cumsum(codes[rows], axis=1)
+
+        lanes = np.clip(codes * header['step'][:, None].astype(np.int64), -32768, 32767)
+        samples = lanes.reshape(channels, blocks * ADPCM_BLOCK_FRAMES).T[:frames]
+        return samples.astype('<i2').tobytes()
+
+    @staticmethod
+    def choose_steps(lanes):
+        """Per block, the predictor order and step size giving the finest quantization"""
+        orders = np.arange(MAX_ORDER + 1)
+        peaks = [np.abs(lanes).max(axis=1)]
+        residual = lanes
+        for _ in orders[1:]:
+            residual = np.diff(residual, axis=1)
+            peaks.append(np.abs(residual).max(axis=1))
+        peak = np.stack(peaks, axis=1)[:, :, None]
+
+        # Rounding moves an order-k difference by at most 2**(k-1) steps, so
+        # the upper bound always fits in -8..7; smaller steps are tried first
+        fractions = np.arange(ADPCM_STEP_CANDIDATES) / (ADPCM_STEP_CANDIDATES - 1)
+        low = np.maximum(peak / 8, 1)
+        high = np.maximum(np.ceil(peak / (7 - 2.0 ** (orders[:, None] - 1))), 1)
+        candidates = np.ceil(low * (high / low) ** fractions)
+        candidates[:, :, -1] = high[:, :, 0]
+
+        # Lattice for every (order, candidate) at once; floats are exact here
+        lattice = np.floor(lanes[:, None, None, :] / candidates[:, :, :, None] + 0.5)
+        fits = []
+        for order in orders:
+            codes = np.diff(lattice[:, order], n=order, axis=2)
+            fits.append((codes.max(axis=2) <= 7) & (codes.min(axis=2) >= -8))
+        first_fit = np.argmax(np.stack(fits, axis=1), axis=2)
+
+        steps = np.take_along_axis(candidates, first_fit[:, :, None], axis=2)[:, :, 0]
+        order = np.argmin(steps, axis=1)
+        return order, steps[np.arange(len(lanes)), order].astype(np.int64)
+
+
+CODECS = {codec.name: codec for codec in (PcmCodec(), RiceCodec(), AdpcmCodec(), MulawCodec())}
+# Codec ids carried in AUDIO and FEC headers
+CODEC_IDS = {codec.id: codec for codec in CODECS.values()}
+
+
+def get_codec(name):
+    """Look up a codec by the name used in format_info"""
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError(f"unknown codec {name!r}") from None
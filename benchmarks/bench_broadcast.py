@@ -0,0 +1,321 @@
+# bench_broadcast.py - Listeners one station sustains: delivery, jitter, send lag and CPU per listener
+#
+# Runs the broadcast engine on localhost with a synthetic WAV and starts
+# simulated listeners in separate processes. Each listener logs in through an
+# in-process session, sends the real encrypted ping, and counts the AUDIO
+# packets it receives. Before measuring, it checks that a short track reaches
+# a listener of every codec and latency profile down to its last sample.
+#
+# Usage: python benchmarks/bench_broadcast.py [--listeners 100 500 1000] [--seconds S] [--warmup S]
+#                                             [--codec pcm] [--profile low-latency] [--fanout auto] [--processes N]
+#                                             [--chunks-per-wakeup N]
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from broadcast_engine import BroadcastEngine
+from loginserver import generate_token, generate_AES_key, save_token
+from packetizer import PROFILES, DEFAULT_PROFILE
+from protocol import FRAME_AUDIO, parse_frames, sequence_distance
+from audio_codecs import CODECS, CODEC_IDS
+
+
+FRAMERATE = 44100
+# Listeners ping more often than the client (every 4 s) so none is swept while the machine is busy
+PING_INTERVAL = 2.0
+
+
+def write_wav(path, seconds):
+    """Stereo 16-bit tones with a little noise, so compressed codecs have real work to do"""
+    t = np.arange(round(seconds * FRAMERATE)) / FRAMERATE
+    rng = np.random.default_rng(0)
+    left = 8000 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 300, t.size)
+    right = 6000 * np.sin(2 * np.pi * 660 * t) + rng.normal(0, 300, t.size)
+    samples = np.stack([left, right], axis=1).astype('<i2')
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(FRAMERATE)
+        wav.writeframes(samples.tobytes())
+
+
+class Listener:
+    """Counters for one simulated listener"""
+    __slots__ = ("sock", "index", "token", "aesgcm", "packets", "first_seq", "last_seq",
+                 "transit", "jitter")
+
+    def __init__(self, sock, index, token, key):
+        self.sock = sock
+        self.index = index.encode('utf-8')
+        self.token = token.encode('utf-8')
+        self.aesgcm = AESGCM(key)
+        self.packets = 0
+        self.first_seq = None
+        self.last_seq = 0
+        self.transit = None
+        self.jitter = 0.0
+
+    def ping(self, server, options):
+        """The client's ping: index, nonce, AES-GCM(timestamp + token + NUL + options)"""
+        nonce = os.urandom(12)
+        plaintext = struct.pack('!d', time.time()) + self.token + b'\0' + options
+        try:
+            self.sock.sendto(b'ping' + self.index + nonce + self.aesgcm.encrypt(nonce, plaintext, None), server)
+        except (BlockingIOError, ConnectionRefusedError):
+            pass
+
+    def audio(self, seq, sample_pos, arrival):
+        self.packets += 1
+        if self.first_seq is None:
+            self.first_seq = self.last_seq = seq
+        elif sequence_distance(seq, self.last_seq) > 0:
+            self.last_seq = seq
+        # RFC 3550 interarrival jitter, with sample_pos as the media timestamp
+        transit = arrival - sample_pos / FRAMERATE
+        if self.transit is not None:
+            self.jitter += (abs(transit - self.transit) - self.jitter) / 16
+        self.transit = transit
+
+
+def run_listeners(server, sessions, options, measure_from, end_at, results):
+    """Child process: one UDP socket per listener, all served by one selector"""
+    selector = selectors.DefaultSelector()
+    listeners = []
+    for index, token, key in sessions:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setblocking(False)
+        listener = Listener(sock, index, token, key)
+        selector.register(sock, selectors.EVENT_READ, listener)
+        listeners.append(listener)
+
+    options = json.dumps(options).encode('utf-8')
+    buffer = bytearray(9000)
+    view = memoryview(buffer)
+    # Spread the pings over the interval, as independent clients would be
+    start = time.time()
+    next_ping = [start + PING_INTERVAL * n / len(listeners) for n in range(len(listeners))]
+    ping_cursor = 0
+    cpu = None
+
+    while True:
+        now = time.time()
+        if now >= end_at:
+            break
+        if cpu is None and now >= measure_from:
+            cpu = time.process_time()
+        while next_ping[ping_cursor] <= now:
+            listeners[ping_cursor].ping(server, options)
+            next_ping[ping_cursor] += PING_INTERVAL
+            ping_cursor = (ping_cursor + 1) % len(listeners)
+
+        for key, _ in selector.select(min(next_ping[ping_cursor], end_at) - now):
+            listener = key.data
+            while True:
+                try:
+                    length = listener.sock.recv_into(buffer)
+                except (BlockingIOError, ConnectionRefusedError):
+                    break
+                arrival = time.time()
+                if arrival < measure_from:
+                    continue
+                for kind, _, seq, sample_pos, _ in parse_frames(buffer, view, length):
+                    if kind == FRAME_AUDIO:
+                        listener.audio(seq, sample_pos, arrival)
+
+    for listener in listeners:
+        try:
+            listener.sock.sendto(b'quit', server)
+        except OSError:
+            pass
+        listener.sock.close()
+    results.put({
+        "cpu": time.process_time() - (cpu or 0),
+        "listeners": [(l.packets, sequence_distance(l.last_seq, l.first_seq) + 1 if l.first_seq is not None else 0,
+                       l.jitter) for l in listeners],
+    })
+
+
+def check_track_end(tmp):
+    """Play a track whose length is no multiple of any profile to one listener per codec and profile.
+
+    Returns the (codec, profile) pairs whose listener did not get every
+    sample position from 0 to the end of the track exactly once.
+    """
+    wav_path = os.path.join(tmp, "check.wav")
+    # One frame short of a whole unit: the most either profile can have left over
+    write_wav(wav_path, (6 * PROFILES["efficient"] - 1) / FRAMERATE)
+    with wave.open(wav_path, "rb") as wav:
+        track_frames = wav.getnframes()
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    engine = BroadcastEngine(host="127.0.0.1", port=port)
+    engine.auto_advance = False
+    engine.start()
+
+    selector = selectors.DefaultSelector()
+    listeners = {}
+    for codec in sorted(CODECS):
+        for profile in sorted(PROFILES):
+            token, index, key = generate_token(20), generate_token(10), generate_AES_key()
+            save_token(token, index, key)
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", 0))
+            sock.setblocking(False)
+            listener = Listener(sock, index, token, key)
+            listener.ping(("127.0.0.1", port), json.dumps({"codec": codec, "profile": profile}).encode('utf-8'))
+            selector.register(sock, selectors.EVENT_READ, (codec, profile))
+            listeners[codec, profile] = (listener, [])
+
+    deadline = time.time() + 5
+    while len(engine.udpclients) < len(listeners) and time.time() < deadline:
+        time.sleep(0.01)
+    engine.play(wav_path)
+
+    buffer = bytearray(9000)
+    view = memoryview(buffer)
+    quiet_from = None
+    while time.time() < deadline + 10:
+        if engine.playing:
+            quiet_from = None
+        elif quiet_from is None:
+            quiet_from = time.time()
+        elif time.time() - quiet_from > 0.3:
+            break
+        for key, _ in selector.select(0.05):
+            listener, covered = listeners[key.data]
+            while True:
+                try:
+                    length = listener.sock.recv_into(buffer)
+                except BlockingIOError:
+                    break
+                for kind, codec_id, _, sample_pos, payload in parse_frames(buffer, view, length):
+                    if kind == FRAME_AUDIO:
+                        pcm = CODEC_IDS[codec_id].decode(payload, 2)
+                        covered.append((sample_pos, len(pcm) // 4))
+    engine.shutdown()
+
+    failed = []
+    for key, (listener, covered) in listeners.items():
+        listener.sock.close()
+        position = 0
+        for sample_pos, frames in sorted(covered):
+            if sample_pos != position:
+                break
+            position += frames
+        if position != track_frames:
+            failed.append(key)
+            print(f"  {key[0]}/{key[1]}: contiguous up to sample {position} of {track_frames}")
+    return failed
+
+
+def run(count, args, wav_path):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    engine = BroadcastEngine(host="127.0.0.1", port=port, fanout=args.fanout, codec=args.codec,
+                             profile=args.profile, chunks_per_wakeup=args.chunks_per_wakeup)
+    engine.auto_advance = False
+    engine.start()
+
+    sessions = []
+    for _ in range(count):
+        token, index, key = generate_token(20), generate_token(10), generate_AES_key()
+        save_token(token, index, key)
+        sessions.append((index, token, key))
+
+    options = {"codec": args.codec, "profile": args.profile}
+    measure_from = time.time() + args.warmup
+    end_at = measure_from + args.seconds
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_listeners,
+                                         args=(("127.0.0.1", port), sessions[n::args.processes], options,
+                                               measure_from, end_at, results))
+                 for n in range(min(args.processes, count))]
+    for process in processes:
+        process.start()
+    engine.play(wav_path)
+
+    time.sleep(max(0, measure_from - time.time()))
+    registered = len(engine.udpclients)
+    engine.send_lags.clear()
+    packets_sent, _ = engine.fanout_totals()
+    wakeups = engine.pacing_clock.wakeups if engine.pacing_clock else 0
+    cpu = time.process_time()
+    time.sleep(max(0, end_at - time.time()))
+    cpu = time.process_time() - cpu
+    packets_sent = engine.fanout_totals()[0] - packets_sent
+    pacing = engine.pacing_stats()
+    reader = engine.pacing_clock.stats() if engine.pacing_clock else {}
+
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    engine.shutdown()
+
+    stats = [item for report in reports for item in report["listeners"]]
+    received = sum(packets for packets, _, _ in stats)
+    expected = sum(span for _, span, _ in stats)
+    jitters = sorted(jitter * 1000 for _, span, jitter in stats if span)
+    seconds = args.seconds
+
+    print(f"{count} listeners ({args.codec}, {args.profile}), {registered} registered at the start of the window")
+    print(f"  delivered: {received / seconds:9.0f} packets/s, {received / seconds / count:6.1f} per listener, "
+          f"{1 - received / expected if expected else 1:.2%} lost (engine sent {packets_sent / seconds:.0f}/s)")
+    if jitters:
+        print(f"  jitter ms: median listener {jitters[len(jitters) // 2]:.2f}, "
+              f"p99 listener {jitters[min(len(jitters) - 1, len(jitters) * 99 // 100)]:.2f}, worst {jitters[-1]:.2f}")
+    if pacing:
+        print(f"  send lag ms: p50 {pacing['p50']:.2f}, p99 {pacing['p99']:.2f}, max {pacing['max']:.2f} "
+              f"over {pacing['chunks']} chunks")
+    if reader:
+        print(f"  reader: {(reader['wakeups'] - wakeups) / seconds:.0f} wakeups/s, woke p50 {reader['p50']:.2f} ms, "
+              f"p99 {reader['p99']:.2f} ms late, {reader['slips']} schedule slip(s), drift {reader['drift']:.1f} ms")
+    print(f"  engine CPU: {cpu / seconds:.1%} of a core, {cpu / seconds / count * 1e6:.0f} us per listener-second; "
+          f"simulated listeners used {sum(report['cpu'] for report in reports) / seconds:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Broadcast engine benchmark with simulated listeners")
+    parser.add_argument("--listeners", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--seconds", type=float, default=10.0, help="measurement window")
+    parser.add_argument("--warmup", type=float, default=3.0, help="time for listeners to register first")
+    parser.add_argument("--codec", default="pcm", choices=sorted(CODECS))
+    parser.add_argument("--profile", default=DEFAULT_PROFILE, choices=sorted(PROFILES))
+    parser.add_argument("--fanout", default="auto", choices=["auto", "loop", "sendmmsg"])
+    parser.add_argument("--chunks-per-wakeup", type=int, default=1, help="chunks the engine's reader sends per wakeup")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="processes the simulated listeners are spread across")
+    args = parser.parse_args()
+    print(f"{os.cpu_count()} CPU(s); the simulated listeners share them with the engine")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        failed = check_track_end(tmp)
+        if failed:
+            print(f"FAILED: the end of the track was lost for {len(failed)} codec/profile listener(s)")
+            sys.exit(1)
+        print("Track end: every codec and profile received every sample")
+
+        wav_path = os.path.join(tmp, "bench.wav")
+        write_wav(wav_path, args.warmup + args.seconds + 5)
+        for count in args.listeners:
+            run(count, args, wav_path)
+
+
+if __name__ == "__main__":
+    main()
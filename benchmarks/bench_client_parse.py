@@ -0,0 +1,197 @@
+# bench_client_parse.py - Client receive path: concatenating parser vs recv_into + memoryview
+#
+# Also checks that every codec's decoded payloads, received through the ring,
+# are accepted by PyAudio's Stream.write.
+#
+# Usage: python benchmarks/bench_client_parse.py [--packets N] [--rate PPS] [--seconds S]
+import argparse
+import ctypes
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import AUDIO_HEADER, DatagramReader, PacketBuffer, FRAME_AUDIO
+from audio_codecs import CODECS
+
+
+def make_datagram(seq, frames_per_datagram, payload):
+    datagram = b''
+    for i in range(frames_per_datagram):
+        datagram += bytes(PacketBuffer().fill(payload, seq + i, (seq + i) * 256))
+    if seq % 50 == 0:
+        message = json.dumps({"type": "track_info", "track": "bench.wav"}).encode('utf-8')
+        datagram += b'JSON' + len(message).to_bytes(4, 'big') + message
+    return datagram
+
+
+def concat_parser(sock):
+    """The previous client loop: buffer += data, buffer = buffer[total_len:]"""
+    def parse(count):
+        buffer = b''
+        queued = []
+        for _ in range(count):
+            data, _ = sock.recvfrom(2048 * 4)
+            buffer += data
+            while buffer:
+                if buffer.startswith(b'AUDIO'):
+                    _, _, _, seq, sample_pos, data_len = AUDIO_HEADER.unpack_from(buffer)
+                    total_len = AUDIO_HEADER.size + data_len
+                    # Queued for playback, as the client did with each payload
+                    queued.append(buffer[AUDIO_HEADER.size:total_len])
+                    buffer = buffer[total_len:]
+                elif buffer.startswith(b'JSON'):
+                    msg_len = int.from_bytes(buffer[4:8], 'big')
+                    json.loads(buffer[8:8 + msg_len].decode('utf-8'))
+                    buffer = buffer[8 + msg_len:]
+                else:
+                    buffer = b''
+        return len(queued)
+    return parse
+
+
+def ring_parser(sock):
+    """The current client loop: recv_into a slot, memoryview frames"""
+    reader = DatagramReader(sock)
+
+    def parse(count):
+        queued = []
+        for _ in range(count):
+            for kind, _, seq, sample_pos, data in reader.receive():
+                if kind == FRAME_AUDIO:
+                    # The client copies each payload out of the ring as it queues it
+                    queued.append(bytes(data))
+                else:
+                    json.loads(bytes(data))
+        return len(queued)
+    return parse
+
+
+def burst(name, make_parser, frames_per_datagram, packets, batch=500):
+    """Queue batches of packets in the socket buffer, then time draining and parsing them"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+    receiver.bind(('127.0.0.1', 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    addr = receiver.getsockname()
+    payload = os.urandom(1024)
+    datagrams = [make_datagram(i * frames_per_datagram, frames_per_datagram, payload) for i in range(batch)]
+
+    parse = make_parser(receiver)
+    cpu = 0.0
+    frames = 0
+    for _ in range(packets // batch):
+        for datagram in datagrams:
+            sender.sendto(datagram, addr)
+        start = time.thread_time()
+        frames += parse(batch)
+        cpu += time.thread_time() - start
+
+    received = packets // batch * batch
+    print(f"  {name:<8} {frames_per_datagram} frame(s)/datagram: {cpu / received * 1e6:7.2f} us CPU per datagram, "
+          f"{frames} frames")
+    receiver.close()
+    sender.close()
+
+
+def write_error(frame):
+    """Parse frame the way PyAudio's write_stream does ("s#"), returning the error or None"""
+    parse = ctypes.pythonapi._PyArg_ParseTuple_SizeT
+    parse.restype = ctypes.c_int
+    data, length = ctypes.c_char_p(), ctypes.c_ssize_t()
+    try:
+        parse(ctypes.py_object((frame,)), b"s#", ctypes.byref(data), ctypes.byref(length))
+    except TypeError as e:
+        return str(e)
+    return None
+
+
+def check_playback():
+    """Receive one packet per codec through the ring and decode it as the client does before Stream.write"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    reader = DatagramReader(receiver)
+    pcm = os.urandom(256 * 4)
+    failed = False
+    for name, codec in sorted(CODECS.items()):
+        sender.sendto(bytes(PacketBuffer().fill(codec.encode(memoryview(pcm), 2), codec_id=codec.id)),
+                      receiver.getsockname())
+        _, _, _, _, payload = reader.receive()[0]
+        # At full volume the client writes the decoded frame unchanged
+        error = write_error(codec.decode(payload, 2))
+        failed = failed or error is not None
+        print(f"  {name:<6} {'ok' if error is None else 'Stream.write would fail: ' + error}")
+    receiver.close()
+    sender.close()
+    return not failed
+
+
+def paced(rate, seconds):
+    """Send AUDIO datagrams at a fixed rate and measure receiver CPU with the ring parser"""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1)
+    addr = receiver.getsockname()
+    total = int(rate * seconds)
+    payload = os.urandom(1024)
+
+    def send():
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        packet = PacketBuffer()
+        start = time.perf_counter()
+        for seq in range(total):
+            delay = start + seq / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sender.sendto(packet.fill(payload, seq, seq * 256), addr)
+        sender.close()
+
+    thread = threading.Thread(target=send, daemon=True)
+    thread.start()
+
+    reader = DatagramReader(receiver)
+    received = 0
+    cpu_start = time.thread_time()
+    wall_start = time.perf_counter()
+    try:
+        while received < total:
+            received += len(reader.receive())
+    except socket.timeout:
+        pass
+    wall = time.perf_counter() - wall_start
+    cpu = time.thread_time() - cpu_start
+    thread.join()
+
+    print(f"  {rate} packets/s for {seconds:.0f}s: received {received}/{total} ({received / wall:.0f}/s), "
+          f"receiver CPU {cpu / wall * 100:.1f}% of a core, {cpu / max(received, 1) * 1e6:.1f} us per packet")
+    receiver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Client datagram parser benchmark")
+    parser.add_argument("--packets", type=int, default=5000)
+    parser.add_argument("--rate", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    print("Playback path")
+    if not check_playback():
+        sys.exit(1)
+
+    print("Burst parse")
+    for frames_per_datagram in (1, 6):
+        burst("concat", concat_parser, frames_per_datagram, args.packets)
+        burst("ring", ring_parser, frames_per_datagram, args.packets)
+
+    print("Paced receive")
+    for rate in args.rate:
+        paced(rate, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench_codec.py - Compression ratio and encode/decode CPU of the AUDIO payload codecs
+#
+# Usage: python benchmarks/bench_codec.py [--wav FILE] [--seconds S] [--chunk FRAMES]
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_codecs import CODECS
+from wav_source import WavSource
+
+
+def synthetic(seconds, rate=44100):
+    """A few tones with a slow envelope plus noise, roughly like mastered music"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * rate)) / rate
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 0.25 * t)
+    left = envelope * (6000 * np.sin(2 * np.pi * 220 * t) + 3000 * np.sin(2 * np.pi * 1320 * t + 1)
+                       + 1500 * np.sin(2 * np.pi * 4400 * t)) + rng.normal(0, 300, len(t))
+    right = 0.8 * left + rng.normal(0, 300, len(t))
+    samples = np.clip(np.stack([left, right], axis=1), -32768, 32767).astype('<i2')
+    return samples.tobytes(), 2, rate
+
+
+def load_wav(path, seconds):
+    with WavSource(path) as source:
+        params = source.params
+        if params.sampwidth != 2:
+            sys.exit(f"{path}: only 16-bit WAV files can be compared across all codecs")
+        data = bytes(source.read(int(seconds * params.framerate) * params.nchannels * 2))
+    return data, params.nchannels, params.framerate
+
+
+def measure(codec, pcm, channels, rate, chunk_frames):
+    chunk_bytes = chunk_frames * channels * 2
+    chunks = [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)]
+
+    start = time.process_time()
+    encoded = [codec.encode(chunk, channels) for chunk in chunks]
+    encode_cpu = time.process_time() - start
+
+    start = time.process_time()
+    decoded = [codec.decode(memoryview(payload), channels) for payload in encoded]
+    decode_cpu = time.process_time() - start
+
+    lossless = all(bytes(a) == bytes(b) for a, b in zip(chunks, decoded))
+    if lossless:
+        quality = "lossless"
+    else:
+        original = np.frombuffer(pcm, dtype='<i2').astype(np.float64)
+        error = original - np.frombuffer(b''.join(decoded), dtype='<i2')
+        quality = f"SNR {10 * np.log10((original ** 2).sum() / (error ** 2).sum()):.1f} dB"
+    ratio = sum(len(payload) for payload in encoded) / len(pcm)
+    chunks_per_second = rate / chunk_frames
+    kbits = len(pcm) * 8 / (len(pcm) / (channels * 2) / rate) / 1000 * ratio
+
+    print(f"  {codec.name:<6} ratio {ratio:5.3f}  {kbits:7.0f} kbit/s  "
+          f"encode {encode_cpu / len(chunks) * 1e6:6.1f} us/chunk ({encode_cpu / len(chunks) * chunks_per_second * 100:4.1f}% of a core)  "
+          f"decode {decode_cpu / len(chunks) * 1e6:6.1f} us/chunk ({decode_cpu / len(chunks) * chunks_per_second * 100:4.1f}%)  "
+          f"{quality}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AUDIO payload codec benchmark")
+    parser.add_argument("--wav", help="16-bit WAV file to use instead of a synthetic signal")
+    parser.add_argument("--seconds", type=float, default=20.0)
+    parser.add_argument("--chunk", type=int, default=256, help="frames per chunk, as sent by the engine")
+    args = parser.parse_args()
+
+    if args.wav:
+        pcm, channels, rate = load_wav(args.wav, args.seconds)
+    else:
+        pcm, channels, rate = synthetic(args.seconds)
+
+    print(f"{len(pcm) / (channels * 2) / rate:.1f}s, {channels} channels, {rate} Hz, {args.chunk} frame chunks "
+          f"(real time = {rate / args.chunk:.0f} chunks/s)")
+    for codec in CODECS.values():
+        measure(codec, pcm, channels, rate, args.chunk)
+
+
+if __name__ == "__main__":
+    main()
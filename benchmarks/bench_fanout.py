@@ -0,0 +1,62 @@
+# bench_fanout.py - Packets/sec per core for the sendto loop vs batched sendmmsg
+#
+# Usage: python benchmarks/bench_fanout.py [--listeners 10 100 1000] [--seconds S]
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import PacketBuffer
+from fanout import BatchSender
+
+
+def run(mode, sock, destinations, packet, seconds):
+    sender = BatchSender(sock, mode)
+    sender.set_destinations(destinations)
+
+    wall_start = time.perf_counter()
+    while time.perf_counter() - wall_start < seconds:
+        sender.send(packet)
+    wall = time.perf_counter() - wall_start
+
+    print(f"  {sender.mode:<9} {sender.packets_sent / wall:10.0f} packets/s  "
+          f"{sender.packets_per_core_second():10.0f} packets per CPU-second  "
+          f"{sender.syscalls / wall:9.0f} syscalls/s  errors={sender.send_errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-listener fan-out benchmark")
+    parser.add_argument("--listeners", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--sinks", type=int, default=16,
+                        help="distinct receiving sockets; listeners are spread across them")
+    args = parser.parse_args()
+
+    sinks = []
+    for _ in range(args.sinks):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('127.0.0.1', 0))
+        sinks.append(sink)
+    addrs = [sink.getsockname() for sink in sinks]
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    packet = PacketBuffer().fill(os.urandom(1024))
+
+    modes = ["loop", "sendmmsg"] if BatchSender(sock).batched else ["loop"]
+    for count in args.listeners:
+        destinations = [addrs[i % len(addrs)] for i in range(count)]
+        print(f"{count} listeners, {len(packet)} byte packets")
+        for mode in modes:
+            run(mode, sock, destinations, packet, args.seconds)
+
+    sock.close()
+    for sink in sinks:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
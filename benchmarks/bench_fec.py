@@ -0,0 +1,66 @@
+# bench_fec.py - Residual loss and CPU cost of XOR parity at simulated loss rates
+#
+# Usage: python benchmarks/bench_fec.py [--loss P ...] [--group N ...] [--packets N] [--size BYTES]
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import FecEncoder, FecDecoder, ReorderBuffer, parse_frames
+
+
+def simulate(loss, group, packets, size):
+    """Drop audio and parity packets independently at rate loss, as on a lossy Wi-Fi link"""
+    rng = random.Random(0)
+    payload = os.urandom(size)
+    encoder = FecEncoder(group) if group else None
+    decoder = FecDecoder()
+    reorder = ReorderBuffer(depth=max(8, group + 2))
+    encode_cpu = decode_cpu = 0.0
+
+    for seq in range(packets):
+        ready = []
+        if rng.random() >= loss:
+            start = time.process_time()
+            ready = [(seq, seq * 256, payload)] + decoder.add_audio(seq, seq * 256, payload)
+            decode_cpu += time.process_time() - start
+
+        if encoder:
+            start = time.process_time()
+            frame = encoder.add(seq, seq * 256, payload)
+            encode_cpu += time.process_time() - start
+            if frame and rng.random() >= loss:
+                buffer = bytearray(frame)
+                start = time.process_time()
+                for _, _, first, count, data in parse_frames(buffer, memoryview(buffer), len(buffer)):
+                    ready += decoder.add_parity(first, count, data)
+                decode_cpu += time.process_time() - start
+
+        for packet in ready:
+            reorder.push(*packet)
+    reorder.flush()
+
+    overhead = f"{100 / group:5.1f}%" if group else "   0%"
+    print(f"  loss {loss * 100:4.1f}%  group {group or '-':>3}  overhead {overhead}  "
+          f"residual loss {reorder.loss_rate() * 100:5.2f}%  recovered {decoder.recovered:5}  "
+          f"encode {encode_cpu / packets * 1e6:5.2f} us/packet  decode {decode_cpu / packets * 1e6:5.2f} us/packet")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FEC parity benchmark")
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.01, 0.05, 0.1])
+    parser.add_argument("--group", type=int, nargs="+", default=[0, 4, 8, 16])
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument("--size", type=int, default=1024, help="AUDIO payload bytes (1024 = one PCM chunk)")
+    args = parser.parse_args()
+
+    for loss in args.loss:
+        for group in args.group:
+            simulate(loss, group, args.packets, args.size)
+
+
+if __name__ == "__main__":
+    main()
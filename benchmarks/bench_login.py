@@ -0,0 +1,251 @@
+# bench_login.py - Login server throughput, latency percentiles and CPU under many concurrent TLS clients
+#
+# Starts loginserver in a child process with a throwaway certificate and user
+# database, then has N client threads send login/refresh/register requests at
+# once, like listeners reconnecting after a server restart.
+#
+# Usage: python benchmarks/bench_login.py [--clients N] [--requests N] [--actions login refresh register]
+#                                         [--users N] [--max-connections N] [--max-pending N]
+#                                         [--retry-busy] [--no-resume]
+import argparse
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loginserver
+from userstore import UserStore
+
+try:
+    import resource
+except ImportError:  # Windows: no CPU time for the bcrypt workers
+    resource = None
+
+
+PASSWORD = "password"
+
+
+def make_certificate(cert_path, key_path):
+    """Self-signed RSA certificate like the one the real server uses"""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                  serialization.NoEncryption()))
+
+
+def server_stats(server):
+    return {"cpu": time.process_time(), "handshakes": server.handshakes, "resumed": server.resumed,
+            "busy": server.busy_responses, "refreshes": server.refreshes}
+
+
+def run_server(workdir, port, max_connections, max_pending, control):
+    """Child process: the login server, answering "stats"/"stop" on the control pipe"""
+    sys.stdout = open(os.devnull, "w")
+    os.chdir(workdir)
+    loginserver.HOST = "127.0.0.1"
+    loginserver.PORT = port
+    loginserver.CERT_FILE = "cert.pem"
+    loginserver.KEY_FILE = "key.pem"
+    server = loginserver.LoginServer(max_connections, max_pending)
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        serving = loop.create_task(server.serve())
+        while await loop.run_in_executor(None, control.recv) != "stop":
+            control.send(server_stats(server))
+        serving.cancel()
+
+    loginserver.get_user_store()
+    loginserver.get_hash_pool()
+    asyncio.run(main())
+    # Wait for the bcrypt workers to exit so their CPU time shows up as our children's
+    loginserver.hash_pool.shutdown()
+    stats = server_stats(server)
+    if resource is not None:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        stats["hash_cpu"] = usage.ru_utime + usage.ru_stime
+    control.send(stats)
+
+
+def request(context, port, message, session):
+    """One TLS connection and JSON request, as Client.send_login_request does it"""
+    with socket.create_connection(("127.0.0.1", port), timeout=60) as sock:
+        with context.wrap_socket(sock, server_hostname="localhost", session=session) as ssock:
+            ssock.sendall(json.dumps(message).encode('utf-8'))
+            reply = ssock.recv(4096).decode('utf-8').strip()
+            session = ssock.session
+    try:
+        return json.loads(reply), session
+    except json.JSONDecodeError:
+        return reply, session
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def run_phase(action, args, port, context, clients, control, run_id):
+    per_client = max(1, args.requests // args.clients)
+    barrier = threading.Barrier(args.clients)
+    results = [[] for _ in clients]
+
+    def send(state, message, retry_busy=args.retry_busy):
+        """Send until the reply is not busy (or once, without retry_busy); returns the status"""
+        while True:
+            try:
+                reply, session = request(context, port, message, state["session"] if args.resume else None)
+            except (OSError, ssl.SSLError):
+                return "error"
+            state["session"] = session
+            status = reply.get("status", "?") if isinstance(reply, dict) else reply
+            if status == "busy" and retry_busy:
+                time.sleep(min(float(reply.get("retry_after", 1)), 30) + random.uniform(0, 1))
+                continue
+            if status == "success":
+                state["refresh"] = reply.get("refresh")
+            return status
+
+    def login_message(n):
+        return {"type": "login", "username": f"user{n % args.users}", "password": PASSWORD}
+
+    def warm_up(n):
+        """Log in once (untimed) so the client has a refresh token"""
+        if not clients[n].get("refresh"):
+            send(clients[n], login_message(n), retry_busy=True)
+
+    def client(n):
+        state = clients[n]
+        barrier.wait()
+        for i in range(per_client):
+            if action == "login":
+                message = login_message(n)
+            elif action == "refresh":
+                message = {"type": "refresh", "refresh": state.get("refresh") or ""}
+            else:
+                message = {"type": "register", "username": f"new{run_id}_{n}_{i}", "password": PASSWORD}
+            start = time.perf_counter()
+            status = send(state, message)
+            results[n].append((status, time.perf_counter() - start))
+
+    if action == "refresh":
+        threads = [threading.Thread(target=warm_up, args=(n,)) for n in range(args.clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(args.clients)]
+    control.send("stats")
+    before = control.recv()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+    control.send("stats")
+    after = control.recv()
+
+    statuses = {}
+    latencies = []
+    for status, seconds in (item for items in results for item in items):
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == "success":
+            latencies.append(seconds * 1000)
+    latencies.sort()
+    handshakes = after["handshakes"] - before["handshakes"]
+
+    print(f"{action:<9} {per_client * args.clients} requests from {args.clients} clients in {elapsed:.2f}s: "
+          f"{statuses.get('success', 0) / elapsed:.1f} successful/s "
+          f"({', '.join(f'{count} {status}' for status, count in sorted(statuses.items()))})")
+    print(f"          latency ms: p50 {percentile(latencies, 50):.1f}  p90 {percentile(latencies, 90):.1f}  "
+          f"p99 {percentile(latencies, 99):.1f}  max {latencies[-1] if latencies else float('nan'):.1f}")
+    print(f"          CPU s: server loop {after['cpu'] - before['cpu']:.2f}, clients {cpu:.2f}; "
+          f"TLS resumed {after['resumed'] - before['resumed']}/{handshakes}, "
+          f"busy responses {after['busy'] - before['busy']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login server load benchmark")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent client threads")
+    parser.add_argument("--requests", type=int, default=64, help="requests per action, split across clients")
+    parser.add_argument("--actions", nargs="+", default=["login", "refresh", "register"],
+                        choices=["login", "refresh", "register"])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--max-connections", type=int, default=loginserver.MAX_CONNECTIONS)
+    parser.add_argument("--max-pending", type=int, default=loginserver.MAX_PENDING_HASHES)
+    parser.add_argument("--retry-busy", action="store_true", help="retry busy responses after retry_after, like the client")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="full TLS handshake every time")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_certificate(os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem"))
+        # Every user gets the same hash: verifying it costs the same 12 rounds
+        hashed = bcrypt.hashpw(PASSWORD.encode('utf-8'), bcrypt.gensalt())
+        store = UserStore(os.path.join(tmp, loginserver.USER_DB))
+        for n in range(args.users):
+            store.add_user(f"user{n}", hashed)
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        control, child_control = multiprocessing.Pipe()
+        server = multiprocessing.Process(target=run_server,
+                                         args=(tmp, port, args.max_connections, args.max_pending, child_control))
+        server.start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.load_verify_locations(os.path.join(tmp, "cert.pem"))
+        print(f"{args.users} users, {loginserver.HASH_WORKERS} bcrypt worker(s), "
+              f"max {args.max_connections} connections / {args.max_pending} pending hashes")
+
+        clients = [{"session": None, "refresh": None} for _ in range(args.clients)]
+        run_id = os.getpid()
+        try:
+            for action in args.actions:
+                run_phase(action, args, port, context, clients, control, run_id)
+        finally:
+            control.send("stop")
+            final = control.recv()
+            server.join()
+        if "hash_cpu" in final:
+            print(f"bcrypt worker CPU over the whole run: {final['hash_cpu']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
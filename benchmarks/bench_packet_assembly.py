@@ -0,0 +1,155 @@
+# bench_packet_assembly.py - Compare ways of building and sending AUDIO packets
+#
+# Each way is timed over several rounds, and its allocations are traced with
+# tracemalloc: the most allocated at once while building and sending one
+# packet, and what is still held after a batch of packets.
+#
+# Usage: python benchmarks/bench_packet_assembly.py [--packets N] [--listeners N] [--rounds N]
+import argparse
+import os
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from protocol import AUDIO_HEADER, AUDIO_VERSION, PacketBuffer
+from packetizer import Substream, DEFAULT_PROFILE
+from audio_codecs import PcmCodec
+
+
+CHUNK_BYTES = 256 * 4  # 256 stereo 16-bit frames, as sent by the engine
+
+
+class CopySender:
+    """The original path: slice the track, concatenate header and payload"""
+    name = "concat"
+
+    def __init__(self, track):
+        self.track = track
+
+    def send(self, sock, position, addrs):
+        audio_data = self.track[position:position + CHUNK_BYTES]
+        packet = b'AUDIO' + len(audio_data).to_bytes(4, 'big') + audio_data
+        for addr in addrs:
+            sock.sendto(packet, addr)
+
+
+class ScatterSender:
+    """memoryview chunk, header packed in place, header + chunk via sendmsg"""
+    name = "sendmsg"
+
+    def __init__(self, track):
+        self.view = memoryview(track)
+        self.header = bytearray(AUDIO_HEADER.size)
+        self.iov = [self.header, b'']
+
+    def send(self, sock, position, addrs):
+        audio_data = self.view[position:position + CHUNK_BYTES]
+        AUDIO_HEADER.pack_into(self.header, 0, b'AUDIO', AUDIO_VERSION, 0, position, position, len(audio_data))
+        self.iov[1] = audio_data
+        for addr in addrs:
+            sock.sendmsg(self.iov, (), 0, addr)
+
+
+class BufferSender:
+    """memoryview chunk copied once into a reused packet"""
+    name = "reused buf"
+
+    def __init__(self, track):
+        self.view = memoryview(track)
+        self.packet = PacketBuffer(CHUNK_BYTES)
+
+    def send(self, sock, position, addrs):
+        packet = self.packet.fill(self.view[position:position + CHUNK_BYTES], position, position)
+        for addr in addrs:
+            sock.sendto(packet, addr)
+
+
+class SubstreamSender:
+    """The engine path: a PCM low-latency Substream sending each chunk with sendto"""
+    name = "substream"
+
+    def __init__(self, track):
+        self.view = memoryview(track)
+        self.substream = None
+
+    def send(self, sock, position, addrs):
+        if self.substream is None:
+            self.substream = Substream(sock, PcmCodec(), DEFAULT_PROFILE, 1500, "loop")
+            self.substream.set_destinations(addrs)
+            self.substream.start_track(2, 4)
+        self.substream.send(self.view[position:position + CHUNK_BYTES], position // 4)
+
+
+def measure(sender, sock, addrs, packets, track_len, rounds):
+    """Return the time of each round, and bytes allocated (peak per packet, still held after 1000)"""
+    positions = [(i * CHUNK_BYTES) % (track_len - CHUNK_BYTES) for i in range(packets)]
+
+    # Warm up so lazily created objects are not counted
+    for position in positions[:1000]:
+        sender.send(sock, position, addrs)
+
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for position in positions:
+            sender.send(sock, position, addrs)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    peak = 0
+    baseline = tracemalloc.get_traced_memory()[0]
+    for position in positions[:1000]:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        sender.send(sock, position, addrs)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    held = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    sends = packets * len(addrs)
+    best = min(times)
+    print(f"{sender.name:<11} {statistics.median(times) / sends * 1e9:7.0f} ns/send median "
+          f"({best / sends * 1e9:.0f}-{max(times) / sends * 1e9:.0f})  {sends / best:9.0f} sends/s  "
+          f"{peak:5d} B peak per packet  {held:6d} B held after 1000")
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AUDIO packet assembly microbenchmark")
+    parser.add_argument("--packets", type=int, default=50000)
+    parser.add_argument("--listeners", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5, help="timed passes over the packets per way")
+    args = parser.parse_args()
+
+    # Listeners are sockets that never read; the kernel drops what does not fit
+    sinks = []
+    for _ in range(args.listeners):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(('127.0.0.1', 0))
+        sinks.append(sink)
+    addrs = [sink.getsockname() for sink in sinks]
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    track = os.urandom(CHUNK_BYTES * 1000)
+
+    senders = [CopySender(track), BufferSender(track), SubstreamSender(track)]
+    if hasattr(socket.socket, 'sendmsg'):
+        senders.insert(1, ScatterSender(track))
+
+    print(f"{args.packets} packets x {args.listeners} listeners, {CHUNK_BYTES} byte payload, {args.rounds} rounds")
+    times = [measure(sender, sock, addrs, args.packets, len(track), args.rounds) for sender in senders]
+    # Round by round, so a slow spell on the machine hits both sides of each ratio
+    ratios = sorted(concat / buffer for concat, buffer in zip(times[0], times[-2]))
+    print(f"reused buf vs concat: {statistics.median(ratios):.2f}x median, {ratios[0]:.2f}-{ratios[-1]:.2f}x over rounds")
+
+    sock.close()
+    for sink in sinks:
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# bench_userstore.py - Login server user lookups: shelve opened per request vs the SQLite UserStore
+#
+# Usage: python benchmarks/bench_userstore.py [--users N] [--lookups N] [--shelve-lookups N] [--threads N ...]
+import argparse
+import os
+import shelve
+import sys
+import tempfile
+import threading
+import time
+
+import bcrypt
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from userstore import UserStore
+
+
+def shelve_lookup(path, lock):
+    """The previous handle_client: open the shelve under the global lock for every request"""
+    def lookup(username):
+        with lock:
+            with shelve.open(path, writeback=True) as db:
+                return db[username] if username in db else None
+    return lookup
+
+
+def run(name, lookup, users, lookups, threads):
+    per_thread = lookups // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            assert lookup(f"user{(offset + i * 7919) % users}") is not None
+
+    workers = [threading.Thread(target=worker, args=(n * 1000,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<8} {threads} thread(s): {per_thread * threads / elapsed:9.0f} lookups/s "
+          f"({elapsed / (per_thread * threads) * 1e6:7.1f} us each)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User store benchmark")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--shelve-lookups", type=int, default=100, help="the shelve takes tens of ms per lookup")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy = os.path.join(tmp, "users.db")
+        hashed = bcrypt.hashpw(b"password", bcrypt.gensalt(rounds=4))
+        with shelve.open(legacy) as db:
+            for i in range(args.users):
+                db[f"user{i}"] = hashed
+
+        start = time.perf_counter()
+        store = UserStore(os.path.join(tmp, "users.sqlite3"), legacy_shelve=legacy)
+        print(f"{args.users} users, migrated from shelve in {time.perf_counter() - start:.2f}s")
+
+        lock = threading.Lock()
+        for threads in args.threads:
+            run("shelve", shelve_lookup(legacy, lock), args.users, args.shelve_lookups, threads)
+            run("sqlite", store.get_hash, args.users, args.lookups, threads)
+
+    # What a login costs on top of the lookup, at the work factor hash_password uses
+    hashed = bcrypt.hashpw(b"password", bcrypt.gensalt())
+    start = time.perf_counter()
+    bcrypt.checkpw(b"password", hashed)
+    verify = time.perf_counter() - start
+    print(f"bcrypt verify (12 rounds): {verify * 1000:.0f} ms, so at most {1 / verify:.1f} logins/s per core")
+
+
+if __name__ == "__main__":
+    main()
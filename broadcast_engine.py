@@ -0,0 +1,1159 @@
+# broadcast_engine.py - Headless UDP broadcast engine for PyWaves Radio
+import socket
+import threading
+import json
+import os
+import time
+import queue
+import struct
+import argparse
+import hmac
+import ipaddress
+from collections import deque
+from datetime import datetime, timedelta
+from dataclasses import dataclass
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from loginserver import start_server, active_tokens, TOKEN_VALID_HOURS
+from wav_source import WavSource
+from control_plane import ControlPlane
+from audio_codecs import CODECS, get_codec, PcmCodec
+from packetizer import Substream, PROFILES, DEFAULT_PROFILE, MIN_MTU, MAX_MTU, MAX_FEC_GROUP
+from protocol import parse_nack
+from ratelimit import TokenBucket
+from pacing import SampleClock, MAX_CATCH_UP
+from metrics import Histogram, Metric, REGISTRY, METRICS_HOST, METRICS_PORT, start_metrics_server
+
+
+# PortAudio sample formats (same values as pyaudio.paInt8 ... pyaudio.paInt32),
+# so the engine can describe the stream without importing PyAudio
+PA_INT8 = 0x10
+PA_INT16 = 0x08
+PA_INT24 = 0x04
+PA_INT32 = 0x02
+SAMPLE_FORMATS = {1: PA_INT8, 2: PA_INT16, 3: PA_INT24, 4: PA_INT32}
+
+# Ping layout: b'ping', token index (10), nonce (12), then AES-GCM over
+# timestamp (8) + token [+ NUL + options JSON] with a 16 byte tag
+PING_MIN_SIZE = 4 + 10 + 12 + 8 + 1 + 16
+PING_MAX_SIZE = 1024
+# Pings that fail authentication, per source address
+PING_FAILURE_RATE = 1
+PING_FAILURE_BURST = 10
+PING_FAILURE_SOURCES = 4096
+# Chunks whose send lag is kept for pacing_stats()
+LAG_SAMPLES = 4096
+
+@dataclass
+class UdpClient:
+    addr: tuple  # IPv4: (host, port)
+    active: bool
+    lastping: datetime
+    index: str = ""  # token index of the session its last good ping used
+    codec: str = ""  # requested in the listener's pings; "" = station default
+    profile: str = ""  # latency profile, likewise
+    fec: bool = False  # wants XOR parity frames
+    retransmit_budget: TokenBucket = None  # created on the first NACK
+    # Audio/parity packets and bytes sent, settled when the listener set changes
+    packets_sent: int = 0
+    bytes_sent: int = 0
+    traffic_mark: tuple = None  # (fanouts, their packets, their bytes) at the last settle
+
+
+class EngineObserver:
+    """Receives engine events; the default implementation ignores them"""
+
+    def log(self, message, level="info"):
+        pass
+
+    def client_count_changed(self, count):
+        pass
+
+    def track_started(self, track):
+        pass
+
+    def track_finished(self):
+        pass
+
+
+class ConsoleObserver(EngineObserver):
+    """Observer that prints engine events, used when running headless"""
+
+    def __init__(self, station=None):
+        # Tags every line when several stations share the console
+        self.prefix = f"[{station}] " if station else ""
+
+    def log(self, message, level="info"):
+        timestamp = datetime.now().strftime("%H:%M:%S")
+        print(f"[{timestamp}] [{level}] {self.prefix}{message}", flush=True)
+
+    def client_count_changed(self, count):
+        self.log(f"{count} listener(s) connected")
+
+
+class BroadcastEngine:
+    """UDP streaming engine: listener table, frame reader and broadcaster.
+
+    The engine never touches a GUI. Front ends subscribe through an
+    EngineObserver, whose callbacks are invoked from engine threads.
+    """
+
+    def __init__(self, host='0.0.0.0', port=12345, observer=None, fanout="auto",
+                 multicast=None, multicast_ttl=1, codec="pcm", codecs=None,
+                 profile=DEFAULT_PROFILE, mtu=1500, fec_group=8, retransmit_history=512,
+                 retransmit_rate=50, chunks_per_wakeup=1, station=None):
+        self.observer = observer or EngineObserver()
+        # Several engines (stations) can run in one process, each on its own
+        # port; they share the login server's sessions. The name labels metrics.
+        self.station = station or str(port)
+
+        # Server settings
+        self.host = host
+        self.port = port
+        self.server_socket = None
+        self.udpclients = {}
+        self.current_track = ""
+        self.playlist = []
+        self.index = 0
+        self.TOKEN_VALID_HOURS = TOKEN_VALID_HOURS
+        self.auto_advance = True
+
+        # Fan-out: one substream per (codec, latency profile), each with its
+        # own BatchSender. The broadcaster rebuilds destination lists only
+        # when listener_version changes.
+        self.fanout_mode = fanout
+        self.substreams = {}
+        self.listener_version = 0
+        if profile not in PROFILES:
+            raise ValueError(f"unknown latency profile {profile!r}")
+        self.profile = profile
+        self.mtu = mtu
+        # Listeners that ask for FEC get one parity frame per fec_group audio
+        # packets of their substream; 0 turns FEC off
+        self.fec_group = fec_group
+        # NACKed packets are resent from each substream's history ring, at
+        # most retransmit_rate per second per listener and 20 times that
+        # for the whole station; a history of 0 turns retransmission off
+        self.retransmit_history = retransmit_history
+        self.retransmit_rate = retransmit_rate
+        self.retransmit_budget = TokenBucket(20 * retransmit_rate)
+        self.retransmitted = 0
+        self.retransmit_misses = 0
+        self.retransmit_limited = 0
+        # Ping authentication: one AESGCM per token index, and a failure
+        # budget per source address so garbage floods are dropped before
+        # any decryption is attempted
+        self.ping_ciphers = {}
+        self.ping_failures = {}
+        self.pings_accepted = 0
+        self.pings_rejected = 0
+        self.pings_limited = 0
+        self.read_unit_cache = (None, 0)
+        self.fanout_report_interval = 30
+        # The reader wakes on a SampleClock and sends chunks_per_wakeup
+        # chunks each time. Send lag is how long after the deadline of its
+        # wakeup each chunk went out.
+        if chunks_per_wakeup < 1:
+            raise ValueError(f"chunks_per_wakeup must be at least 1, got {chunks_per_wakeup}")
+        self.chunks_per_wakeup = chunks_per_wakeup
+        self.pacing_clock = None
+        self.send_lags = deque(maxlen=LAG_SAMPLES)
+        # For the metrics endpoint: send lag, and how late the reader woke
+        self.send_lag = Histogram()
+        self.reader_lag = Histogram()
+
+        # Multicast: (group, port) to send every AUDIO/JSON packet to once.
+        # Listeners still ping the unicast port to be counted and authorized.
+        self.multicast_group = multicast
+        self.multicast_ttl = multicast_ttl
+        self.multicast_socket = None
+
+        # Audio settings
+        self.chunk_size = 256
+        self.buffer_chunks = 8
+        self.audio_queue = queue.Queue(maxsize=50)
+        self.playing = False
+        self.sampwidth = PA_INT16
+        self.params = None
+        # Seconds sent of the current track: exact, and whole seconds for display
+        self.current_track_position = 0.0
+        self.current_track_elapsed = 0
+
+        # Payload codecs: listeners pick one of the offered codecs in their
+        # pings, and each chunk is encoded once per codec in use. Tracks a
+        # codec cannot handle are sent to its listeners as PCM.
+        self.codec = get_codec(codec)
+        self.codecs = [get_codec(name) for name in (codecs or CODECS)]
+        if self.codec not in self.codecs:
+            self.codecs.insert(0, self.codec)
+        self.stream_codecs = {c.name: c for c in self.codecs}
+
+        # Audio data
+        self.audio_source = None
+        self.audio_position = 0
+
+        # Threading controls
+        self.control_plane = None
+        self.frame_reader_thread = None
+        self.broadcast_thread = None
+        # Each track gets its own stop_event; playback_lock is held while
+        # one track is swapped for another
+        self.stop_event = threading.Event()
+        self.playback_lock = threading.RLock()
+        self.last_client_count = 0
+
+    def log_message(self, message, level="info"):
+        """Forward a log line to the observer"""
+        self.observer.log(message, level)
+
+    # Server lifecycle
+    def start(self):
+        """Bind the UDP socket and start accepting listeners"""
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((self.host, self.port))
+        self.server_socket.setblocking(False)
+
+        if self.multicast_group:
+            self.multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicast_ttl)
+            self.multicast_socket.setblocking(False)
+            # One group, one stream: everyone gets the station default codec and profile
+            self.substreams = {(name, self.profile): Substream(self.multicast_socket, CODECS[name], self.profile,
+                                                              self.mtu, self.fanout_mode, self.fec_group,
+                                                              self.retransmit_history)
+                               for name in {self.codec.name, "pcm"}}
+            self.log_message(f"Multicast to {self.multicast_group[0]}:{self.multicast_group[1]} "
+                             f"(TTL {self.multicast_ttl})", "info")
+        else:
+            self.substreams = {(name, profile): Substream(self.server_socket, CODECS[name], profile,
+                                                          self.mtu, self.fanout_mode, self.fec_group,
+                                                          self.retransmit_history)
+                               for name in {c.name for c in self.codecs} | {"pcm"} for profile in PROFILES}
+            self.log_message(f"Audio fan-out mode: {self.substreams['pcm', DEFAULT_PROFILE].fanout.mode}", "info")
+
+        self.control_plane = ControlPlane(self, self.server_socket)
+        self.control_plane.start()
+        REGISTRY.register(self.collect_metrics)
+        self.log_message("Waiting for client connections...", "info")
+
+    def shutdown(self):
+        """Stop playback, close the socket and forget all listeners"""
+        if self.playing:
+            self.stop_audio()
+
+        self.stop_event.set()
+        REGISTRY.unregister(self.collect_metrics)
+
+        if self.control_plane:
+            self.control_plane.stop()
+            self.control_plane = None
+
+        if self.server_socket:
+            self.server_socket.close()
+            self.server_socket = None
+
+        if self.multicast_socket:
+            self.multicast_socket.close()
+            self.multicast_socket = None
+
+        self.udpclients = {}
+        self.listeners_changed()
+        self.notify_client_count()
+
+    # Playlist handling (used when no front end drives the engine)
+    def load_playlist(self, playlist_file):
+        """Load a playlist saved by the server GUI"""
+        try:
+            with open(playlist_file, 'r') as f:
+                playlist_data = json.load(f)
+        except Exception as e:
+            self.log_message(f"Error loading playlist: {str(e)}", "error")
+            return
+
+        for file_path in playlist_data.get("playlist", []):
+            if os.path.exists(file_path):
+                self.playlist.append(file_path)
+            else:
+                self.log_message(f"File not found: {file_path}", "warning")
+
+        self.log_message(f"Loaded {len(self.playlist)} tracks from {playlist_file}", "success")
+
+    def play_index(self, index):
+        """Start playing the playlist entry at index"""
+        if not self.playlist:
+            return
+
+        if self.playing:
+            self.stop_playback()
+
+        self.index = index % len(self.playlist)
+        self.play(self.playlist[self.index])
+
+    def next_track(self):
+        """Play next track in playlist"""
+        self.play_index(self.index + 1)
+
+    def previous_track(self):
+        """Play previous track in playlist"""
+        self.play_index(self.index - 1)
+
+    # Playback control
+    def play(self, file_path):
+        """Start broadcasting a track, stopping the one before it"""
+        with self.playback_lock:
+            # The previous track's threads are stopped here and joined by the
+            # new reader before it queues anything, so tracks never interleave
+            self.stop_event.set()
+            previous = [thread for thread in (self.frame_reader_thread, self.broadcast_thread)
+                        if thread is not None and thread is not threading.current_thread()]
+            stop_event = self.stop_event = threading.Event()
+
+            self.current_track = os.path.basename(file_path)
+            self.clear_audio_queue()
+
+            # Send track info
+            self.send_json({"type": "track_info", "track": self.current_track})
+
+            self.playing = True
+
+            # Start frame reading thread
+            self.frame_reader_thread = threading.Thread(
+                target=self.read_frames_optimized,
+                args=(file_path, stop_event, previous),
+                daemon=True
+            )
+            self.frame_reader_thread.start()
+        self.observer.track_started(self.current_track)
+
+    def stop_playback(self):
+        """Tell listeners to stop and halt the current track"""
+        self.send_json({"type": "stop", "track": ""})
+        self.stop_audio()
+
+    def stop_audio(self):
+        """Stop audio playback threads"""
+        with self.playback_lock:
+            self.playing = False
+            self.stop_event.set()
+            self.clear_audio_queue()
+            self.current_track_position = 0.0
+            self.current_track_elapsed = 0
+
+    def finish_track(self, stop_event):
+        """A track played to its end: stop, and move on unless another track was started meanwhile"""
+        with self.playback_lock:
+            if self.stop_event is not stop_event or stop_event.is_set():
+                return
+            self.log_message("Track completed", "info")
+            self.stop_audio()
+        self.observer.track_finished()
+
+        if self.auto_advance:
+            time.sleep(0.5)
+            with self.playback_lock:
+                if self.stop_event is stop_event:
+                    self.next_track()
+
+    def clear_audio_queue(self):
+        """Drop any chunks waiting to be broadcast"""
+        while not self.audio_queue.empty():
+            try:
+                self.audio_queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def read_frames_optimized(self, filename, stop_event, previous=()):
+        """Optimized frame reading with better buffering"""
+        for thread in previous:
+            thread.join()
+        if stop_event.is_set():
+            return
+        # Anything the previous track queued before it stopped
+        self.clear_audio_queue()
+        self.log_message(f"Starting playback: {os.path.basename(filename)}", "info")
+
+        source = None
+        try:
+            source = self.audio_source = self.load_audio_file(filename)
+            self.params = source.params
+            self.audio_position = 0
+            self.sampwidth = SAMPLE_FORMATS.get(self.params.sampwidth, PA_INT16)
+            stream_codecs = {}
+            for codec in self.codecs:
+                if codec.supports(self.params.sampwidth):
+                    stream_codecs[codec.name] = codec
+                else:
+                    self.log_message(f"Codec {codec.name} does not support {self.params.sampwidth * 8}-bit audio, "
+                                     f"sending PCM instead", "warning")
+                    stream_codecs[codec.name] = PcmCodec()
+            self.stream_codecs = stream_codecs
+            self.listeners_changed()
+
+            self.send_format_info()
+
+            bytes_per_frame = self.params.nchannels * self.params.sampwidth
+
+            # Prebuffer the same amount of audio whatever the read size
+            read_frames = self.read_unit()
+            for _ in range(max(1, self.buffer_chunks * self.chunk_size // read_frames)):
+                if source.remaining > 0 and not stop_event.is_set():
+                    sample_pos = source.position // bytes_per_frame
+                    data = source.read(read_frames * bytes_per_frame)
+
+                    if data:
+                        try:
+                            # Prebuffered: sent ahead of any schedule, so no deadline
+                            self.audio_queue.put((sample_pos, data, None), timeout=0.1)
+                            self.audio_position = source.position
+                        except queue.Full:
+                            source.seek(self.audio_position)
+                            break
+
+            if stop_event.is_set():
+                return
+            track_sent = threading.Event()
+            self.broadcast_thread = threading.Thread(target=self.broadcast_audio_loop, args=(stop_event, track_sent),
+                                                     daemon=True)
+            self.broadcast_thread.start()
+
+            self.current_track_position = 0.0
+            self.current_track_elapsed = 0
+            clock = self.pacing_clock = SampleClock(self.params.framerate)
+            data = b""
+
+            while source.remaining > 0 and not stop_event.is_set():
+                try:
+                    # Wake once per chunks_per_wakeup units of the lowest-latency profile in use
+                    read_frames = self.read_unit()
+                    self.reader_lag.observe(clock.wait(read_frames * self.chunks_per_wakeup, stop_event))
+                    # Every chunk of this wakeup is due now, however far into the batch it is
+                    deadline = clock.due()
+
+                    for _ in range(self.chunks_per_wakeup):
+                        sample_pos = source.position // bytes_per_frame
+                        data = source.read(read_frames * bytes_per_frame)
+                        if not data:
+                            break
+                        self.audio_queue.put((sample_pos, data, deadline), timeout=0.1)
+                        self.audio_position = source.position
+                        clock.advance(len(data) // bytes_per_frame)
+
+                    if not data:
+                        break
+
+                    if not stop_event.is_set():
+                        self.current_track_position = clock.position()
+                        self.current_track_elapsed = int(self.current_track_position)
+
+                except queue.Full:
+                    # Re-read the chunk that did not fit on the next pass
+                    source.seek(self.audio_position)
+                    time.sleep(0.01)
+                    continue
+                except Exception as e:
+                    self.log_message(f"Error in frame reading: {str(e)}", "error")
+                    break
+
+            if source.remaining <= 0:
+                # Let the broadcaster send the rest of the track, including the
+                # incomplete units its substreams are still holding, before stopping
+                end = (source.position // bytes_per_frame, None, None)
+                while not stop_event.is_set():
+                    try:
+                        self.audio_queue.put(end, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                while not stop_event.is_set() and not track_sent.wait(0.1):
+                    pass
+                self.finish_track(stop_event)
+
+        except Exception as e:
+            self.log_message(f"Error in playback: {str(e)}", "error")
+            with self.playback_lock:
+                if self.stop_event is stop_event:
+                    self.playing = False
+        finally:
+            if source is not None:
+                source.close()
+
+    def broadcast_audio_loop(self, stop_event, track_sent):
+        """Separate thread for broadcasting audio to clients; sets track_sent once the end of the track is sent"""
+        substreams = list(self.substreams.items())
+        for _, substream in substreams:
+            substream.start_track(self.params.nchannels, self.params.nchannels * self.params.sampwidth)
+        version = None
+        report_time = time.monotonic()
+        report_packets, report_cpu = self.fanout_totals()
+
+        while not stop_event.is_set():
+            try:
+                sample_pos, audio_data, deadline = self.audio_queue.get(timeout=0.1)
+
+                if version != self.listener_version:
+                    version = self.listener_version
+                    groups = self.audio_destinations()
+                    for key, substream in substreams:
+                        substream.set_destinations(*groups.get(key, ([], [])))
+                    self.settle_listener_traffic()
+
+                if audio_data is None:
+                    # End of track: what each substream holds goes out as a short final unit
+                    for _, substream in substreams:
+                        if substream.fanout.destinations and self.server_socket:
+                            substream.flush()
+                    track_sent.set()
+                elif audio_data and self.server_socket:
+                    for _, substream in substreams:
+                        if substream.fanout.destinations:
+                            # Encoded once per substream, however many listeners use it
+                            substream.send(audio_data, sample_pos)
+
+                    if deadline is not None:
+                        lag = time.monotonic() - deadline
+                        self.send_lags.append(lag)
+                        self.send_lag.observe(lag)
+
+                self.audio_queue.task_done()
+
+                now = time.monotonic()
+                if now - report_time >= self.fanout_report_interval:
+                    total_packets, total_cpu = self.fanout_totals()
+                    packets = total_packets - report_packets
+                    cpu = total_cpu - report_cpu
+                    per_core = packets / cpu if cpu > 0 else 0
+                    self.log_message(f"Fan-out ({substreams[0][1].fanout.mode}): {packets / (now - report_time):.0f} packets/s, "
+                                     f"{per_core:.0f} packets per CPU-second", "info")
+                    pacing = self.pacing_stats()
+                    if pacing:
+                        self.log_message(f"Pacing: send lag p50 {pacing['p50']:.1f} ms, p99 {pacing['p99']:.1f} ms, "
+                                         f"max {pacing['max']:.1f} ms", "info")
+                    reader = self.pacing_clock.stats() if self.pacing_clock else {}
+                    if reader:
+                        self.log_message(f"Reader: woke p50 {reader['p50']:.2f} ms, p99 {reader['p99']:.2f} ms late, "
+                                         f"{reader['slips']} schedule slip(s) totalling {reader['slipped']:.2f} s, "
+                                         f"drift {reader['drift']:.1f} ms", "info")
+                    sessions = active_tokens.stats()
+                    self.log_message(f"Sessions: {sessions['live']} live, {sessions['expired']} expired, "
+                                     f"{sessions['evicted']} evicted", "info")
+                    if self.pings_rejected or self.pings_limited:
+                        self.log_message(f"Pings: {self.pings_rejected} failed authentication, "
+                                         f"{self.pings_limited} dropped from sources over their failure budget",
+                                         "info")
+                    if self.retransmitted or self.retransmit_limited:
+                        self.log_message(f"Retransmissions: {self.retransmitted} sent, {self.retransmit_misses} "
+                                         f"no longer held, {self.retransmit_limited} rate-limited", "info")
+                    report_time, report_packets, report_cpu = now, total_packets, total_cpu
+
+            except queue.Empty:
+                continue
+            except Exception as e:
+                self.log_message(f"Error in broadcast: {str(e)}", "error")
+                break
+
+    def pacing_stats(self):
+        """Send lag of recent chunks behind the reader's schedule, in ms ({} before any)"""
+        lags = sorted(self.send_lags)
+        if not lags:
+            return {}
+        return {"chunks": len(lags), "p50": lags[len(lags) // 2] * 1000,
+                "p99": lags[min(len(lags) - 1, len(lags) * 99 // 100)] * 1000, "max": lags[-1] * 1000}
+
+    def load_audio_file(self, filename):
+        """Load and convert audio file to standard format"""
+        try:
+            file_ext = os.path.splitext(filename)[1].lower()
+
+            if file_ext == '.wav':
+                return WavSource(filename)
+
+            elif file_ext == '.mp3':
+                raise ValueError("MP3 support requires pydub library")
+
+            else:
+                raise ValueError(f"Unsupported format: {file_ext}")
+
+        except Exception as e:
+            self.log_message(f"Error loading audio: {str(e)}", "error")
+            raise
+
+    def fanout_totals(self):
+        """Packets sent and CPU time spent sending, over all substreams"""
+        fanouts = [fanout for substream in list(self.substreams.values())
+                   for fanout in (substream.fanout, substream.parity_fanout)]
+        return sum(f.packets_sent for f in fanouts), sum(f.cpu_time for f in fanouts)
+
+    def listener_fanouts(self, oneudp):
+        """The BatchSenders whose packets reach a listener directly (none in multicast mode)"""
+        if self.multicast_group or not oneudp.active:
+            return ()
+        substream = self.substreams.get((self.listener_codec(oneudp).name, self.listener_profile(oneudp)))
+        if substream is None:
+            return ()
+        return (substream.fanout, substream.parity_fanout) if oneudp.fec else (substream.fanout,)
+
+    def listener_traffic(self, oneudp):
+        """Packets and bytes of audio and parity sent to a listener so far"""
+        packets, sent_bytes = oneudp.packets_sent, oneudp.bytes_sent
+        if oneudp.traffic_mark:
+            fanouts, mark_packets, mark_bytes = oneudp.traffic_mark
+            packets += sum(f.destination_packets for f in fanouts) - mark_packets
+            sent_bytes += sum(f.destination_bytes for f in fanouts) - mark_bytes
+        return packets, sent_bytes
+
+    def settle_listener_traffic(self):
+        """Bank each listener's traffic and start counting from its current substream.
+
+        Runs on the broadcaster whenever destinations are rebuilt, so the
+        fan-out itself never counts per listener.
+        """
+        for oneudp in list(self.udpclients.values()):
+            oneudp.packets_sent, oneudp.bytes_sent = self.listener_traffic(oneudp)
+            fanouts = self.listener_fanouts(oneudp)
+            oneudp.traffic_mark = (fanouts, sum(f.destination_packets for f in fanouts),
+                                   sum(f.destination_bytes for f in fanouts)) if fanouts else None
+
+    def collect_metrics(self):
+        """Metrics for the registry, read from the engine's counters at scrape time"""
+        listeners = [oneudp for oneudp in list(self.udpclients.values()) if oneudp.active]
+        packets = Metric("pywaves_listener_packets_sent_total", "counter",
+                         "Audio and parity packets sent to each listener")
+        sent_bytes = Metric("pywaves_listener_bytes_sent_total", "counter",
+                            "Audio and parity bytes sent to each listener")
+        for oneudp in listeners:
+            listener = f"{oneudp.addr[0]}:{oneudp.addr[1]}"
+            listener_packets, listener_bytes = self.listener_traffic(oneudp)
+            packets.add(listener_packets, listener=listener)
+            sent_bytes.add(listener_bytes, listener=listener)
+
+        fanout_packets = Metric("pywaves_fanout_packets_sent_total", "counter",
+                                "Datagrams sent by each substream fan-out")
+        send_errors = Metric("pywaves_send_errors_total", "counter",
+                             "Datagrams a substream fan-out failed to send")
+        for (codec, profile), substream in list(self.substreams.items()):
+            for kind, fanout in (("audio", substream.fanout), ("parity", substream.parity_fanout)):
+                if not (fanout.packets_sent or fanout.send_errors or fanout.destinations):
+                    continue  # no one has used this codec/profile
+                fanout_packets.add(fanout.packets_sent, codec=codec, profile=profile, kind=kind)
+                send_errors.add(fanout.send_errors, codec=codec, profile=profile, kind=kind)
+
+        pings = Metric("pywaves_pings_total", "counter", "Listener pings by outcome")
+        pings.add(self.pings_accepted, result="accepted")
+        pings.add(self.pings_rejected, result="rejected")
+        pings.add(self.pings_limited, result="limited")
+        retransmits = Metric("pywaves_retransmits_total", "counter", "NACKed packets by outcome")
+        retransmits.add(self.retransmitted, result="sent")
+        retransmits.add(self.retransmit_misses, result="missed")
+        retransmits.add(self.retransmit_limited, result="limited")
+
+        metrics = [
+            Metric("pywaves_listeners", "gauge", "Active listeners").add(len(listeners)),
+            packets, sent_bytes, fanout_packets, send_errors,
+            Metric("pywaves_audio_queue_depth", "gauge", "Chunks waiting for the broadcaster").add(
+                self.audio_queue.qsize()),
+            Metric("pywaves_send_lag_seconds", "histogram",
+                   "How long after its reader wakeup was due each chunk was sent").add_histogram(self.send_lag),
+            Metric("pywaves_reader_lag_seconds", "histogram",
+                   "How late the frame reader woke for each chunk").add_histogram(self.reader_lag),
+            Metric("pywaves_reader_slips_total", "counter",
+                   "Times the reader fell too far behind and moved its schedule back").add(
+                self.pacing_clock.slips if self.pacing_clock else 0),
+            Metric("pywaves_reader_drift_seconds", "gauge",
+                   "How far the stream has fallen behind real time this track").add(
+                self.pacing_clock.drift() if self.pacing_clock else 0),
+            pings, retransmits,
+        ]
+        for metric in metrics:
+            metric.samples = [(suffix, {"station": self.station, **labels}, value)
+                              for suffix, labels, value in metric.samples]
+        return metrics
+
+    # Codecs and latency profiles
+    def listener_codec(self, oneudp):
+        """The codec a listener's audio is encoded with for the current track"""
+        name = oneudp.codec if oneudp and not self.multicast_group else ""
+        return self.stream_codecs.get(name) or self.stream_codecs[self.codec.name]
+
+    def listener_profile(self, oneudp):
+        """The latency profile a listener's audio is packetized with"""
+        if oneudp and oneudp.profile and not self.multicast_group:
+            return oneudp.profile
+        return self.profile
+
+    def read_unit(self):
+        """Frames the reader sends per wakeup: the smallest profile anyone is using"""
+        version, frames = self.read_unit_cache
+        if version != self.listener_version:
+            profiles = {self.listener_profile(oneudp) for oneudp in list(self.udpclients.values()) if oneudp.active}
+            frames = min((PROFILES[p] for p in profiles), default=self.chunk_size)
+            self.read_unit_cache = (self.listener_version, frames)
+        return frames
+
+    def apply_listener_options(self, oneudp, options):
+        """Apply the options a listener sent with its ping, returning True if they changed"""
+        if not isinstance(options, dict):
+            options = {}
+        codec = options.get("codec", "")
+        if codec not in self.stream_codecs:
+            codec = ""
+        profile = options.get("profile", "")
+        if profile not in PROFILES:
+            profile = ""
+        fec = bool(options.get("fec")) and self.fec_group > 0
+
+        if (codec, profile, fec) == (oneudp.codec, oneudp.profile, oneudp.fec):
+            return False
+        oneudp.codec, oneudp.profile, oneudp.fec = codec, profile, fec
+        self.listeners_changed()
+        return True
+
+    # Messaging
+    def format_info(self, codec=None, profile=None):
+        """Build the format_info message describing the current track"""
+        return {
+            "type": "format_info",
+            "channels": self.params.nchannels,
+            "rate": self.params.framerate,
+            "format": self.sampwidth,
+            "frames": self.params.nframes,
+            "current_time": round(self.current_track_position, 3),
+            "codec": (codec or self.listener_codec(None)).name,
+            "codecs": [c.name for c in self.codecs],
+            "profile": profile or self.listener_profile(None),
+            "frames_per_buffer": PROFILES[profile or self.listener_profile(None)],
+            "fec_group": self.fec_group,
+            "retransmit": self.retransmit_history > 0
+        }
+
+    def listener_format_info(self, oneudp):
+        """format_info for one listener's codec and profile"""
+        return self.format_info(self.listener_codec(oneudp), self.listener_profile(oneudp))
+
+    def send_format_info(self):
+        """Tell every listener the track format and the codec it will receive"""
+        if self.multicast_socket:
+            self.send_json(self.format_info())
+            return
+
+        for oneudp in list(self.udpclients.values()):
+            if oneudp.active:
+                self.send_json_to(oneudp, self.listener_format_info(oneudp))
+
+    def audio_destinations(self):
+        """Audio and parity destinations, grouped by (codec name, profile)"""
+        active = [oneudp for oneudp in list(self.udpclients.values()) if oneudp.active and oneudp.addr]
+        if self.multicast_group:
+            # One copy for the whole LAN, but only while someone is listening
+            key = (self.listener_codec(None).name, self.listener_profile(None))
+            parity = [self.multicast_group] if any(oneudp.fec for oneudp in active) else []
+            return {key: ([self.multicast_group], parity)} if active else {}
+
+        groups = {}
+        for oneudp in active:
+            key = (self.listener_codec(oneudp).name, self.listener_profile(oneudp))
+            audio, parity = groups.setdefault(key, ([], []))
+            audio.append(oneudp.addr)
+            if oneudp.fec:
+                parity.append(oneudp.addr)
+        return groups
+
+    def send_json(self, message):
+        """Broadcast a JSON control message to all listeners"""
+        jsonfile = json.dumps(message)
+        self.broadcast(b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8'))
+
+    def broadcast(self, message):
+        """Send a message to all connected clients"""
+        if self.multicast_socket:
+            if self.udpclients:
+                try:
+                    self.multicast_socket.sendto(message, self.multicast_group)
+                except OSError:
+                    pass
+            return
+
+        for key in list(self.udpclients.keys()):
+            oneudp = self.udpclients.get(key)
+            if self.server_socket and oneudp and oneudp.active and oneudp.addr:
+                try:
+                    self.server_socket.sendto(message, oneudp.addr)
+                except ConnectionResetError:
+                    oneudp.active = False
+                    self.listeners_changed()
+                except BlockingIOError:
+                    pass
+
+    def send_json_to(self, oneudp, message):
+        """Send a JSON control message to one listener"""
+        jsonfile = json.dumps(message)
+        packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
+        try:
+            self.server_socket.sendto(packet, oneudp.addr)
+        except ConnectionResetError:
+            oneudp.active = False
+            self.listeners_changed()
+        except BlockingIOError:
+            pass
+
+    def send_reject_token(self, addr):
+        """Send login required message to client"""
+        if addr:
+            jsonfile = json.dumps({"type": "loginrequired"})
+            packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
+
+            try:
+                self.server_socket.sendto(packet, addr)
+            except (ConnectionResetError, BlockingIOError):
+                pass
+
+    def send_wav_parameters(self, oneudp):
+        """Send audio parameters to client"""
+        if oneudp and oneudp.addr and oneudp.active:
+            try:
+                if self.multicast_group:
+                    jsonfile = json.dumps({
+                        "type": "multicast",
+                        "group": self.multicast_group[0],
+                        "port": self.multicast_group[1]
+                    })
+                    packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
+                    try:
+                        self.server_socket.sendto(packet, oneudp.addr)
+                    except (ConnectionResetError, BlockingIOError):
+                        pass
+
+                jsonfile = json.dumps({
+                    "type": "track_info",
+                    "track": self.current_track if self.current_track else ""
+                })
+                packet = b'JSON' + len(jsonfile).to_bytes(4, 'big') + jsonfile.encode('utf-8')
+                try:
+                    self.server_socket.sendto(packet, oneudp.addr)
+                except ConnectionResetError:
+                    oneudp.active = False
+                except BlockingIOError:
+                    pass
+
+                if self.playing and self.params:
+                    self.send_json_to(oneudp, self.listener_format_info(oneudp))
+
+            except Exception as e:
+                self.log_message(f"Error sending parameters: {str(e)}", "error")
+
+    def listeners_changed(self):
+        """Invalidate the broadcaster's cached destination list"""
+        self.listener_version += 1
+
+    def notify_client_count(self):
+        """Tell the observer about listener count changes"""
+        count = len(self.udpclients)
+        if count != self.last_client_count:
+            self.last_client_count = count
+            self.observer.client_count_changed(count)
+
+    def handle_datagram(self, data, addr):
+        """Handle a ping or quit from a listener (runs on the control plane loop)"""
+        message = data[:4]
+        key = f"{addr[0]}:{addr[1]}"
+        udpone = self.udpclients.get(key)
+
+        if message == b"ping":
+            # Cheap checks first: size, the source's failure budget, a known index
+            if not PING_MIN_SIZE <= len(data) <= PING_MAX_SIZE:
+                self.pings_rejected += 1
+                return
+            now_monotonic = time.monotonic()
+            index = data[4:14].decode('utf-8', 'replace')
+            # Source addresses can be spoofed, so a registered listener pinging
+            # with its own session skips the budget: garbage sent in its name
+            # must not get its real pings dropped
+            registered = udpone is not None and udpone.index == index
+            failures = self.ping_failures.get(addr[0])
+            if not registered and failures is not None and not failures.ready(now_monotonic):
+                self.pings_limited += 1
+                return
+
+            Entry = active_tokens.get(index)
+            aesgcm = self.ping_cipher(index, Entry) if Entry else None
+            if aesgcm is None:
+                self.ping_failed(addr, now_monotonic)
+                if registered:
+                    # The session expired or was evicted: tell the listener to log in again
+                    self.send_reject_token(addr)
+                return
+
+            try:
+                plaintext = aesgcm.decrypt(data[14:26], data[26:], None)
+                timestamp = struct.unpack('!d', plaintext[:8])[0]
+                # Newer clients append NUL and a JSON object of listener options
+                token, _, options = plaintext[8:].partition(b'\0')
+            except Exception:
+                self.ping_failed(addr, now_monotonic)
+                return
+
+            if (not hmac.compare_digest(token, Entry.get('token', '').encode('utf-8'))
+                    or time.time() - timestamp >= 5):
+                self.ping_failed(addr, now_monotonic)
+                return
+            self.pings_accepted += 1
+
+            try:
+                options = json.loads(options) if options else {}
+            except ValueError:
+                options = {}
+
+            token_time = Entry.get('timestamp')
+            if token_time is None:
+                self.send_reject_token(addr)
+                return
+
+            now = datetime.now()
+            if udpone:
+                if not udpone.active:
+                    udpone.active = True
+                    self.listeners_changed()
+                udpone.lastping = now
+                udpone.index = index
+                if self.apply_listener_options(udpone, options) and self.playing and self.params:
+                    self.send_json_to(udpone, self.listener_format_info(udpone))
+            elif now - token_time < timedelta(hours=self.TOKEN_VALID_HOURS):
+                udpone = UdpClient(active=True, addr=addr, lastping=now, index=index)
+                self.apply_listener_options(udpone, options)
+                self.udpclients[key] = udpone
+                self.listeners_changed()
+                self.log_message(f"New client: {addr[0]}:{addr[1]}", "success")
+                self.send_wav_parameters(udpone)
+                self.notify_client_count()
+                self.control_plane.arm_sweep()
+
+        elif message == b"nack" and udpone and udpone.active:
+            self.retransmit(udpone, parse_nack(data))
+
+        elif message == b"quit" and udpone:
+            self.remove_client(key)
+            self.notify_client_count()
+
+    def ping_cipher(self, index, entry):
+        """The AESGCM for a session's key, built once per token index"""
+        key = entry.get("key")
+        if key is None:
+            return None
+        cached = self.ping_ciphers.get(index)
+        if cached is None or cached[0] != key:
+            cached = (key, AESGCM(key))
+            self.ping_ciphers[index] = cached
+        return cached[1]
+
+    def ping_failed(self, addr, now):
+        """Charge a ping that did not authenticate to its source address"""
+        self.pings_rejected += 1
+        failures = self.ping_failures.get(addr[0])
+        if failures is None:
+            if len(self.ping_failures) >= PING_FAILURE_SOURCES:
+                del self.ping_failures[next(iter(self.ping_failures))]
+            failures = TokenBucket(PING_FAILURE_RATE, PING_FAILURE_BURST)
+            self.ping_failures[addr[0]] = failures
+        failures.take(now)
+
+    def retransmit(self, oneudp, seqs):
+        """Resend packets a listener missed from its substream's history ring"""
+        substream = self.substreams.get((self.listener_codec(oneudp).name, self.listener_profile(oneudp)))
+        if substream is None or not self.server_socket:
+            return
+        if oneudp.retransmit_budget is None:
+            oneudp.retransmit_budget = TokenBucket(self.retransmit_rate)
+
+        now = time.monotonic()
+        for i, seq in enumerate(seqs):
+            # Every request costs a token, held or not, so a flood of NACKs is cheap to ignore
+            if not (oneudp.retransmit_budget.take(now) and self.retransmit_budget.take(now)):
+                self.retransmit_limited += len(seqs) - i
+                break
+            packet = substream.recent_packet(seq)
+            if packet is None:
+                self.retransmit_misses += 1
+                continue
+            try:
+                self.server_socket.sendto(packet, oneudp.addr)
+                self.retransmitted += 1
+            except (BlockingIOError, ConnectionResetError):
+                pass
+
+    def remove_client(self, key):
+        """Forget a listener"""
+        oneudp = self.udpclients.pop(key, None)
+        if oneudp:
+            oneudp.active = False
+            self.listeners_changed()
+            self.log_message(f"Client disconnected: {oneudp.addr[0]}:{oneudp.addr[1]}", "warning")
+
+    def sweep_clients(self):
+        """Drop listeners that quit or stopped pinging"""
+        now = datetime.now()
+
+        for key in list(self.udpclients.keys()):
+            oneudp = self.udpclients.get(key)
+            if oneudp and (not oneudp.active or now - oneudp.lastping > timedelta(seconds=6)):
+                self.remove_client(key)
+
+        # Forget ciphers of sessions that ended
+        for index in [index for index in self.ping_ciphers if index not in active_tokens]:
+            del self.ping_ciphers[index]
+
+        self.notify_client_count()
+
+
+def parse_multicast(value):
+    """Parse GROUP:PORT for --multicast"""
+    group, _, port = value.rpartition(':')
+    try:
+        if not ipaddress.IPv4Address(group).is_multicast:
+            raise ValueError
+        return group, int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an IPv4 multicast GROUP:PORT, got {value!r}")
+
+
+def parse_station(value):
+    """Parse NAME=PORT[:PLAYLIST] for --station"""
+    name, _, rest = value.partition("=")
+    port, _, playlist = rest.partition(":")
+    try:
+        port = int(port)
+        if not name or not 0 < port < 65536:
+            raise ValueError
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected NAME=PORT[:PLAYLIST], got {value!r}")
+    return name, port, playlist or f"{name}_playlist.json"
+
+
+def validate_stations(stations):
+    """Return an error message if (name, port, playlist) stations share a name or port, else None.
+
+    Each station binds its own port, and its name labels its metrics, so
+    two alike would emit duplicate series.
+    """
+    if len({port for _, port, _ in stations}) < len(stations) or len({name for name, _, _ in stations}) < len(stations):
+        return "each --station needs its own name and port"
+    return None
+
+
+def parse_mtu(value):
+    """Parse and range-check --mtu"""
+    try:
+        mtu = int(value)
+    except ValueError:
+        mtu = 0
+    if not MIN_MTU <= mtu <= MAX_MTU:
+        raise argparse.ArgumentTypeError(f"expected an MTU between {MIN_MTU} and {MAX_MTU}, got {value!r}")
+    return mtu
+
+
+def parse_fec_group(value):
+    """Parse and range-check --fec-group"""
+    try:
+        group = int(value)
+    except ValueError:
+        group = -1
+    if not 0 <= group <= MAX_FEC_GROUP:
+        raise argparse.ArgumentTypeError(f"expected a group size between 0 and {MAX_FEC_GROUP}, got {value!r}")
+    return group
+
+
+def parse_codecs(value):
+    """Parse NAME,... for --codecs"""
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in names if name not in CODECS]
+    if unknown or not names:
+        raise argparse.ArgumentTypeError(f"expected codec names from {', '.join(sorted(CODECS))}, got {value!r}")
+    return names
+
+
+def main():
+    """Run a station without the GUI"""
+    parser = argparse.ArgumentParser(description="PyWaves Radio headless broadcast engine")
+    parser.add_argument("--host", default="0.0.0.0", help="address to bind the UDP stream socket")
+    parser.add_argument("--port", type=int, default=12345, help="UDP stream port")
+    parser.add_argument("--playlist", default="server_playlist.json", help="playlist file saved by the server GUI")
+    parser.add_argument("--station", type=parse_station, action="append", metavar="NAME=PORT[:PLAYLIST]",
+                        help="run this station (repeat for several, each on its own port and sharing one login "
+                             "server); PLAYLIST defaults to NAME_playlist.json. Replaces --port and --playlist")
+    parser.add_argument("--no-login-server", action="store_true",
+                        help="do not start the TLS login server in this process")
+    parser.add_argument("--fanout", choices=("auto", "sendmmsg", "loop"), default="auto",
+                        help="how audio packets are sent to many listeners (default: sendmmsg where available)")
+    parser.add_argument("--multicast", type=parse_multicast, metavar="GROUP:PORT",
+                        help="send the stream once to a multicast group instead of to every listener")
+    parser.add_argument("--multicast-ttl", type=int, default=1,
+                        help="multicast TTL, 1 keeps the stream on the local subnet")
+    parser.add_argument("--codec", choices=sorted(CODECS), default="pcm",
+                        help="codec for listeners that do not ask for one (rice: lossless; adpcm, mulaw: lossy)")
+    parser.add_argument("--codecs", type=parse_codecs, default=None, metavar="NAME,...",
+                        help="codecs listeners may choose from (default: all)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=DEFAULT_PROFILE,
+                        help="latency profile for listeners that do not ask for one")
+    parser.add_argument("--mtu", type=parse_mtu, default=1500,
+                        help="path MTU; audio packets are sized to fit it without fragmentation")
+    parser.add_argument("--fec-group", type=parse_fec_group, default=8, metavar="N",
+                        help="send listeners that ask for FEC one parity packet per N audio packets, "
+                             "masking one loss in every N+1 (0 disables FEC)")
+    parser.add_argument("--nack-history", type=int, default=512, metavar="PACKETS",
+                        help="recent packets kept per substream for listeners to NACK (0 disables retransmission)")
+    parser.add_argument("--nack-rate", type=int, default=50, metavar="PPS",
+                        help="most retransmitted packets per second for one listener")
+    parser.add_argument("--chunks-per-wakeup", type=int, choices=range(1, MAX_CATCH_UP + 1), default=1, metavar="N",
+                        help=f"chunks the reader sends each time it wakes, 1-{MAX_CATCH_UP}; "
+                             "more means fewer wakeups but burstier sends")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help=f"serve Prometheus metrics on http://{METRICS_HOST}:PORT/metrics (0 disables)")
+    args = parser.parse_args()
+
+    stations = args.station or [(None, args.port, args.playlist)]
+    error = validate_stations(stations)
+    if error:
+        parser.error(error)
+    if args.multicast and len(stations) > 1:
+        parser.error("--multicast sends one station; run a process per multicast station")
+
+    if not args.no_login_server:
+        # Start login server in background
+        login_server = threading.Thread(target=start_server, daemon=True)
+        login_server.start()
+
+    engines = []
+    for name, port, playlist in stations:
+        engine = BroadcastEngine(args.host, port, observer=ConsoleObserver(name if len(stations) > 1 else None),
+                                 fanout=args.fanout, multicast=args.multicast, multicast_ttl=args.multicast_ttl,
+                                 codec=args.codec, codecs=args.codecs, profile=args.profile, mtu=args.mtu,
+                                 fec_group=args.fec_group, retransmit_history=args.nack_history,
+                                 retransmit_rate=args.nack_rate, chunks_per_wakeup=args.chunks_per_wakeup,
+                                 station=name)
+        engine.load_playlist(playlist)
+        engine.start()
+        engine.log_message(f"Server started on {args.host}:{port}", "success")
+        engines.append(engine)
+
+    if args.metrics_port:
+        try:
+            start_metrics_server(METRICS_HOST, args.metrics_port)
+            engines[0].log_message(f"Metrics on http://{METRICS_HOST}:{args.metrics_port}/metrics", "info")
+        except OSError as e:
+            engines[0].log_message(f"Metrics endpoint not started: {e}", "warning")
+
+    for engine in engines:
+        if engine.playlist:
+            engine.play_index(0)
+        else:
+            engine.log_message("Playlist is empty, waiting for listeners only", "warning")
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Shutting down...")
+        for engine in engines:
+            engine.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# control_plane.py - Event-driven listener control plane (ping/quit/liveness) for the broadcast engine
+import asyncio
+import threading
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    """Hands every datagram on the stream port to the engine"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def datagram_received(self, data, addr):
+        try:
+            self.engine.handle_datagram(data, addr)
+        except Exception as e:
+            self.engine.log_message(f"Error in client handler: {str(e)}", "error")
+
+    def error_received(self, exc):
+        # ICMP errors for listeners that went away; the liveness sweep drops them
+        pass
+
+
+class ControlPlane:
+    """Runs the control protocol on its own asyncio loop and thread.
+
+    Nothing runs while no datagrams arrive except the liveness sweep, which
+    is armed only while there are listeners to check.
+    """
+
+    def __init__(self, engine, sock, sweep_interval=3):
+        self.engine = engine
+        self.sock = sock
+        self.sweep_interval = sweep_interval
+        self.loop = asyncio.new_event_loop()
+        self.transport = None
+        self.sweep_handle = None
+        self.thread = None
+        self.ready = threading.Event()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait(timeout=5)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.transport, _ = self.loop.run_until_complete(
+            self.loop.create_datagram_endpoint(lambda: ControlProtocol(self.engine), sock=self.sock))
+        self.ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self.transport.close()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+
+    def arm_sweep(self):
+        """Make sure a liveness sweep is scheduled (call from any thread)"""
+        if self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._arm_sweep)
+
+    def _arm_sweep(self):
+        if self.sweep_handle is None:
+            self.sweep_handle = self.loop.call_later(self.sweep_interval, self._sweep)
+
+    def _sweep(self):
+        self.sweep_handle = None
+        try:
+            self.engine.sweep_clients()
+        except Exception as e:
+            self.engine.log_message(f"Error in client handler: {str(e)}", "error")
+        if self.engine.udpclients:
+            self._arm_sweep()
@@ -0,0 +1,194 @@
+# fanout.py - Send one packet to many UDP listeners with as few syscalls as possible
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import sys
+import time
+
+
+# Linux caps the number of messages per sendmmsg call at UIO_MAXIOV
+MAX_BATCH = 1024
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [("sin_family", ctypes.c_ushort),
+                ("sin_port", ctypes.c_uint16),
+                ("sin_addr", ctypes.c_uint8 * 4),
+                ("sin_zero", ctypes.c_uint8 * 8)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+def load_sendmmsg():
+    """Return libc's sendmmsg, or None where it is not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = load_sendmmsg()
+
+
+class BatchSender:
+    """Fans the same packet out to a list of IPv4 destinations.
+
+    On Linux one sendmmsg(2) call submits up to MAX_BATCH datagrams; every
+    message points at the same iovec, so the payload is shared. Elsewhere,
+    or when mode is "loop", it falls back to one sendto per destination.
+    The message array is rebuilt only when set_destinations is called.
+    """
+
+    def __init__(self, sock, mode="auto"):
+        self.sock = sock
+        self.batched = mode != "loop" and _sendmmsg is not None
+        if mode == "sendmmsg" and _sendmmsg is None:
+            raise OSError("sendmmsg is not available on this platform")
+
+        self.destinations = []
+        self.iov = iovec()
+        self.addresses = None
+        self.messages = None
+
+        # Counters for packets/sec per core
+        self.packets_sent = 0
+        # What each destination was sent (send calls and their bytes), for per-listener totals
+        self.destination_packets = 0
+        self.destination_bytes = 0
+        self.send_errors = 0
+        self.syscalls = 0
+        self.cpu_time = 0.0
+
+    @property
+    def mode(self):
+        return "sendmmsg" if self.batched else "loop"
+
+    def set_destinations(self, destinations):
+        """Replace the destination list and rebuild the message array"""
+        self.destinations = list(destinations)
+        if not self.batched:
+            return
+
+        count = len(self.destinations)
+        self.addresses = (sockaddr_in * max(count, 1))()
+        self.messages = (mmsghdr * max(count, 1))()
+        iov_pointer = ctypes.pointer(self.iov)
+
+        for i, (host, port) in enumerate(self.destinations):
+            address = self.addresses[i]
+            address.sin_family = socket.AF_INET
+            address.sin_port = socket.htons(port)
+            address.sin_addr[:] = socket.inet_aton(host)
+
+            header = self.messages[i].msg_hdr
+            header.msg_name = ctypes.addressof(address)
+            header.msg_namelen = ctypes.sizeof(sockaddr_in)
+            header.msg_iov = iov_pointer
+            header.msg_iovlen = 1
+
+    def send(self, packet):
+        """Send packet to every destination, returning how many were sent.
+
+        Destinations whose send fails are skipped and counted in send_errors;
+        a reset from one listener never stops the fan-out to the others.
+        """
+        if not self.destinations:
+            return 0
+
+        started = time.thread_time()
+        if self.batched:
+            sent = self.send_batched(packet)
+        else:
+            sent = self.send_loop(packet)
+        self.cpu_time += time.thread_time() - started
+        self.packets_sent += sent
+        self.destination_packets += 1
+        self.destination_bytes += len(packet)
+        return sent
+
+    def send_loop(self, packet):
+        sent = 0
+        for addr in self.destinations:
+            try:
+                self.sock.sendto(packet, addr)
+                sent += 1
+            except OSError:
+                self.send_errors += 1
+        self.syscalls += len(self.destinations)
+        return sent
+
+    def send_batched(self, packet):
+        length = len(packet)
+        try:
+            payload = (ctypes.c_char * length).from_buffer(packet)
+        except TypeError:
+            # Read-only buffers (bytes) cannot be pointed at directly
+            payload = (ctypes.c_char * length).from_buffer_copy(packet)
+        self.iov.iov_base = ctypes.addressof(payload)
+        self.iov.iov_len = length
+
+        fd = self.sock.fileno()
+        total = len(self.destinations)
+        position = 0
+        sent = 0
+        retried = False
+
+        while position < total:
+            count = min(total - position, MAX_BATCH)
+            first = ctypes.byref(self.messages, position * ctypes.sizeof(mmsghdr))
+            result = _sendmmsg(fd, ctypes.cast(first, ctypes.POINTER(mmsghdr)), count, 0)
+            self.syscalls += 1
+
+            if result > 0:
+                position += result
+                sent += result
+                continue
+
+            error = ctypes.get_errno()
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK) and not retried:
+                # Send buffer full: wait briefly once, then drop the rest
+                select.select([], [fd], [], 0.05)
+                retried = True
+                continue
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.send_errors += total - position
+                break
+
+            # The first message of the batch failed (e.g. ICMP refused), skip it
+            self.send_errors += 1
+            position += 1
+
+        del payload
+        return sent
+
+    def packets_per_core_second(self):
+        """Packets sent per second of CPU time spent sending"""
+        if self.cpu_time <= 0:
+            return 0.0
+        return self.packets_sent / self.cpu_time
@@ -1,28 +1,66 @@
+import asyncio
+import math
+import multiprocessing
+import os
 import socket
 import json
 import threading
-import shelve
 import secrets
 import string
 from datetime import datetime
 import ssl
+import time
 import base64
+import hashlib
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from token_store import TokenStore
+from userstore import UserStore
+from metrics import Histogram, Metric, REGISTRY
 
 
 HOST = "0.0.0.0"
 PORT = 12346
-DB_FILE = "users.db"
+USER_DB = "users.sqlite3"
+DB_FILE = "users.db"  # shelve database used before USER_DB, imported on first start
 BUFFER_SIZE = 1024
 LOCK = threading.Lock()
+user_store = None
+
+# bcrypt runs in this many worker processes, so logins use every core and
+# a burst of them cannot take more CPU than that from the audio threads.
+# They are spawned, not forked: the pool starts on the first login, when
+# the process already runs the GUI, audio and control-plane threads, and a
+# forked child could inherit a lock one of them held.
+HASH_WORKERS = os.cpu_count() or 1
+HASH_CONTEXT = multiprocessing.get_context("spawn")
+hash_pool = None
+
+# Connections being handshaken or served at once; more wait in the backlog
+MAX_CONNECTIONS = 64
+LISTEN_BACKLOG = 128
+# bcrypt jobs queued before new requests are answered "busy"
+MAX_PENDING_HASHES = 8 * HASH_WORKERS
+HANDSHAKE_TIMEOUT = 10
+# TLS 1.3 tickets sent after each handshake, each good for one resumption
+SESSION_TICKETS = 2
+REQUEST_TIMEOUT = 10
 
 # TLS Certificate and generated key
 CERT_FILE = 'PyWavesClientCert.pem'
 KEY_FILE = 'PyWavesServerPrivateKey.pem'
 
-# In-memory token list
-active_tokens = {}
+# In-memory sessions by token index; they expire after TOKEN_VALID_HOURS
+# and the least recently used are dropped beyond MAX_SESSIONS
+TOKEN_VALID_HOURS = 10
+MAX_SESSIONS = 100000
+active_tokens = TokenStore(TOKEN_VALID_HOURS * 60 * 60, MAX_SESSIONS)
+# Refresh tokens by SHA-256 digest; each one can be swapped once for a new
+# session without the password (and so without bcrypt)
+REFRESH_VALID_DAYS = 7
+refresh_tokens = TokenStore(REFRESH_VALID_DAYS * 24 * 60 * 60, MAX_SESSIONS)
 certificates_found = False # tells the server if certificates were loaded
 
 
@@ -57,6 +95,30 @@ def hash_password_with_rounds(password, rounds=12):
     return hashed
 
 
+def get_hash_pool():
+    """Start the bcrypt worker processes on first use"""
+    global hash_pool
+    with LOCK:
+        if hash_pool is None:
+            hash_pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=HASH_CONTEXT)
+    return hash_pool
+
+
+async def run_hash(function, *args):
+    """Run hash_password or verify_password in a worker process without blocking the event loop"""
+    global hash_pool
+    loop = asyncio.get_running_loop()
+    pool = get_hash_pool()
+    try:
+        return await loop.run_in_executor(pool, function, *args)
+    except BrokenProcessPool:
+        # A worker died (killed, out of memory): start a fresh pool next time
+        with LOCK:
+            if hash_pool is pool:
+                hash_pool = None
+        return await loop.run_in_executor(None, function, *args)
+
+
 def generate_token(length=20):
     return ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(length))
 
@@ -68,75 +130,202 @@ def save_token(token, index, key):
     active_tokens[index] = tokenindexdict
 
 
-def handle_client(clientsocket, addr, context):
-    print(f"[+] Connected by {addr}")
-    try:
-        with context.wrap_socket(clientsocket, server_side=True) as ssock:
-            data = ssock.recv(BUFFER_SIZE).decode('utf-8')
-            print(f"[>] Received: {data}")
-            message = json.loads(data)
-
-            username = message.get("username", "").strip()
-            password = message.get("password", "").strip()
-            action_type = message.get("type", "").strip().lower()
-
-            if not username or not password or action_type not in ("login", "register"):
-                ssock.sendall(b"fail")
-                return
-
-            with LOCK:
-                with shelve.open(DB_FILE, writeback=True) as db:
-                    if action_type == "register":
-                        if username in db:
-                            ssock.sendall(b"already exists")
-                        else:
-                            db[username] = hash_password(password)
-                            print (username, password, db[username])
-                            token = generate_token(20)
-                            index = generate_token(10)
-                            key = generate_AES_key()
-                            save_token(token, index, key)
-                            response = {"status": "success", "token": token, "index": index, "key": base64.b64encode(key).decode('utf-8')}
-                            ssock.sendall(json.dumps(response).encode('utf-8'))
-                            print(f"[+] Registered user: {username} | Token: {token}")
-
-                    elif action_type == "login":
-                        if username in db:
-                            if verify_password(password, db[username]):
-                                token = generate_token(20)
-                                index = generate_token(10)
-                                key = generate_AES_key()
-                                save_token(token, index, key)
-                                response = {"status": "success", "token": token, "index": index, "key": base64.b64encode(key).decode('utf-8')}
-                                ssock.sendall(json.dumps(response).encode('utf-8'))
-                                print(f"[+] Logged in user: {username} | Token: {token} | Index: " + index)
-                            else:
-                                ssock.sendall(b"fail")
-                        else:
-                            ssock.sendall(b"fail")
-    except Exception as e:
-        print(f"[!] Error: {e}")
-        try:
-            ssock.sendall(b"fail")
-        except:
-            pass
-    finally:
-        clientsocket.close()
-        print(f"[-] Disconnected {addr}")
-
-def start_server():
-    print(f"[*] Starting server on port {PORT}")
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_socket:
-        server_socket.bind((HOST, PORT))
-        server_socket.listen()
+def refresh_digest(refresh):
+    return hashlib.sha256(refresh.encode('utf-8')).hexdigest()
+
+
+def get_user_store():
+    """Open the user database once per process"""
+    global user_store
+    with LOCK:
+        if user_store is None:
+            user_store = UserStore(USER_DB, legacy_shelve=DB_FILE)
+            if user_store.migrated:
+                print(f"[*] Imported {user_store.migrated} user(s) from {DB_FILE} into {USER_DB}")
+    return user_store
+
+
+def session_response(username):
+    """Issue a new session and refresh token for username and build the success response"""
+    token = generate_token(20)
+    index = generate_token(10)
+    key = generate_AES_key()
+    save_token(token, index, key)
+    refresh = secrets.token_urlsafe(32)
+    refresh_tokens[refresh_digest(refresh)] = {'username': username, 'index': index}
+    response = {"status": "success", "token": token, "index": index, "key": base64.b64encode(key).decode('utf-8'),
+                "refresh": refresh}
+    return token, index, json.dumps(response).encode('utf-8')
+
+
+class LoginServer:
+    """TLS login/register server on one asyncio loop.
+
+    At most max_connections connections are handshaking or being served;
+    beyond that new ones wait in the listen backlog. Requests that would
+    queue more than max_pending bcrypt jobs get a busy response with a
+    retry_after estimate instead of waiting.
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_pending=MAX_PENDING_HASHES):
+        self.max_connections = max_connections
+        self.max_pending = max_pending
+        self.pending = 0
+        # Recent time per bcrypt job, for retry_after
+        self.hash_seconds = 0.3
+        self.busy_responses = 0
+        self.refreshes = 0
+        self.handshakes = 0
+        self.resumed = 0
+        # TLS handshake time, full and resumed
+        self.handshake_seconds = {False: Histogram(), True: Histogram()}
+        self.tasks = set()
+
+    async def serve(self):
+        # One context for the server's lifetime: its session cache and ticket
+        # keys let returning clients resume instead of a full handshake
         context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
         context.load_cert_chain(certfile=CERT_FILE, keyfile=KEY_FILE)
-
+        context.num_tickets = SESSION_TICKETS
+        listener = socket.create_server((HOST, PORT), backlog=LISTEN_BACKLOG)
+        listener.setblocking(False)
+        slots = asyncio.Semaphore(self.max_connections)
+        loop = asyncio.get_running_loop()
+        REGISTRY.register(self.collect_metrics)
         print("[*] Server is listening...")
 
         while True:
-            clientsocket, addr = server_socket.accept()
-            threading.Thread(target=handle_client, args=(clientsocket, addr, context), daemon=True).start()
+            # Backpressure: stop accepting while every slot is taken
+            await slots.acquire()
+            try:
+                clientsocket, addr = await loop.sock_accept(listener)
+            except OSError as e:
+                slots.release()
+                print(f"[!] Accept failed: {e}")
+                continue
+            task = loop.create_task(self.handle_client(clientsocket, addr, context, slots))
+            # The loop only keeps weak references to tasks
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def handle_client(self, clientsocket, addr, context, slots):
+        print(f"[+] Connected by {addr}")
+        loop = asyncio.get_running_loop()
+        writer = None
+        try:
+            reader = asyncio.StreamReader()
+            protocol = asyncio.StreamReaderProtocol(reader)
+            started = loop.time()
+            transport, _ = await loop.connect_accepted_socket(lambda: protocol, clientsocket, ssl=context,
+                                                              ssl_handshake_timeout=HANDSHAKE_TIMEOUT)
+            writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+            resumed = transport.get_extra_info('ssl_object').session_reused
+            self.handshake_seconds[resumed].observe(loop.time() - started)
+            self.handshakes += 1
+            if resumed:
+                self.resumed += 1
+                print(f"[+] Resumed TLS session for {addr}")
+
+            data = await asyncio.wait_for(reader.read(BUFFER_SIZE), REQUEST_TIMEOUT)
+            writer.write(await self.handle_request(data))
+            await asyncio.wait_for(writer.drain(), REQUEST_TIMEOUT)
+        except asyncio.TimeoutError:
+            print(f"[!] Timed out: {addr}")
+        except Exception as e:
+            print(f"[!] Error: {e}")
+            if writer is not None:
+                writer.write(b"fail")
+        finally:
+            if writer is not None:
+                writer.close()
+            else:
+                clientsocket.close()
+            slots.release()
+            print(f"[-] Disconnected {addr}")
+
+    async def handle_request(self, data):
+        """Answer one JSON login/register/refresh request"""
+        message = json.loads(data.decode('utf-8'))
+        if message.get("type") == "refresh":
+            return self.refresh_session(message.get("refresh"))
+
+        username = message.get("username", "").strip()
+        password = message.get("password", "").strip()
+        action_type = message.get("type", "").strip().lower()
+        print(f"[>] Received: {action_type} for {username}")
+
+        if not username or not password or action_type not in ("login", "register"):
+            return b"fail"
+
+        if self.pending >= self.max_pending:
+            self.busy_responses += 1
+            retry_after = max(1, math.ceil(self.pending * self.hash_seconds / HASH_WORKERS))
+            return json.dumps({"status": "busy", "retry_after": retry_after}).encode('utf-8')
+
+        users = get_user_store()
+        if action_type == "register":
+            if users.exists(username):
+                return b"already exists"
+            hashed = await self.hash(hash_password, password)
+            # add_user refuses the name if someone registered it while we were hashing
+            if not users.add_user(username, hashed):
+                return b"already exists"
+            token, _, response = session_response(username)
+            print(f"[+] Registered user: {username} | Token: {token}")
+            return response
+
+        hashed = users.get_hash(username)
+        if hashed is None or not await self.hash(verify_password, password, hashed):
+            return b"fail"
+        token, index, response = session_response(username)
+        print(f"[+] Logged in user: {username} | Token: {token} | Index: " + index)
+        return response
+
+    def refresh_session(self, refresh):
+        """Swap a refresh token for a new session and refresh token; no bcrypt, never busy"""
+        if not isinstance(refresh, str) or not refresh:
+            return b"fail"
+        entry = refresh_tokens.pop(refresh_digest(refresh))
+        if entry is None or not get_user_store().exists(entry['username']):
+            return b"fail"
+        # The stream session issued with this refresh token is replaced, not kept alongside
+        active_tokens.pop(entry['index'])
+        self.refreshes += 1
+        token, index, response = session_response(entry['username'])
+        print(f"[+] Refreshed session for {entry['username']} | Token: {token} | Index: " + index)
+        return response
+
+    def collect_metrics(self):
+        """Metrics for the registry, read at scrape time"""
+        handshakes = Metric("pywaves_login_handshake_seconds", "histogram", "TLS handshake time on the login server")
+        for resumed, histogram in self.handshake_seconds.items():
+            handshakes.add_histogram(histogram, resumed="true" if resumed else "false")
+        return [
+            handshakes,
+            Metric("pywaves_login_pending_hashes", "gauge", "bcrypt jobs queued or running").add(self.pending),
+            Metric("pywaves_login_busy_total", "counter", "Requests answered busy").add(self.busy_responses),
+            Metric("pywaves_login_refreshes_total", "counter", "Sessions renewed with a refresh token").add(
+                self.refreshes),
+            # Sessions are shared by every station in the process
+            Metric("pywaves_sessions", "gauge", "Live login sessions").add(active_tokens.stats()["live"]),
+        ]
+
+    async def hash(self, function, *args):
+        self.pending += 1
+        started = time.monotonic()
+        try:
+            return await run_hash(function, *args)
+        finally:
+            self.pending -= 1
+            self.hash_seconds = 0.8 * self.hash_seconds + 0.2 * (time.monotonic() - started)
+
+
+def start_server(max_connections=MAX_CONNECTIONS, max_pending=MAX_PENDING_HASHES):
+    print(f"[*] Starting server on port {PORT}")
+    get_user_store()
+    get_hash_pool()
+    asyncio.run(LoginServer(max_connections, max_pending).serve())
+
 
 if __name__ == "__main__":
     start_server()
@@ -0,0 +1,139 @@
+# metrics.py - Metrics registry and a local HTTP endpoint in Prometheus text format
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9105
+
+# Seconds; suits both send lag and TLS handshakes
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and three additions.
+
+    Not locked: each histogram is observed from one thread, and a scrape
+    that races an observation is off by one sample at most.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """One metric family, filled in by a collector at scrape time"""
+
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.kind = kind
+        self.help_text = help_text
+        self.samples = []
+
+    def add(self, value, suffix="", **labels):
+        self.samples.append((suffix, labels, value))
+        return self
+
+    def add_histogram(self, histogram, **labels):
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), list(histogram.counts)):
+            cumulative += count
+            self.add(cumulative, "_bucket", **labels, le="+Inf" if bound == float("inf") else repr(bound))
+        self.add(histogram.sum, "_sum", **labels)
+        self.add(histogram.count, "_count", **labels)
+        return self
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Registry:
+    """Collectors are callables returning Metrics, called on every scrape.
+
+    Components keep their plain counters and register a collector that
+    reads them, so nothing is added to the hot paths beyond those counters.
+    """
+
+    def __init__(self):
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, collector):
+        with self.lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def unregister(self, collector):
+        with self.lock:
+            if collector in self.collectors:
+                self.collectors.remove(collector)
+
+    def collect(self):
+        with self.lock:
+            collectors = list(self.collectors)
+        metrics = {}
+        for collector in collectors:
+            for metric in collector():
+                # Families with the same name from several components are merged
+                if metric.name in metrics:
+                    metrics[metric.name].samples.extend(metric.samples)
+                else:
+                    metrics[metric.name] = metric
+        return list(metrics.values())
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples:
+                label_text = ",".join(f'{key}="{escape(value)}"' for key, value in labels.items())
+                lines.append(f"{metric.name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"{metric.name}{suffix} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        try:
+            body = self.registry.render().encode('utf-8')
+        except Exception as e:
+            self.send_error(500, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT, registry=REGISTRY):
+    """Serve registry at http://host:port/metrics from a daemon thread, returning the server"""
+    handler = type("Handler", (MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,81 @@
+# pacing.py - Sample-clock scheduler that paces the broadcast engine's frame reader
+import time
+from collections import deque
+
+
+# Most chunks sent back to back to catch up after a stall; anything later
+# than that is given up on by moving the schedule back
+MAX_CATCH_UP = 8
+# Wakeups whose lateness is kept for stats()
+LATENESS_SAMPLES = 4096
+
+
+class SampleClock:
+    """When each chunk of a track is due, counted in samples on the monotonic clock.
+
+    Chunk n is due at origin + (samples sent before it) / framerate, so
+    deadlines are absolute: sleep overshoot on one wakeup is made up on
+    the next instead of adding up, and wall-clock changes (NTP, DST) have
+    no effect. A reader that falls behind sends up to max_catch_up
+    chunks back to back; beyond that the schedule itself moves back
+    (a slip) so a long stall does not end in a burst of stale audio.
+    """
+
+    def __init__(self, framerate, max_catch_up=MAX_CATCH_UP, clock=time.monotonic):
+        self.framerate = framerate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.origin = clock()
+        self.samples = 0
+        self.lateness = deque(maxlen=LATENESS_SAMPLES)
+        self.wakeups = 0
+        self.slips = 0
+        self.slipped = 0.0
+
+    def due(self):
+        """Monotonic time the next chunk is due"""
+        return self.origin + self.samples / self.framerate
+
+    def wait(self, frames, stop_event=None):
+        """Sleep until the next chunk (frames long) is due, returning how late we woke, in seconds"""
+        delay = self.due() - self.clock()
+        if delay > 0:
+            if stop_event is not None:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+
+        late = self.clock() - self.due()
+        allowed = self.max_catch_up * frames / self.framerate
+        if late > allowed:
+            # Too far behind to catch up: start the schedule over from here
+            self.origin += late - allowed
+            self.slips += 1
+            self.slipped += late - allowed
+            late = allowed
+        late = max(late, 0.0)
+        self.lateness.append(late)
+        self.wakeups += 1
+        return late
+
+    def advance(self, frames):
+        """Count frames as sent, moving the next deadline on"""
+        self.samples += frames
+
+    def position(self):
+        """Seconds of the track sent since the clock started"""
+        return self.samples / self.framerate
+
+    def drift(self):
+        """How far the stream has fallen behind real time since the clock started, in seconds:
+        the schedule slips plus how late the last wakeup was"""
+        return self.slipped + (self.lateness[-1] if self.lateness else 0.0)
+
+    def stats(self):
+        """Wakeup lateness over recent chunks and drift (ms), and schedule slips, or {} before the first wakeup"""
+        late = sorted(self.lateness)
+        if not late:
+            return {}
+        return {"wakeups": self.wakeups, "p50": late[len(late) // 2] * 1000,
+                "p99": late[min(len(late) - 1, len(late) * 99 // 100)] * 1000, "max": late[-1] * 1000,
+                "slips": self.slips, "slipped": self.slipped, "drift": self.drift() * 1000}
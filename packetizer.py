@@ -0,0 +1,153 @@
+# packetizer.py - Latency profiles and MTU-sized AUDIO packetization for the broadcast engine
+import math
+
+from protocol import PacketBuffer, FecEncoder, AUDIO_HEADER, SEQUENCE_MASK
+from fanout import BatchSender
+
+
+# Latency profiles: frames of audio sent per wakeup. low-latency is the
+# original one-chunk-per-packet stream; efficient sends 46 ms at a time in
+# as few MTU-sized packets as possible.
+PROFILES = {
+    "low-latency": 256,
+    "efficient": 2048,
+}
+DEFAULT_PROFILE = "low-latency"
+
+# IPv4 + UDP headers
+IP_UDP_OVERHEAD = 28
+MIN_MTU = 576
+MAX_MTU = 9000
+# Larger groups outlast what the client keeps for recovery
+MAX_FEC_GROUP = 32
+
+
+class Substream:
+    """One encoded stream: a codec, a latency profile and its own sequence numbers.
+
+    Audio is collected until a profile's worth of frames is available, then
+    cut into blocks that each encode to a single AUDIO frame filling at most
+    one MTU-sized datagram; flush() sends what is left at the end of a track. Every listener on the substream gets the same
+    packets from one BatchSender. With fec_group set, an XOR parity frame
+    follows every fec_group packets, sent only to listeners that asked for
+    it; it fits the same MTU because its header plus trailer is no larger
+    than the AUDIO header. With history set, the last history packets are
+    kept, one copy each whoever they went to, so they can be sent again
+    to listeners that NACK them. Each is copied into a reused slot of the
+    history ring, so keeping them allocates nothing once the ring is full.
+    """
+
+    def __init__(self, sock, codec, profile, mtu, fanout_mode="auto", fec_group=0, history=0):
+        self.codec = codec
+        self.profile = profile
+        self.frames = PROFILES[profile]
+        self.budget = mtu - IP_UDP_OVERHEAD - AUDIO_HEADER.size
+        self.fanout = BatchSender(sock, fanout_mode)
+        self.parity_fanout = BatchSender(sock, fanout_mode)
+        self.fec = FecEncoder(fec_group, codec.id) if fec_group else None
+        # History ring: packet bytes, sequence number (None while being
+        # written) and length per slot; slots are allocated on first use
+        self.history = [None] * history
+        self.history_seqs = [None] * history
+        self.history_lengths = [0] * history
+        self.packet_buffer = PacketBuffer(self.budget)
+        self.sequence = 0
+        # Encoded size / PCM size of recent blocks, used to guess block sizes
+        self.ratio = 1.0
+        self.channels = 2
+        self.bytes_per_frame = 4
+        self.pending = bytearray()
+        self.pending_pos = 0
+
+    def set_destinations(self, destinations, parity_destinations=()):
+        self.fanout.set_destinations(destinations)
+        self.parity_fanout.set_destinations(list(parity_destinations) if self.fec else [])
+
+    def recent_packet(self, seq):
+        """A copy of a packet still in the history ring, or None (safe from any thread)"""
+        if not self.history:
+            return None
+        slot = seq % len(self.history)
+        if self.history_seqs[slot] != seq:
+            return None
+        packet = bytes(memoryview(self.history[slot])[:self.history_lengths[slot]])
+        # The broadcaster may have reused the slot while we copied it
+        if self.history_seqs[slot] != seq:
+            return None
+        return packet
+
+    def remember(self, packet):
+        """Copy a sent packet into its slot of the history ring"""
+        slot = self.sequence % len(self.history)
+        buffer = self.history[slot]
+        if buffer is None or len(buffer) < len(packet):
+            buffer = self.history[slot] = bytearray(max(len(packet), len(self.packet_buffer.buffer)))
+        self.history_seqs[slot] = None
+        buffer[:len(packet)] = packet
+        self.history_lengths[slot] = len(packet)
+        self.history_seqs[slot] = self.sequence
+
+    def start_track(self, channels, bytes_per_frame):
+        self.channels = channels
+        self.bytes_per_frame = bytes_per_frame
+        self.pending.clear()
+
+    def send(self, audio_data, sample_pos):
+        """Queue a chunk from the reader, sending whatever is complete"""
+        unit = self.frames * self.bytes_per_frame
+        if not self.pending and len(audio_data) == unit:
+            self.send_unit(audio_data, sample_pos)
+            return
+
+        # A gap (new track, seek, or nobody listening for a while) drops the
+        # incomplete unit rather than splicing unrelated audio together
+        if self.pending and sample_pos != self.pending_pos + len(self.pending) // self.bytes_per_frame:
+            self.pending.clear()
+        if not self.pending:
+            self.pending_pos = sample_pos
+        self.pending += audio_data
+
+        while len(self.pending) >= unit:
+            self.send_unit(memoryview(self.pending)[:unit], self.pending_pos)
+            del self.pending[:unit]
+            self.pending_pos += self.frames
+
+    def flush(self):
+        """Send the incomplete unit left at the end of a track as a short final unit"""
+        if self.pending:
+            self.send_unit(memoryview(self.pending), self.pending_pos)
+            self.pending.clear()
+
+    def send_unit(self, audio_data, sample_pos):
+        """Split a unit into as few blocks as should fit the MTU and send them"""
+        frames = len(audio_data) // self.bytes_per_frame
+        blocks = max(1, math.ceil(len(audio_data) * self.ratio / self.budget))
+        if blocks == 1:
+            self.send_block(audio_data, sample_pos)
+            return
+        block_frames = math.ceil(frames / blocks)
+        for start in range(0, frames, block_frames):
+            end = min(start + block_frames, frames)
+            self.send_block(audio_data[start * self.bytes_per_frame:end * self.bytes_per_frame],
+                            sample_pos + start)
+
+    def send_block(self, audio_data, sample_pos):
+        payload = self.codec.encode(audio_data, self.channels)
+        frames = len(audio_data) // self.bytes_per_frame
+        if len(payload) > self.budget and frames > 1:
+            # Compressed worse than expected: halve the block
+            half = frames // 2
+            self.send_block(audio_data[:half * self.bytes_per_frame], sample_pos)
+            self.send_block(audio_data[half * self.bytes_per_frame:], sample_pos + half)
+            return
+
+        self.ratio = 0.8 * self.ratio + 0.2 * len(payload) / len(audio_data)
+        packet = self.packet_buffer.fill(payload, self.sequence, sample_pos, self.codec.id)
+        self.fanout.send(packet)
+        if self.history:
+            self.remember(packet)
+        if self.parity_fanout.destinations:
+            parity = self.fec.add(self.sequence, sample_pos, payload)
+            if parity:
+                self.parity_fanout.send(parity)
+        self.sequence = (self.sequence + 1) & SEQUENCE_MASK
@@ -0,0 +1,423 @@
+# protocol.py - Wire format shared by the broadcast engine and the radio client
+import struct
+from collections import deque
+
+
+# AUDIO frame: magic, header version, codec id of the payload, per-stream
+# sequence number, position of the first frame in samples since track start,
+# payload length
+AUDIO_HEADER = struct.Struct('!5sBBIQI')
+AUDIO_VERSION = 2
+SEQUENCE_MASK = 0xFFFFFFFF
+
+# JSON frame: magic, payload length
+JSON_HEADER = struct.Struct('!4sI')
+
+# FEC frame: magic, version, codec id of the covered packets, sequence
+# number of the first AUDIO packet covered, number of packets covered,
+# payload length. The payload is the XOR of the covered packets, each as
+# payload + FEC_TRAILER, right-aligned.
+FEC_HEADER = struct.Struct('!3sBBIBH')
+FEC_VERSION = 2
+FEC_TRAILER = struct.Struct('!QH')
+
+FRAME_AUDIO = 1
+FRAME_JSON = 2
+FRAME_FEC = 3
+
+# NACK (client to server): b'nack' followed by up to MAX_NACK sequence
+# numbers, each '!I', of AUDIO packets to send again
+MAX_NACK = 64
+
+
+def sequence_distance(seq, reference):
+    """Signed distance from reference to seq, allowing for wrap-around"""
+    distance = (seq - reference) & SEQUENCE_MASK
+    if distance >= 0x80000000:
+        distance -= 0x100000000
+    return distance
+
+
+class PacketBuffer:
+    """Reusable AUDIO packet buffer.
+
+    The header is packed in place and each chunk is copied in once, however
+    many listeners it is sent to. The view returned for each packet size is
+    made once and reused, so building a packet allocates nothing.
+    """
+
+    def __init__(self, capacity=0):
+        self.buffer = bytearray(AUDIO_HEADER.size + capacity)
+        self.view = memoryview(self.buffer)
+        # Packet size -> view of that many bytes of buffer
+        self.views = {len(self.buffer): self.buffer}
+
+    def fill(self, payload, seq=0, sample_pos=0, codec_id=0):
+        """Write header and payload, returning the packet to send (valid until the next fill)"""
+        size = AUDIO_HEADER.size + len(payload)
+        if size > len(self.buffer):
+            self.buffer = bytearray(size)
+            self.view = memoryview(self.buffer)
+            self.views = {size: self.buffer}
+
+        AUDIO_HEADER.pack_into(self.buffer, 0, b'AUDIO', AUDIO_VERSION, codec_id,
+                               seq & SEQUENCE_MASK, sample_pos, len(payload))
+        self.view[AUDIO_HEADER.size:size] = payload
+
+        packet = self.views.get(size)
+        if packet is None:
+            packet = self.views[size] = self.view[:size]
+        return packet
+
+
+def parse_frames(buffer, view, length):
+    """Return (kind, codec_id, seq, sample_pos, payload) for each frame in a datagram.
+
+    buffer holds the datagram in its first length bytes and view is a
+    memoryview of it; payloads are slices of view, so nothing is copied.
+    For FEC frames seq and sample_pos are the first sequence number and
+    the number of packets covered; JSON frames have codec_id 0. Parsing
+    stops at the first truncated or unknown frame.
+    """
+    frames = []
+    offset = 0
+    while offset < length:
+        if buffer.startswith(b'AUDIO', offset):
+            if length - offset < AUDIO_HEADER.size:
+                break
+            _, version, codec_id, seq, sample_pos, data_len = AUDIO_HEADER.unpack_from(buffer, offset)
+            start = offset + AUDIO_HEADER.size
+            end = start + data_len
+            if version != AUDIO_VERSION or end > length:
+                break
+            frames.append((FRAME_AUDIO, codec_id, seq, sample_pos, view[start:end]))
+
+        elif buffer.startswith(b'JSON', offset):
+            if length - offset < JSON_HEADER.size:
+                break
+            _, data_len = JSON_HEADER.unpack_from(buffer, offset)
+            start = offset + JSON_HEADER.size
+            end = start + data_len
+            if end > length:
+                break
+            frames.append((FRAME_JSON, 0, 0, 0, view[start:end]))
+
+        elif buffer.startswith(b'FEC', offset):
+            if length - offset < FEC_HEADER.size:
+                break
+            _, version, codec_id, first, count, data_len = FEC_HEADER.unpack_from(buffer, offset)
+            start = offset + FEC_HEADER.size
+            end = start + data_len
+            if version != FEC_VERSION or end > length:
+                break
+            frames.append((FRAME_FEC, codec_id, first, count, view[start:end]))
+
+        else:
+            break
+
+        offset = end
+    return frames
+
+
+class DatagramReader:
+    """Receives datagrams into a ring of preallocated buffers.
+
+    Each datagram lands in the next slot with recv_into, and the payloads
+    returned by receive() point into that slot. A slot is only reused
+    after slots - 1 further datagrams, so payloads stay valid that long;
+    anything kept for longer, such as the playback queue, must be copied.
+    """
+
+    # Room for a full datagram at the largest MTU the engine accepts (9000)
+    def __init__(self, sock, slots=128, slot_size=9000):
+        self.sock = sock
+        self.buffers = [bytearray(slot_size) for _ in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.slot = 0
+        self.datagrams = 0
+
+    def receive(self):
+        """Block for the next datagram, returning the frames in it"""
+        slot = self.slot + 1
+        if slot == len(self.buffers):
+            slot = 0
+        self.slot = slot
+        buffer = self.buffers[slot]
+        length = self.sock.recv_into(buffer)
+        self.datagrams += 1
+        return parse_frames(buffer, self.views[slot], length)
+
+
+def nack_message(seqs):
+    """Build a retransmission request for the given sequence numbers"""
+    seqs = seqs[:MAX_NACK]
+    return b'nack' + struct.pack(f'!{len(seqs)}I', *seqs)
+
+
+def parse_nack(data):
+    """Sequence numbers requested by a NACK datagram"""
+    count = min((len(data) - 4) // 4, MAX_NACK)
+    return struct.unpack_from(f'!{count}I', data, 4)
+
+
+class NackTracker:
+    """Decides which missing packets to ask the server for on the client.
+
+    Each missing packet is requested at most attempts times, retry_after
+    seconds apart, and forgotten once it arrives or is given up on.
+    """
+
+    def __init__(self, retry_after=0.08, attempts=2):
+        self.retry_after = retry_after
+        self.attempts = attempts
+        self.requested = {}
+        self.sent = 0
+
+    def reset(self):
+        self.requested.clear()
+
+    def due(self, missing, now):
+        """The subset of missing to request now"""
+        requested = {}
+        due = []
+        for seq in missing:
+            when, tries = self.requested.get(seq, (0.0, 0))
+            if tries < self.attempts and now - when >= self.retry_after and len(due) < MAX_NACK:
+                when, tries = now, tries + 1
+                due.append(seq)
+            requested[seq] = (when, tries)
+        self.requested = requested
+        self.sent += len(due)
+        return due
+
+
+def fec_item(sample_pos, payload):
+    """One AUDIO packet as the integer that goes into the parity XOR"""
+    trailer = int.from_bytes(FEC_TRAILER.pack(sample_pos, len(payload)), 'big')
+    return int.from_bytes(payload, 'big') << (8 * FEC_TRAILER.size) | trailer
+
+
+class FecEncoder:
+    """Builds one XOR parity frame for every group of AUDIO packets.
+
+    Any single packet lost from a group can be rebuilt from the others and
+    the parity, at a bandwidth cost of one frame per group.
+    """
+
+    def __init__(self, group, codec_id=0):
+        self.group = group
+        self.codec_id = codec_id
+        self.reset()
+
+    def reset(self):
+        self.first = None
+        self.count = 0
+        self.parity = 0
+        self.length = 0
+
+    def add(self, seq, sample_pos, payload):
+        """Account for a sent packet, returning the parity frame when a group is complete"""
+        if self.count and seq != (self.first + self.count) & SEQUENCE_MASK:
+            self.reset()  # packets were sent without us: the group would not add up
+        if self.count == 0:
+            self.first = seq
+        self.parity ^= fec_item(sample_pos, payload)
+        self.length = max(self.length, len(payload) + FEC_TRAILER.size)
+        self.count += 1
+        if self.count < self.group:
+            return None
+
+        frame = (FEC_HEADER.pack(b'FEC', FEC_VERSION, self.codec_id, self.first, self.count, self.length)
+                 + self.parity.to_bytes(self.length, 'big'))
+        self.reset()
+        return frame
+
+
+class FecDecoder:
+    """Rebuilds lost AUDIO packets from XOR parity on the client.
+
+    Remembers recently received packets and parity frames. Once a group's
+    parity has arrived and exactly one of its packets is missing, that
+    packet is rebuilt. Feed packets in before the reorder buffer so
+    recovered ones are put back in sequence with the rest. Payloads may
+    point into a DatagramReader ring, so history must stay well below its
+    slot count.
+    """
+
+    def __init__(self, history=64):
+        self.received = {}
+        self.order = deque(maxlen=history)
+        self.parity = {}
+        self.recovered = 0
+
+    def reset(self):
+        self.received.clear()
+        self.order.clear()
+        self.parity.clear()
+
+    def add_audio(self, seq, sample_pos, payload):
+        """Remember a received packet, returning any packets it lets us recover"""
+        if seq in self.received:
+            return []
+        self.remember(seq, sample_pos, payload)
+
+        recovered = []
+        for first, (count, _, _) in list(self.parity.items()):
+            if 0 <= sequence_distance(seq, first) < count:
+                recovered += self.recover(first)
+        return recovered
+
+    def add_parity(self, first, count, payload):
+        """Remember a parity frame, returning the packet it recovers, if any"""
+        if count == 0 or first in self.parity:
+            return []
+        # Forget parity for groups too old to be completed
+        for old in [f for f in self.parity if sequence_distance(first, f) > self.order.maxlen]:
+            del self.parity[old]
+        self.parity[first] = (count, len(payload), int.from_bytes(payload, 'big'))
+        return self.recover(first)
+
+    def recover(self, first):
+        count, length, parity = self.parity[first]
+        missing = None
+        for i in range(count):
+            seq = (first + i) & SEQUENCE_MASK
+            packet = self.received.get(seq)
+            if packet is None:
+                if missing is not None:
+                    return []  # two or more missing: wait for retransmission or give up
+                missing = seq
+            else:
+                parity ^= fec_item(*packet)
+
+        del self.parity[first]
+        if missing is None:
+            return []
+
+        item = parity.to_bytes(length, 'big')
+        sample_pos, data_len = FEC_TRAILER.unpack_from(item, length - FEC_TRAILER.size)
+        if data_len > length - FEC_TRAILER.size:
+            return []
+        payload = item[length - FEC_TRAILER.size - data_len:length - FEC_TRAILER.size]
+        self.recovered += 1
+        self.remember(missing, sample_pos, payload)
+        return [(missing, sample_pos, payload)]
+
+    def remember(self, seq, sample_pos, payload):
+        if len(self.order) == self.order.maxlen:
+            self.received.pop(self.order[0], None)
+        self.order.append(seq)
+        self.received[seq] = (sample_pos, payload)
+
+
+class ReorderBuffer:
+    """Puts AUDIO packets back in sequence order on the client.
+
+    Packets are held until the gap before them is filled or more than depth
+    packets are waiting, at which point the missing ones are counted as lost.
+    Duplicates and packets that arrive after their slot was skipped are
+    dropped.
+    """
+
+    # A jump larger than this is a new stream, not loss
+    RESYNC_DISTANCE = 1000
+
+    def __init__(self, depth=8):
+        self.depth = depth
+        self.pending = {}
+        self.recent = deque(maxlen=64)
+        self.recent_set = set()
+        self.reset()
+        self.reset_stats()
+
+    def reset(self):
+        """Forget the stream position (new track or reconnect)"""
+        self.next_seq = None
+        self.pending.clear()
+        self.recent.clear()
+        self.recent_set.clear()
+
+    def reset_stats(self):
+        self.received = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.late = 0
+        self.lost = 0
+
+    def push(self, seq, sample_pos, payload):
+        """Add a packet, returning the (seq, sample_pos, payload) now ready to play"""
+        self.received += 1
+
+        if self.next_seq is None:
+            self.next_seq = seq
+
+        distance = sequence_distance(seq, self.next_seq)
+        if abs(distance) > self.RESYNC_DISTANCE:
+            ready = self.flush()
+            self.next_seq = seq
+            distance = 0
+        else:
+            ready = []
+
+        if distance < 0:
+            if seq in self.recent_set:
+                self.duplicates += 1
+            else:
+                self.late += 1
+            return ready
+
+        if seq in self.pending:
+            self.duplicates += 1
+            return ready
+
+        if self.pending and distance < max(sequence_distance(s, self.next_seq) for s in self.pending):
+            self.reordered += 1
+
+        self.pending[seq] = (seq, sample_pos, payload)
+        self.release(ready)
+
+        if len(self.pending) > self.depth:
+            # Give up on the gap: skip ahead to the oldest packet we hold
+            oldest = min(self.pending, key=lambda s: sequence_distance(s, self.next_seq))
+            self.lost += sequence_distance(oldest, self.next_seq)
+            self.next_seq = oldest
+            self.release(ready)
+
+        return ready
+
+    def release(self, ready):
+        while self.next_seq in self.pending:
+            packet = self.pending.pop(self.next_seq)
+            ready.append(packet)
+            self.remember(self.next_seq)
+            self.next_seq = (self.next_seq + 1) & SEQUENCE_MASK
+
+    def flush(self):
+        """Return everything held, in order, without waiting for gaps"""
+        ready = []
+        while self.pending:
+            oldest = min(self.pending, key=lambda s: sequence_distance(s, self.next_seq))
+            self.lost += sequence_distance(oldest, self.next_seq)
+            self.next_seq = oldest
+            self.release(ready)
+        return ready
+
+    def remember(self, seq):
+        self.delivered += 1
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_set.discard(self.recent[0])
+        self.recent.append(seq)
+        self.recent_set.add(seq)
+
+    def missing(self):
+        """Sequence numbers in the gaps before the packets being held"""
+        if not self.pending:
+            return []
+        span = max(sequence_distance(s, self.next_seq) for s in self.pending)
+        return [seq for seq in ((self.next_seq + i) & SEQUENCE_MASK for i in range(span))
+                if seq not in self.pending]
+
+    def loss_rate(self):
+        expected = self.delivered + self.lost
+        return self.lost / expected if expected else 0.0
@@ -0,0 +1,35 @@
+# ratelimit.py - Token buckets for per-listener and per-station rate limits
+import time
+
+
+class TokenBucket:
+    """Allows rate events per second on average, with bursts of up to burst.
+
+    Not thread-safe: each bucket is used from one thread (the control
+    plane loop), so take() stays a few float operations.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if now is None:
+            now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now=None, count=1):
+        """Spend count tokens if available, returning whether the event is allowed"""
+        self.refill(now)
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
+
+    def ready(self, now=None, count=1):
+        """Whether take(count) would succeed, without spending anything"""
+        self.refill(now)
+        return self.tokens >= count
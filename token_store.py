@@ -0,0 +1,98 @@
+# token_store.py - Expiring, size-capped session token store for the login server
+import heapq
+import threading
+import time
+from collections import OrderedDict
+
+
+class TokenStore:
+    """Session entries by token index, each expiring ttl seconds after it was issued.
+
+    Used like the dict it replaces (store[index] = entry, get, in, len).
+    Expiry times are kept in a heap, so dropping expired sessions costs
+    O(log n) each. When capacity is reached, the least recently used
+    session is dropped to make room. Safe to use from the login threads
+    and the engine's control plane at once.
+    """
+
+    def __init__(self, ttl, capacity=100000):
+        self.ttl = ttl
+        self.capacity = capacity
+        # index -> (expires, entry), least recently used first
+        self.entries = OrderedDict()
+        # (expires, index); items for replaced or evicted sessions are skipped when popped
+        self.expiry = []
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __setitem__(self, index, entry):
+        now = time.monotonic()
+        with self.lock:
+            self.purge(now)
+            if index in self.entries:
+                del self.entries[index]
+            elif len(self.entries) >= self.capacity:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+            expires = now + self.ttl
+            self.entries[index] = (expires, entry)
+            heapq.heappush(self.expiry, (expires, index))
+            self.issued += 1
+
+            if len(self.expiry) > 2 * len(self.entries) + 1024:
+                # Mostly stale items (LRU evictions, replaced indexes): rebuild
+                self.expiry = [(expires, index) for index, (expires, _) in self.entries.items()]
+                heapq.heapify(self.expiry)
+
+    def get(self, index, default=None):
+        """The live entry for index, or default; counts as a use for LRU"""
+        with self.lock:
+            item = self.entries.get(index)
+            if item is None:
+                return default
+            if item[0] <= time.monotonic():
+                del self.entries[index]
+                self.expired += 1
+                return default
+            self.entries.move_to_end(index)
+            return item[1]
+
+    def __getitem__(self, index):
+        entry = self.get(index)
+        if entry is None:
+            raise KeyError(index)
+        return entry
+
+    def __contains__(self, index):
+        return self.get(index) is not None
+
+    def __len__(self):
+        with self.lock:
+            self.purge(time.monotonic())
+            return len(self.entries)
+
+    def pop(self, index, default=None):
+        """Remove and return the live entry for index, or default"""
+        with self.lock:
+            item = self.entries.pop(index, None)
+            if item is not None and item[0] <= time.monotonic():
+                self.expired += 1
+                item = None
+        return default if item is None else item[1]
+
+    def purge(self, now):
+        """Drop sessions whose time is up (call with the lock held)"""
+        heap = self.expiry
+        while heap and heap[0][0] <= now:
+            expires, index = heapq.heappop(heap)
+            item = self.entries.get(index)
+            if item is not None and item[0] == expires:
+                del self.entries[index]
+                self.expired += 1
+
+    def stats(self):
+        """Counters for the server log"""
+        return {"live": len(self), "issued": self.issued, "expired": self.expired, "evicted": self.evicted}
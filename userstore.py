@@ -0,0 +1,78 @@
+# userstore.py - SQLite user database for the login server
+import os
+import shelve
+import sqlite3
+import threading
+
+
+SCHEMA_VERSION = 1
+
+
+class UserStore:
+    """Usernames and bcrypt hashes in SQLite, opened once per thread.
+
+    WAL mode lets logins read while a registration writes, so nothing is
+    serialized beyond SQLite's own single writer. Each thread keeps its own
+    connection, and with it sqlite3's cache of prepared statements.
+    """
+
+    def __init__(self, path, legacy_shelve=None):
+        self.path = path
+        self.local = threading.local()
+        self.migrated = 0
+        self.setup(legacy_shelve)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def setup(self, legacy_shelve):
+        """Create the schema, importing users from the old shelve database the first time"""
+        conn = self.connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                         "username TEXT PRIMARY KEY, password_hash BLOB NOT NULL)")
+            if legacy_shelve:
+                for username, hashed in read_shelve(legacy_shelve):
+                    cursor = conn.execute("INSERT OR IGNORE INTO users VALUES (?, ?)", (username, hashed))
+                    self.migrated += cursor.rowcount
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_hash(self, username):
+        """The stored bcrypt hash for username, or None"""
+        row = self.connection().execute("SELECT password_hash FROM users WHERE username = ?",
+                                        (username,)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def exists(self, username):
+        return self.connection().execute("SELECT 1 FROM users WHERE username = ?",
+                                         (username,)).fetchone() is not None
+
+    def add_user(self, username, hashed):
+        """Store a new user, returning False if the name is already taken"""
+        cursor = self.connection().execute("INSERT OR IGNORE INTO users VALUES (?, ?)", (username, hashed))
+        return cursor.rowcount == 1
+
+    def count(self):
+        return self.connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def read_shelve(path):
+    """(username, hash) pairs from the shelve database used before SQLite"""
+    if not any(os.path.exists(path + suffix) for suffix in ("", ".dat", ".db")):
+        return []
+    with shelve.open(path, flag='r') as db:
+        return [(username, db[username]) for username in db.keys()]
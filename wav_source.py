@@ -0,0 +1,122 @@
+# wav_source.py - On-demand PCM access to WAV files for the broadcast engine
+import mmap
+import struct
+import wave
+
+
+# Pages behind the read position are handed back to the OS in blocks of this size
+RELEASE_BYTES = 1 << 20
+
+
+def find_data_chunk(f):
+    """Return (offset, size) of the data chunk of an open RIFF/WAVE file"""
+    f.seek(0)
+    riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave_id != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("WAV file has no data chunk")
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'data':
+            return f.tell(), chunk_size
+        # Chunks are padded to an even number of bytes
+        f.seek(chunk_size + (chunk_size & 1), 1)
+
+
+class WavSource:
+    """Streams the PCM data of a WAV file without loading it into memory.
+
+    The data chunk is memory-mapped and pages that have already been
+    broadcast are released, so resident memory stays constant regardless of
+    track length. If the file cannot be mapped, frames are read incrementally.
+    """
+
+    def __init__(self, filename):
+        with wave.open(filename, 'rb') as wf:
+            self.params = wf.getparams()
+
+        self.file = open(filename, 'rb')
+        self.map = None
+        self.view = None
+        self.position = 0
+        self.released = 0
+
+        try:
+            self.data_offset, data_size = find_data_chunk(self.file)
+            bytes_per_frame = self.params.nchannels * self.params.sampwidth
+            self.size = min(data_size, self.params.nframes * bytes_per_frame)
+
+            try:
+                self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self.map, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    self.map.madvise(mmap.MADV_SEQUENTIAL)
+                self.view = memoryview(self.map)
+            except (ValueError, OSError):
+                # Not mappable (e.g. special file system), fall back to reads
+                self.map = None
+        except Exception:
+            self.file.close()
+            raise
+
+    def __len__(self):
+        return self.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def remaining(self):
+        return self.size - self.position
+
+    def read(self, nbytes):
+        """Return the next nbytes of PCM data (less at the end of the track).
+
+        With a mapped file the result is a read-only memoryview into the
+        mapping, so no bytes are copied.
+        """
+        end = min(self.position + nbytes, self.size)
+        start = self.data_offset + self.position
+
+        if self.map is not None:
+            data = self.view[start:self.data_offset + end]
+            if start - self.released >= RELEASE_BYTES:
+                self.release_pages(start)
+        else:
+            self.file.seek(start)
+            data = self.file.read(end - self.position)
+
+        self.position = end
+        return data
+
+    def release_pages(self, upto):
+        """Drop mapped pages before file offset upto from the resident set"""
+        upto -= upto % mmap.PAGESIZE
+        if upto > self.released and hasattr(mmap, 'MADV_DONTNEED'):
+            try:
+                self.map.madvise(mmap.MADV_DONTNEED, self.released, upto - self.released)
+            except OSError:
+                pass
+        self.released = max(self.released, upto)
+
+    def seek(self, position):
+        """Move to a byte position inside the data chunk"""
+        self.position = max(0, min(position, self.size))
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.view.release()
+                self.map.close()
+            except BufferError:
+                # A chunk is still queued somewhere; the mapping is closed
+                # when the last view into it is garbage collected
+                pass
+            self.view = None
+            self.map = None
+        self.file.close()